@@ -0,0 +1,52 @@
+"""
+Measure the time it takes to ``import ilastikrag`` in a fresh interpreter,
+and check which of the heavy dependencies were imported along with it.
+
+Usage: python benchmarks/benchmark_import.py [--repeats N] [--statement 'import ilastikrag']
+"""
+import sys
+import json
+import argparse
+import subprocess
+
+HEAVY_MODULES = ['pandas', 'vigra', 'h5py', 'networkx', 'PyQt4']
+
+MEASURE_SCRIPT = """\
+import sys, time, json
+start = time.time()
+{statement}
+duration = time.time() - start
+print json.dumps({{ 'seconds': duration, 'loaded': [m for m in {heavy_modules!r} if m in sys.modules] }})
+"""
+
+def measure_import(statement='import ilastikrag', repeats=5):
+    """
+    Run the given import statement in ``repeats`` fresh interpreters.
+
+    Returns
+    -------
+    *dict* with the ``min`` and ``median`` import time (in seconds) and the list of heavy modules
+    that the statement ``loaded``.
+    """
+    script = MEASURE_SCRIPT.format(statement=statement, heavy_modules=HEAVY_MODULES)
+    durations = []
+    for _ in range(repeats):
+        output = subprocess.check_output([sys.executable, '-c', script])
+        result = json.loads(output.splitlines()[-1])
+        durations.append(result['seconds'])
+
+    durations.sort()
+    return { 'statement': statement,
+             'min': durations[0],
+             'median': durations[len(durations)//2],
+             'loaded': result['loaded'] }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--statement', default='import ilastikrag')
+    args = parser.parse_args()
+
+    result = measure_import(args.statement, args.repeats)
+    print "{statement}: min {min:.3f}s, median {median:.3f}s".format(**result)
+    print "Heavy modules loaded: {}".format( ', '.join(result['loaded']) or '(none)' )
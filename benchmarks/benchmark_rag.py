@@ -0,0 +1,260 @@
+"""
+Benchmark Rag construction, feature computation (with each registered accumulator),
+serialization, and groundtruth mapping on synthetic superpixel volumes.
+
+The volumes are generated with :py:func:`ilastikrag.util.generate_random_voronoi`, for every combination
+of the requested volume shapes and superpixel counts.  The wall time, CPU time, and peak memory
+(the growth of the process's resident memory while the stage runs) of each stage are printed,
+and written to a JSON file, which can be compared with the results of another commit (``--compare``).
+
+Usage: python benchmarks/benchmark_rag.py [--shapes 64,256,256 128,512,512] [--num-sp 1000 10000]
+                                          [--flat] [--edge-roughness 0.0] [--output results.json]
+                                          [--profile] [--compare baseline.json]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+from collections import OrderedDict
+
+import numpy as np
+
+from ilastikrag.profiling import Profile
+
+logger = logging.getLogger('benchmark_rag')
+
+def measure(func, repeats=1):
+    """
+    Call ``func()`` ``repeats`` times, each time as the only stage of a new
+    :py:class:`~ilastikrag.profiling.Profile`.
+
+    Returns
+    -------
+    ``(result, measurements)``
+        The result of the last call, and a dict of the ``seconds`` (wall time) and ``cpu_seconds``
+        of the fastest call, and the largest ``peak_mb`` of all calls.
+    """
+    measurements = { 'seconds': None, 'cpu_seconds': None, 'peak_mb': None }
+    for _ in range(repeats):
+        result = None # Release the previous result before measuring again.
+        profile = Profile('measure')
+        profile.start()
+        try:
+            with profile.stage('measure'):
+                result = func()
+        finally:
+            profile.stop()
+
+        stats = profile['measure']
+        if measurements['seconds'] is None or stats.wall_seconds < measurements['seconds']:
+            measurements['seconds'] = stats.wall_seconds
+            measurements['cpu_seconds'] = stats.cpu_seconds
+        if stats.peak_mb is not None and stats.peak_mb > measurements['peak_mb']:
+            measurements['peak_mb'] = stats.peak_mb
+    return result, measurements
+
+def accumulator_feature_groups(rag):
+    """
+    Return an OrderedDict of { 'accumulatorid_type' : (edge_group, feature_names) } for every registered
+    accumulator that supports the given rag, where feature_names is the accumulator's full feature set.
+    """
+    from ilastikrag import Rag
+    from ilastikrag.accumulators.registry import cached_supported_features
+
+    feature_groups = OrderedDict()
+    for (acc_id, acc_type) in sorted(Rag.DEFAULT_ACCUMULATOR_CLASSES.keys()):
+        feature_names = cached_supported_features(Rag.DEFAULT_ACCUMULATOR_CLASSES[(acc_id, acc_type)], rag)
+
+        # Skip names that are covered by a shorter name, e.g. 'standard_edge_quantiles_25'
+        feature_names = [ name for name in feature_names
+                          if not any(name.startswith(other + '_') for other in feature_names) ]
+        if not feature_names:
+            continue
+
+        if acc_type == 'flatedge':
+            edge_group = 'z'
+        elif rag.flat_superpixels:
+            edge_group = 'yx'
+        else:
+            edge_group = None
+        feature_groups['{}_{}'.format(acc_id, acc_type)] = (edge_group, feature_names)
+    return feature_groups
+
+def benchmark_case(shape, num_sp, flat_superpixels=False, edge_roughness=0.0, repeats=1, seed=0, stages=None,
+                   profile=False):
+    """
+    Benchmark each stage on a synthetic volume of the given shape and number of superpixels.
+    If ``profile`` is True, the construction and accumulator results also include
+    the breakdown of ``rag.last_profile`` (see :py:class:`ilastikrag.profiling.Profile`).
+
+    Returns
+    -------
+    *list* of result *dicts*, one per stage.
+    """
+    import h5py
+    import vigra
+    from ilastikrag import Rag
+    from ilastikrag.util import generate_random_voronoi
+
+    random = np.random.RandomState(seed)
+    superpixels = generate_random_voronoi(shape, num_sp, flat_superpixels, edge_roughness, seed=random)
+    groundtruth = generate_random_voronoi(shape, max(1, num_sp // 10), seed=random)
+    values = vigra.taggedView( random.random_sample(shape).astype(np.float32), superpixels.axistags )
+
+    case = OrderedDict([ ('shape', list(shape)),
+                         ('num_sp', num_sp),
+                         ('flat_superpixels', flat_superpixels),
+                         ('edge_roughness', edge_roughness) ])
+    results = []
+    def run(stage, func, profiled_rag=None):
+        if stages and not any(stage.startswith(s) for s in stages):
+            return None
+        result, measurements = measure(func, repeats)
+        row = OrderedDict(case)
+        row['stage'] = stage
+        row.update(measurements)
+        if profile:
+            last_profile = (profiled_rag or result).last_profile
+            row['profile'] = OrderedDict( (path, stats._asdict()) for path, stats in last_profile.stages.items() )
+        results.append(row)
+        logger.info("{shape} {num_sp:>7} sp  {stage:<30} {seconds:8.3f}s  {peak_mb}MB".format(**row))
+        return result
+
+    construct = lambda: Rag(superpixels, flat_superpixels=flat_superpixels, profile=profile)
+    rag = run('construction', construct) or construct()
+
+    # Record the size of the graph with each result
+    case['num_edges'] = rag.num_edges
+    case['num_pixel_edges'] = sum( len(df) for df in rag.dense_edge_tables.values() )
+    for row in results:
+        row.update( (k, case[k]) for k in ('num_edges', 'num_pixel_edges') )
+
+    for acc_name, (edge_group, feature_names) in accumulator_feature_groups(rag).items():
+        run('accumulator:' + acc_name, lambda: rag.compute_features(values, feature_names, edge_group=edge_group),
+            profiled_rag=rag)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        h5_path = os.path.join(tmp_dir, 'rag.h5')
+        compact_h5_path = os.path.join(tmp_dir, 'rag_compact.h5')
+        def serialize(path, **kwargs):
+            with h5py.File(path, 'w') as f:
+                rag.serialize_hdf5(f.create_group('rag'), store_labels=True, **kwargs)
+        def deserialize(path, **kwargs):
+            with h5py.File(path, 'r') as f:
+                return Rag.deserialize_hdf5(f['rag'], **kwargs)
+
+        # (The files are written even if the serialization stages were skipped, for the deserialization stages.)
+        rag.profile = False
+        run('serialize_hdf5', lambda: serialize(h5_path)) or os.path.exists(h5_path) or serialize(h5_path)
+        run('deserialize_hdf5', lambda: deserialize(h5_path))
+        run('serialize_hdf5:compact', lambda: serialize(compact_h5_path, store_dense_tables=False)) \
+            or os.path.exists(compact_h5_path) or serialize(compact_h5_path, store_dense_tables=False)
+        run('deserialize_hdf5:compact', lambda: deserialize(compact_h5_path))
+
+        rag_dir = os.path.join(tmp_dir, 'rag_dir')
+        def save():
+            shutil.rmtree(rag_dir, ignore_errors=True)
+            rag.save(rag_dir, store_labels=True)
+        run('save', save) or os.path.exists(rag_dir) or save()
+        run('load', lambda: Rag.load(rag_dir))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    run('groundtruth_mapping', lambda: rag.edge_decisions_from_groundtruth(groundtruth))
+    return results
+
+def run_benchmarks(shapes, num_sps, flat_superpixels=False, edge_roughness=0.0, repeats=1, seed=0, stages=None,
+                   profile=False):
+    """
+    Run :py:func:`benchmark_case()` for every combination of the given shapes and superpixel counts.
+
+    Returns
+    -------
+    *dict* with the benchmark ``metadata`` (versions, commit, etc.) and the list of ``results``.
+    """
+    metadata = OrderedDict()
+    metadata['date'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    metadata['commit'] = git_commit()
+    metadata['host'] = platform.node()
+    metadata['python'] = platform.python_version()
+    for module_name in ['numpy', 'pandas', 'vigra', 'h5py']:
+        module = __import__(module_name)
+        metadata[module_name] = getattr(module, '__version__', getattr(module, 'version', None))
+        if not isinstance(metadata[module_name], basestring):
+            metadata[module_name] = str(metadata[module_name])
+    metadata['repeats'] = repeats
+    metadata['seed'] = seed
+
+    results = []
+    for shape in shapes:
+        for num_sp in num_sps:
+            results += benchmark_case(shape, num_sp, flat_superpixels, edge_roughness, repeats, seed, stages, profile)
+    return OrderedDict([('metadata', metadata), ('results', results)])
+
+def git_commit():
+    """
+    Return the commit of the ilastikrag working tree (or None, if it isn't a git repo).
+    """
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=repo_dir, stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare_results(baseline, results):
+    """
+    Print the ratio of the wall times in the given results vs. the baseline results, for the common cases.
+    """
+    def key(row):
+        return (tuple(row['shape']), row['num_sp'], row['flat_superpixels'], row['edge_roughness'], row['stage'])
+    baseline_rows = { key(row) : row for row in baseline['results'] }
+
+    print "Compared to {} ({}):".format( baseline['metadata']['commit'], baseline['metadata']['date'] )
+    for row in results['results']:
+        baseline_row = baseline_rows.get(key(row))
+        if baseline_row is None or not baseline_row['seconds']:
+            continue
+        print "{shape} {num_sp:>7} sp  {stage:<30} {ratio:6.2f}x time".format( ratio=row['seconds'] / baseline_row['seconds'],
+                                                                                **row )
+
+def parse_shape(shape_str):
+    return tuple(map(int, shape_str.split(',')))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--shapes', type=parse_shape, nargs='+', default=[(64,256,256)],
+                        help="Volume shapes, e.g. 64,256,256 (2D or 3D)")
+    parser.add_argument('--num-sp', type=int, nargs='+', default=[1000, 10000],
+                        help="Superpixel counts (per slice, with --flat)")
+    parser.add_argument('--flat', action='store_true', help="Use flat superpixels")
+    parser.add_argument('--edge-roughness', type=float, default=0.0,
+                        help="Boundary roughness of the superpixels (see generate_random_voronoi())")
+    parser.add_argument('--stages', nargs='+', help="Run only the stages that start with these names")
+    parser.add_argument('--profile', action='store_true',
+                        help="Also record the per-stage breakdown (rag.last_profile) of construction and features")
+    parser.add_argument('--repeats', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help="A results file from an earlier run, to compare with")
+    args = parser.parse_args()
+
+    logger.addHandler( logging.StreamHandler(sys.stdout) )
+    logger.setLevel(logging.INFO)
+
+    results = run_benchmarks(args.shapes, args.num_sp, args.flat, args.edge_roughness, args.repeats, args.seed,
+                             args.stages, args.profile)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print "Wrote {}".format( args.output )
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare_results(json.load(f), results)
@@ -3,3 +3,10 @@ import accumulators
 from .accumulators import BaseEdgeAccumulator
 from .accumulators import BaseSpAccumulator
 from .rag import Rag
+from .feature_array import FeatureArray
+from .feature_plan import FeaturePlan
+from .feature_store import FeatureStore
+from .rag_statistics import RagStatistics
+from .profiling import Profile
+from .agglomeration import Agglomerator
+from .evaluation import SegmentationEvaluator
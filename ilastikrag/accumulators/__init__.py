@@ -1,3 +1,10 @@
 from .base import *
-from .standard import *
-from .edgeregion import *
+from .registry import AccumulatorRegistry
+
+from ..lazy_import import lazy_import
+
+# The built-in accumulators are imported on first use (e.g. via Rag.DEFAULT_ACCUMULATOR_CLASSES),
+# so that importing ilastikrag doesn't import them (or their dependencies).
+standard = lazy_import(__name__ + '.standard')
+edgeregion = lazy_import(__name__ + '.edgeregion')
+similarity = lazy_import(__name__ + '.similarity')
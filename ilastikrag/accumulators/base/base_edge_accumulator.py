@@ -56,6 +56,44 @@ class BaseEdgeAccumulator(object):
         """
         raise NotImplementedError
     
+    def requires_value_range(self):
+        """
+        Blockwise processing only.
+        Returns ``True`` if this accumulator needs the global ``(min, max)`` of the value
+        image before the first block is ingested (e.g. to fix the range of a histogram).
+        In that case, the Rag will make an extra pass over the value image to find it.
+        """
+        return False
+
+    def ingest_edges_for_block(self, rag, dense_edge_tables, edge_values, value_range):
+        """
+        Ingests the edge values for one block of the volume, and merges them with
+        the results from all previously ingested blocks.
+
+        Called by the Rag (once per block) instead of ``ingest_edges()`` if
+        ``compute_features()`` is processing the value image blockwise.
+        Subclasses must reimplement this function if they support blockwise processing.
+
+        Parameters
+        ----------
+        rag
+            *Rag*
+
+        dense_edge_tables
+            *OrderedDict* of *pandas.DataFrame*.
+            For each axis, the rows of ``rag.dense_edge_tables[k]`` that lie within this block.
+
+        edge_values
+            *OrderedDict* of 1D *ndarray*.
+            Each ndarray ``edge_values[k]`` is in the same order as ``dense_edge_tables[k]``
+
+        value_range
+            *tuple* ``(min, max)`` of the entire value image,
+            or ``None`` if ``requires_value_range()`` returned ``False``.
+        """
+        raise NotImplementedError("{} does not support blockwise processing."
+                                  .format( self.__class__.__name__ ))
+
     def append_edge_features_to_df(self, edge_df):
         """
         Called by the Rag after ``ingest_edges()``.
@@ -66,6 +104,76 @@ class BaseEdgeAccumulator(object):
         """        
         raise NotImplementedError
     
+    def output_column_names(self):
+        """
+        Called by the Rag before ``ingest_edges()``, to plan which features will be computed.
+
+        Returns the names of all the columns this accumulator can produce
+        (for the feature names it was constructed with), in the same order
+        they would be appended by ``append_edge_features_to_df()``.
+
+        Subclasses should reimplement this function (along with ``select_output_columns()``
+        and ``write_edge_features()``).
+        The base implementation returns ``None``, in which case the Rag can't plan the
+        output in advance.  It then drops any unrequested columns after calling
+        ``append_edge_features_to_df()``, and (if ``compute_features()`` was asked
+        to produce a feature array) copies the resulting columns into the array.
+        """
+        return None
+
+    def select_output_columns(self, column_names):
+        """
+        Called by the Rag before ``ingest_edges()`` (if ``output_column_names()`` is not ``None``).
+
+        Tells the accumulator which of its ``output_column_names()`` were actually requested.
+        The accumulator should compute (and append/write) only those columns,
+        skipping any statistics that aren't needed for them.
+        The selection remains in effect until this function is called again.
+        The base implementation does nothing.
+        """
+        pass
+
+    def select_edges(self, edge_labels):
+        """
+        Called by the Rag before ``ingest_edges()``/``ingest_edges_for_block()``, with the
+        ``edge_label`` of each edge that features are needed for (``compute_features(..., edges=...)``),
+        or with ``edge_labels=None`` if features are needed for all edges.
+
+        Accumulators that support edge subsets must return ``True``.  They will then be given
+        (via ``ingest_edges_for_block()``) only the edge pixels of the selected edges, and they
+        must append (or write) one row per entry of ``edge_labels``, in the same order.
+        The selection remains in effect until this function is called again.
+
+        The base implementation returns ``False``, in which case the Rag ingests
+        all edges as usual, and selects the requested rows afterwards.
+
+        Parameters
+        ----------
+        edge_labels
+            1D *ndarray* of ``edge_label`` values (i.e. row numbers of the corresponding
+            ``rag.unique_edge_tables`` table), or ``None``.
+        """
+        return False
+
+    def write_edge_features(self, edge_ids, out_columns):
+        """
+        Called by the Rag after ``ingest_edges()`` (if ``output_column_names()`` is not ``None``).
+
+        Writes the features of all ingested edges directly into the given output columns.
+
+        Parameters
+        ----------
+        edge_ids
+            *ndarray, shape=(N,2)*
+            The ``(sp1, sp2)`` pair for each output row.
+
+        out_columns
+            *OrderedDict* of ``{ column_name : 1D float32 ndarray }``.
+            The output columns to write (a subset of ``output_column_names()``),
+            each of which is a (writable) view into the preallocated feature array.
+        """
+        raise NotImplementedError
+
     def __enter__(self):
         return self
     
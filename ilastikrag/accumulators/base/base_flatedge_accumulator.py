@@ -55,6 +55,45 @@ class BaseFlatEdgeAccumulator(object):
         """
         raise NotImplementedError
     
+    def requires_value_range(self):
+        """
+        Blockwise processing only.
+        Returns ``True`` if this accumulator needs the global ``(min, max)`` of the value
+        image before the first block is ingested (e.g. to fix the range of a histogram).
+        In that case, the Rag will make an extra pass over the value image to find it.
+        """
+        return False
+
+    def ingest_values_for_block(self, rag, block_start, block_stop, value_block, value_range):
+        """
+        Ingest the pixel values for one block of slices (along the first axis) of the volume,
+        using the (flat) superpixels stored in ``rag.label_img``, and merge them with
+        the results from all previously ingested blocks.
+
+        Called by the Rag (once per block) instead of ``ingest_values()`` if
+        ``compute_features()`` is processing the value image blockwise.
+        Subclasses must reimplement this function if they support blockwise processing.
+
+        Parameters
+        ----------
+        rag
+            *Rag*
+
+        block_start, block_stop
+            *int*. The block covers slices ``[block_start, block_stop)`` of ``rag.label_img``.
+
+        value_block
+            *VigraArray*, the pixel values of slices ``[block_start, block_stop+1)``.
+            That is, the block includes one extra slice of 'halo' (except for the last block),
+            since edges along the first axis need the values on both sides.
+
+        value_range
+            *tuple* ``(min, max)`` of the entire value image,
+            or ``None`` if ``requires_value_range()`` returned ``False``.
+        """
+        raise NotImplementedError("{} does not support blockwise processing."
+                                  .format( self.__class__.__name__ ))
+
     def append_edge_features_to_df(self, edge_df):
         """
         Called by the Rag after ``ingest_values()``.
@@ -65,6 +104,76 @@ class BaseFlatEdgeAccumulator(object):
         """
         raise NotImplementedError
 
+    def output_column_names(self):
+        """
+        Called by the Rag before ``ingest_values()``, to plan which features will be computed.
+
+        Returns the names of all the columns this accumulator can produce
+        (for the feature names it was constructed with), in the same order
+        they would be appended by ``append_edge_features_to_df()``.
+
+        Subclasses should reimplement this function (along with ``select_output_columns()``
+        and ``write_edge_features()``).
+        The base implementation returns ``None``, in which case the Rag can't plan the
+        output in advance.  It then drops any unrequested columns after calling
+        ``append_edge_features_to_df()``, and (if ``compute_features()`` was asked
+        to produce a feature array) copies the resulting columns into the array.
+        """
+        return None
+
+    def select_output_columns(self, column_names):
+        """
+        Called by the Rag before ``ingest_values()`` (if ``output_column_names()`` is not ``None``).
+
+        Tells the accumulator which of its ``output_column_names()`` were actually requested.
+        The accumulator should compute (and append/write) only those columns,
+        skipping any statistics that aren't needed for them.
+        The selection remains in effect until this function is called again.
+        The base implementation does nothing.
+        """
+        pass
+
+    def select_edges(self, edge_labels):
+        """
+        Called by the Rag before ``ingest_values()``/``ingest_values_for_block()``, with the
+        ``edge_label`` of each edge that features are needed for (``compute_features(..., edges=...)``),
+        or with ``edge_labels=None`` if features are needed for all edges.
+
+        Accumulators that support edge subsets must return ``True``.  They will then be given
+        (via ``ingest_values_for_block()``) only the slices that contain the selected edges, and they
+        must append (or write) one row per entry of ``edge_labels``, in the same order.
+        The selection remains in effect until this function is called again.
+
+        The base implementation returns ``False``, in which case the Rag ingests
+        all values as usual, and selects the requested rows afterwards.
+
+        Parameters
+        ----------
+        edge_labels
+            1D *ndarray* of ``edge_label`` values (i.e. row numbers of the corresponding
+            ``rag.unique_edge_tables`` table), or ``None``.
+        """
+        return False
+
+    def write_edge_features(self, edge_ids, out_columns):
+        """
+        Called by the Rag after ``ingest_values()`` (if ``output_column_names()`` is not ``None``).
+
+        Writes the features of all ingested edges directly into the given output columns.
+
+        Parameters
+        ----------
+        edge_ids
+            *ndarray, shape=(N,2)*
+            The ``(sp1, sp2)`` pair for each output row.
+
+        out_columns
+            *OrderedDict* of ``{ column_name : 1D float32 ndarray }``.
+            The output columns to write (a subset of ``output_column_names()``),
+            each of which is a (writable) view into the preallocated feature array.
+        """
+        raise NotImplementedError
+
     def __enter__(self):
         return self
     
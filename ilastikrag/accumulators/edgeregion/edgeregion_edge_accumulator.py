@@ -1,6 +1,8 @@
 import logging
 import numpy as np
-import pandas as pd
+
+from ilastikrag.lazy_import import lazy_import
+pd = lazy_import('pandas')
 
 from ilastikrag.accumulators import BaseEdgeAccumulator
 
@@ -66,60 +68,129 @@ class EdgeRegionEdgeAccumulator(BaseEdgeAccumulator):
                 for axisname in map( lambda k: 'xyz'[k], range(label_img.ndim) ):
                     feature_names.append( 'edgeregion_edge_regionaxes_{}{}'.format( component_index, axisname ) )            
         
+        self._all_feature_names = feature_names
         self._feature_names = feature_names
+        self._edge_labels = None
         self._rag = rag
     
     def cleanup(self):
+        self._moments = None
         self._final_df = None
 
     def ingest_edges(self, rag, edge_values):
         # This class computes only unweighted region
         # features, so edge_values is not used below.
-        
-        # Concatenate edges from all axes into one big DataFrame
-        tables = [table[['sp1', 'sp2'] + self._dense_axiskeys] for table in rag.dense_edge_tables.values()]
-        coords_df = pd.concat(tables, axis=0)
-        
+        self._moments = None
+        self._final_df = None
+        self._ingest_axis_tables(rag.dense_edge_tables)
+
+    def ingest_edges_for_block(self, rag, dense_edge_tables, edge_values, value_range):
+        # The coordinate moments of each block are simply added to the totals.
+        self._final_df = None
+        self._ingest_axis_tables(dense_edge_tables)
+
+    def append_edge_features_to_df(self, edge_df):
+        final_df = self._get_final_df()
+        if self._edge_labels is not None:
+            # The rows of final_df are already in the same order as edge_df
+            for feature_name in self._feature_names:
+                edge_df[feature_name] = final_df[feature_name].values
+            return edge_df
+        return pd.merge(edge_df, final_df, on=['sp1', 'sp2'], how='left', copy=False)
+
+    def output_column_names(self):
+        return list(self._all_feature_names)
+
+    def select_output_columns(self, column_names):
+        assert set(column_names) <= set(self._all_feature_names), \
+            "Unknown output columns: {}".format( set(column_names) - set(self._all_feature_names) )
+        self._feature_names = filter(lambda name: name in column_names, self._all_feature_names)
+        self._final_df = None
+
+    def select_edges(self, edge_labels):
+        self._edge_labels = edge_labels
+        self._final_df = None
+        return True
+
+    def write_edge_features(self, edge_ids, out_columns):
+        # final_df has the same edges (and order) as the output rows
+        final_df = self._get_final_df()
+        assert len(edge_ids) == len(final_df)
+        for feature_name, out_column in out_columns.items():
+            out_column[:] = final_df[feature_name].values
+
+    def _ingest_axis_tables(self, dense_edge_tables):
+        """
+        Accumulate the first and second moments of the edge
+        coordinates in the given dense edge tables, per edge_label.
+        """
+        dense_axes = ''.join(self._rag.dense_edge_tables.keys())
+        num_edges = len(self._rag.unique_edge_tables[dense_axes])
+        ndim = len(self._dense_axiskeys)
+
+        if self._moments is None:
+            # The coordinates are shifted by a per-edge (integer) offset before they are
+            # accumulated, to keep the second moments small (and exact) for large volumes.
+            self._moments = { 'count'   : np.zeros( num_edges, dtype=np.float64 ),
+                              'offset'  : np.zeros( (num_edges, ndim), dtype=np.float64 ),
+                              'sum'     : np.zeros( (num_edges, ndim), dtype=np.float64 ),
+                              'sum_sq'  : np.zeros( (num_edges, ndim, ndim), dtype=np.float64 ) }
+        moments = self._moments
+
+        for axiskey, dense_edge_table in dense_edge_tables.items():
+            if len(dense_edge_table) == 0:
+                continue
+            logger.debug("Axis {}: Accumulating edge coordinate moments...".format( axiskey ))
+            edge_labels = dense_edge_table['edge_label'].values
+            counts = np.bincount(edge_labels, minlength=num_edges)
+            new_edges = (counts > 0) & (moments['count'] == 0)
+
+            shifted_coords = []
+            for i, coord_key in enumerate(self._dense_axiskeys):
+                coords = dense_edge_table[coord_key].values.astype(np.float64)
+                if new_edges.any():
+                    coord_sums = np.bincount(edge_labels, coords, minlength=num_edges)
+                    moments['offset'][new_edges, i] = np.round(coord_sums[new_edges] / counts[new_edges])
+                coords -= moments['offset'][edge_labels, i]
+                shifted_coords.append(coords)
+
+            moments['count'] += counts
+            for i in range(ndim):
+                moments['sum'][:, i] += np.bincount(edge_labels, shifted_coords[i], minlength=num_edges)
+                for j in range(i, ndim):
+                    products = shifted_coords[i] * shifted_coords[j]
+                    moments['sum_sq'][:, i, j] += np.bincount(edge_labels, products, minlength=num_edges)
+
+    def _get_final_df(self):
+        """
+        Compute the requested features from the accumulated coordinate moments (on first call only),
+        for all edges (or only the selected edges, in the same order as the edge_labels given to select_edges()).
+        """
+        if self._final_df is not None:
+            return self._final_df
+
         # Create a new DataFrame to store the results
-        dense_axes = ''.join(rag.dense_edge_tables.keys())
-        final_df = pd.DataFrame(self._rag.unique_edge_tables[dense_axes][['sp1', 'sp2']])
+        dense_axes = ''.join(self._rag.dense_edge_tables.keys())
+        edge_table = self._rag.unique_edge_tables[dense_axes]
+        moments = self._moments
+        if self._edge_labels is not None:
+            edge_table = edge_table.iloc[self._edge_labels]
+            moments = { k: v[self._edge_labels] for k, v in moments.items() }
+        final_df = pd.DataFrame(edge_table[['sp1', 'sp2']])
         
         num_edges = len(final_df)
         ndim = len(self._dense_axiskeys)
-        covariance_matrices_array = np.zeros( (num_edges, ndim, ndim), dtype=np.float32 )
-
-        group_index = [-1]
-        def write_covariance_matrix(group_df):
-            """
-            Computes the covariance matrix of the given group,
-            and writes it into the pre-existing covariance_matrices_array.
-            """
-            # There's one 'gotcha' to watch out for here:
-            # GroupBy.apply() calls this function *twice* for the first group.
-            # http://pandas.pydata.org/pandas-docs/stable/generated/pandas.core.groupby.GroupBy.apply.html
-            if group_index[0] < 0:
-                group_index[0] += 1
-                return None
-            
-            # Compute covariance.
-            # Apparently computing it manually is much faster than group_df.cov()
-            group_vals = group_df.values.astype(np.float32, copy=False)
-            group_vals -= group_vals.mean(axis=0)
-            matrix = group_vals.transpose().dot(group_vals)
-            matrix[:] /= len(group_df)
-            
-            # Store.
-            covariance_matrices_array[group_index[0]] = matrix
-            group_index[0] += 1
-            
-            # We don't need to return anything;
-            # we're using this function only for its side effects.
-            return None
 
-        # Compute/store covariance matrices
-        grouper = coords_df.groupby(['sp1', 'sp2'], sort=True, group_keys=False)
-        grouper = grouper[list(self._dense_axiskeys)]
-        grouper.apply(write_covariance_matrix) # Used for its side-effects only
+        # Covariance matrices: E[xx^T] - E[x]E[x]^T
+        # (The offsets cancel out.)
+        counts = moments['count']
+        means = moments['sum'] / counts[:, None]
+        covariance_matrices_array = moments['sum_sq'] / counts[:, None, None]
+        covariance_matrices_array -= means[:, :, None] * means[:, None, :]
+        for i in range(ndim):
+            for j in range(i+1, ndim):
+                covariance_matrices_array[:, j, i] = covariance_matrices_array[:, i, j]
+        covariance_matrices_array = covariance_matrices_array.astype(np.float32)
 
         # Eigensystems
         eigenvalues, eigenvectors = np.linalg.eigh(covariance_matrices_array)
@@ -155,9 +226,7 @@ class EdgeRegionEdgeAccumulator(BaseEdgeAccumulator):
                 assert False, "Unknown feature: ".format( feature_name )
 
         self._final_df = final_df
-    
-    def append_edge_features_to_df(self, edge_df):
-        return pd.merge(edge_df, self._final_df, on=['sp1', 'sp2'], how='left', copy=False)
+        return final_df
 
     @classmethod
     def supported_features(cls, rag):
@@ -0,0 +1,159 @@
+import logging
+import importlib
+from collections import Mapping, OrderedDict
+
+logger = logging.getLogger(__name__)
+
+#: The entry point group that third-party packages can use to register their accumulators.
+ENTRY_POINT_GROUP = 'ilastikrag.accumulators'
+
+class AccumulatorRegistry(Mapping):
+    """
+    A read-only mapping of ``(ACCUMULATOR_ID, ACCUMULATOR_TYPE)`` to accumulator classes.
+
+    Each class is registered by its import path (``'package.module:ClassName'``),
+    and its module is only imported when the class is first looked up, i.e. when one of its features is requested.
+    Hence, merely listing the registered ids/types (e.g. ``registry.keys()``) imports nothing.
+
+    In addition to the classes given to the constructor (and to :py:meth:`register()`),
+    the registry discovers the accumulators that installed packages advertise via an entry point group.
+    Each entry point must be named ``<accumulator-id>_<accumulator-type>``, e.g. in ``setup.py``:
+
+    ::
+
+       setup(...,
+             entry_points={ 'ilastikrag.accumulators':
+                            [ 'mything_edge = mypackage.accumulators:MyThingEdgeAccumulator' ] } )
+
+    Registered accumulator classes must be constructible as ``acc_cls(rag, feature_names)``.
+    """
+    def __init__(self, class_paths, entry_point_group=None):
+        """
+        Parameters
+        ----------
+        class_paths
+            *dict* (or list of pairs) of ``(acc_id, acc_type) : 'package.module:ClassName'``
+
+        entry_point_group
+            *str* (Optional) -- Also discover accumulators from this entry point group,
+            e.g. :py:data:`ENTRY_POINT_GROUP`. |br|
+            The entry points are scanned once, when the registry is first used.
+        """
+        self._class_paths = OrderedDict()
+        self._classes = {}
+        for (acc_id, acc_type), class_path in OrderedDict(class_paths).items():
+            self._add(acc_id, acc_type, class_path)
+        self._entry_point_group = entry_point_group
+
+    def register(self, acc_class, acc_id=None, acc_type=None):
+        """
+        Register an accumulator, so its features can be requested without passing
+        an instance of it via ``accumulator_set``.
+
+        Parameters
+        ----------
+        acc_class
+            An accumulator class, or its import path (``'package.module:ClassName'``),
+            in which case it isn't imported until it's needed.
+
+        acc_id, acc_type
+            *str* -- Required if ``acc_class`` is an import path.
+        """
+        if isinstance(acc_class, basestring):
+            assert acc_id and acc_type, "Must provide the accumulator id and type along with an import path"
+            self._add(acc_id, acc_type, acc_class)
+        else:
+            self._add(acc_class.ACCUMULATOR_ID, acc_class.ACCUMULATOR_TYPE, acc_class)
+
+    def is_loaded(self, key):
+        """
+        Return True if the class for the given id/type has already been imported.
+        """
+        return key in self._classes
+
+    def __getitem__(self, key):
+        try:
+            return self._classes[key]
+        except KeyError:
+            pass
+
+        self._discover_entry_points()
+        class_path = self._class_paths[key]
+        if isinstance(class_path, basestring):
+            module_name, class_name = class_path.split(':')
+            acc_cls = getattr(importlib.import_module(module_name), class_name)
+        else:
+            # A pkg_resources.EntryPoint
+            acc_cls = class_path.load()
+
+        assert (acc_cls.ACCUMULATOR_ID, acc_cls.ACCUMULATOR_TYPE) == key, \
+            "Accumulator {} is registered under the wrong id/type: {}".format( acc_cls, key )
+        self._classes[key] = acc_cls
+        return acc_cls
+
+    def __contains__(self, key):
+        self._discover_entry_points()
+        return key in self._class_paths
+
+    def __iter__(self):
+        self._discover_entry_points()
+        return iter(self._class_paths)
+
+    def __len__(self):
+        self._discover_entry_points()
+        return len(self._class_paths)
+
+    def _add(self, acc_id, acc_type, acc_class):
+        """
+        Add a class (or the import path or entry point of a class) to the registry.
+        """
+        assert acc_type in ('edge', 'sp', 'flatedge'), \
+            "{} has unknown accumulator-type: {}".format( acc_class, acc_type )
+        assert acc_id, \
+            "{} has empty accumulator-id: {}".format( acc_class, acc_id )
+        assert '_' not in acc_id, \
+            "{} has a bad char in its accumulator-id: {}".format( acc_class, acc_id )
+
+        if (acc_id, acc_type) in self._class_paths:
+            raise RuntimeError("Conflicting accumulator registrations.\n"
+                               "Multiple accumulators found to process features of type: {}_{}"
+                               .format(acc_id, acc_type))
+
+        self._class_paths[(acc_id, acc_type)] = acc_class
+        if isinstance(acc_class, type):
+            self._classes[(acc_id, acc_type)] = acc_class
+
+    def _discover_entry_points(self):
+        """
+        Register the accumulators from our entry point group (only the first time this is called).
+        Entry points with a malformed name, or which conflict with an accumulator that is already registered,
+        are skipped (with a warning), so a broken plugin can't prevent the other accumulators from being used.
+        """
+        if self._entry_point_group is None:
+            return
+        group, self._entry_point_group = self._entry_point_group, None
+
+        # pkg_resources is slow to import, so we don't import it until we need it.
+        import pkg_resources
+        for entry_point in pkg_resources.iter_entry_points(group):
+            acc_id, _, acc_type = entry_point.name.rpartition('_')
+            logger.debug("Registering accumulator {}_{} from {}".format( acc_id, acc_type, entry_point.dist ))
+            try:
+                self._add(acc_id, acc_type, entry_point)
+            except (AssertionError, RuntimeError) as ex:
+                logger.warning("Skipping accumulator entry point '{}' from {}: {}"
+                               .format( entry_point.name, entry_point.dist, ex ))
+
+_supported_features_cache = {}
+
+def cached_supported_features(acc_cls, rag):
+    """
+    Return ``acc_cls.supported_features(rag)``, which is computed only once for each kind of Rag,
+    i.e. for each combination of ``rag.label_img.ndim`` and ``rag.flat_superpixels``.
+    """
+    key = (acc_cls, rag.label_img.ndim, rag.flat_superpixels)
+    try:
+        feature_names = _supported_features_cache[key]
+    except KeyError:
+        feature_names = _supported_features_cache[key] = tuple(acc_cls.supported_features(rag))
+    return list(feature_names)
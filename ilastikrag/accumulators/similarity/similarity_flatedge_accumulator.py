@@ -1,8 +1,9 @@
 import logging
 import numpy as np
-import pandas as pd
 
-from ilastikrag.util import edge_ids_for_axis
+from ilastikrag.lazy_import import lazy_import
+pd = lazy_import('pandas')
+
 from ilastikrag.accumulators import BaseFlatEdgeAccumulator
 
 logger = logging.getLogger(__name__)
@@ -22,70 +23,121 @@ class SimilarityFlatEdgeAccumulator(BaseFlatEdgeAccumulator):
     def __init__(self, rag, feature_names):
         self.cleanup() # Initialize members
         feature_names = list(feature_names)
+        self._all_feature_names = feature_names
         self._feature_names = feature_names
+        self._edge_labels = None
     
     def cleanup(self):
-        self._final_df = None
+        self._sums = None
 
     def ingest_values(self, rag, value_img):
-        self._final_df = pd.DataFrame(rag.unique_edge_tables['z'][['sp1', 'sp2']])
-         
-        if 'similarity_flatedge_correlation' in self._feature_names:
-            self._compute_correlation_feature(rag, value_img)
-            pass
-        
+        assert value_img is not None, "Can't compute similarity features without a value image."
+        self._sums = None
+        self._ingest_slice_pairs(rag, 0, value_img)
+
+    def ingest_values_for_block(self, rag, block_start, block_stop, value_block, value_range):
+        # The last slice of the value_block is only needed as the 'right' side of the last slice pair.
+        block_stop = min(block_stop, rag.flat_edge_label_img.shape[0])
+        if block_start < block_stop:
+            self._ingest_slice_pairs(rag, block_start, value_block[:block_stop-block_start+1])
+
     def append_edge_features_to_df(self, edge_df):
-        merged = pd.merge(edge_df, self._final_df, how='left', on=['sp1', 'sp2'])
-        return merged
+        # The edge_df rows are in the same order as unique_edge_tables['z'] (or the selected edges)
+        if 'similarity_flatedge_correlation' in self._feature_names:
+            correlations = self._compute_correlations()
+            edge_df['similarity_flatedge_correlation'] = pd.Series(correlations, dtype=np.float32, index=edge_df.index)
+        return edge_df
+
+    def output_column_names(self):
+        return list(self._all_feature_names)
 
-    def _compute_correlation_feature(self, rag, value_img):
+    def select_output_columns(self, column_names):
+        assert set(column_names) <= set(self._all_feature_names), \
+            "Unknown output columns: {}".format( set(column_names) - set(self._all_feature_names) )
+        self._feature_names = filter(lambda name: name in column_names, self._all_feature_names)
+
+    def select_edges(self, edge_labels):
+        self._edge_labels = edge_labels
+        return True
+
+    def write_edge_features(self, edge_ids, out_columns):
+        if 'similarity_flatedge_correlation' in out_columns:
+            out_columns['similarity_flatedge_correlation'][:] = self._compute_correlations()
+
+    def _ingest_slice_pairs(self, rag, first_slice, value_img):
         """
-        Compute the correlation between edge-adjacent pixels and append it to final_df
+        Accumulate the per-edge sums needed for the correlation between edge-adjacent pixels,
+        one slice pair at a time.
+
+        value_img: The values for slices [first_slice, first_slice+len(value_img)),
+                   whose slice pairs are labeled by the corresponding slices of flat_edge_label_img.
         """
-        # FIXME: We should be able to avoid this sort until the end...
-        z_edge_ids = edge_ids_for_axis(rag.label_img, None, 0)
-        z_edge_ids.sort(1)
-        
-        values_df = pd.DataFrame(z_edge_ids, columns=['sp1', 'sp2'])
-        values_df['left_values'] = value_img[:-1].reshape(-1)
-        values_df['right_values'] = value_img[1:].reshape(-1)
-        
-        correlations = np.zeros( len(self._final_df), dtype=np.float32 )
-        
-        group_index = [-1]
-        def write_correlation(group_df):
-            """
-            Computes the correlation between 'left_values' and 'right_values' of the given group,
-            and writes it into the pre-existing correlations_array.
-            """
-            # There's one 'gotcha' to watch out for here:
-            # GroupBy.apply() calls this function *twice* for the first group.
-            # http://pandas.pydata.org/pandas-docs/stable/generated/pandas.core.groupby.GroupBy.apply.html
-            if group_index[0] < 0:
-                group_index[0] += 1
-                return None
-
-            # Compute
-            covariance = np.cov(group_df['left_values'].values, group_df['right_values'].values)
-            denominator = np.sqrt(covariance[0,0]*covariance[1,1])
-            if denominator == 0.0:
-                corr = 1.0
-            else:
-                assert covariance[0,1] == covariance[1,0]
-                corr = (covariance[0,1] / denominator)
-            
-            # Store
-            correlations[group_index[0]] = corr
-            group_index[0] += 1
+        num_edges = len(rag.unique_edge_tables['z'])
+        if self._sums is None:
+            # The sums are taken over values that are shifted by a per-edge
+            # offset (the mean of the first slice pair in which the edge appears),
+            # to avoid catastrophic cancellation in Sxx - Sx**2/n, etc.
+            self._sums = { k: np.zeros(num_edges, dtype=np.float64)
+                           for k in ('n', 'x', 'y', 'xx', 'yy', 'xy', 'offset_x', 'offset_y') }
+            self._sums['offset_x'][:] = np.nan
+            self._sums['offset_y'][:] = np.nan
+
+        sums = self._sums
+        flat_edge_label_img = rag.flat_edge_label_img
+        for z in range(len(value_img)-1):
+            edge_labels = np.asarray(flat_edge_label_img[first_slice+z]).reshape(-1)
+            left_values = np.asarray(value_img[z], dtype=np.float64).reshape(-1)
+            right_values = np.asarray(value_img[z+1], dtype=np.float64).reshape(-1)
+
+            # Restrict the bincounts to the range of edges in this slice pair
+            first_label = edge_labels.min()
+            local_labels = edge_labels - first_label
+            num_local = edge_labels.max() - first_label + 1
+            local = slice(first_label, first_label + num_local)
+
+            counts = np.bincount(local_labels, minlength=num_local)
+
+            new_edges = (counts > 0) & np.isnan(sums['offset_x'][local])
+            if new_edges.any():
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    sums['offset_x'][local][new_edges] = (np.bincount(local_labels, left_values, num_local) / counts)[new_edges]
+                    sums['offset_y'][local][new_edges] = (np.bincount(local_labels, right_values, num_local) / counts)[new_edges]
+
+            left_values -= sums['offset_x'][edge_labels]
+            right_values -= sums['offset_y'][edge_labels]
+
+            sums['n'][local] += counts
+            sums['x'][local] += np.bincount(local_labels, left_values, num_local)
+            sums['y'][local] += np.bincount(local_labels, right_values, num_local)
+            sums['xx'][local] += np.bincount(local_labels, left_values*left_values, num_local)
+            sums['yy'][local] += np.bincount(local_labels, right_values*right_values, num_local)
+            sums['xy'][local] += np.bincount(local_labels, left_values*right_values, num_local)
+
+    def _compute_correlations(self):
+        """
+        Compute the correlation between the 'left' and 'right' values
+        of each (selected) edge from the accumulated sums.
+        """
+        sums = self._sums
+        if self._edge_labels is not None:
+            sums = { k: v[self._edge_labels] for k, v in sums.items() }
+        n = sums['n']
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # (Centered) covariance matrix entries, without the 1/(n-1) factor (which cancels out)
+            cov_xx = sums['xx'] - sums['x']*sums['x']/n
+            cov_yy = sums['yy'] - sums['y']*sums['y']/n
+            cov_xy = sums['xy'] - sums['x']*sums['y']/n
+
+            # Rounding errors can produce (tiny) negative variances
+            cov_xx = np.maximum(cov_xx, 0.0, out=cov_xx)
+            cov_yy = np.maximum(cov_yy, 0.0, out=cov_yy)
             
-            # We don't need to return anything;
-            # we're using this function only for its side effects.
-            return None
+            denominator = np.sqrt(cov_xx*cov_yy)
+            correlations = cov_xy / denominator
 
-        grouper = values_df.groupby(['sp1', 'sp2'], sort=True, group_keys=False)
-        grouper.apply(write_correlation) # Used for its side-effects only
-        
-        self._final_df['similarity_flatedge_correlation'] = pd.Series(correlations, dtype=np.float32, index=self._final_df.index)
+        # Edges with constant values on either side are considered perfectly correlated
+        correlations[denominator == 0.0] = 1.0
+        return correlations.astype(np.float32)
 
     @classmethod
     def supported_features(cls, rag):
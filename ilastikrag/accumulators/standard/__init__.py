@@ -1,3 +1,5 @@
 from .standard_edge_accumulator import StandardEdgeAccumulator
 from .standard_sp_accumulator import StandardSpAccumulator
 from .standard_flatedge_accumulator import StandardFlatEdgeAccumulator
+from .quantile_util import QuantileSketch
+from .label_statistics import LabelStatistics
@@ -0,0 +1,79 @@
+import numpy as np
+
+#: The bin counts supported for the ``histogram_<nbins>`` features.
+HISTOGRAM_BIN_COUNTS = (4, 8, 16, 32, 64, 128, 256)
+
+def get_histogram_bin_count(feature_name):
+    """
+    Return the number of bins of the given histogram feature name,
+    e.g. 'standard_edge_histogram_16' -> 16, or 'standard_edge_histogram_16_3' -> 16
+    """
+    return int(feature_name.split('_')[3])
+
+def get_histogram_bin_index(feature_name):
+    """
+    Return the bin index of the given histogram column name,
+    e.g. 'standard_edge_histogram_16_3' -> 3
+    """
+    return int(feature_name.split('_')[4])
+
+def expand_histogram_feature_names(feature_names):
+    """
+    Replace each histogram feature name in the given list (e.g. 'standard_edge_histogram_16')
+    with the names of its individual bins ('standard_edge_histogram_16_0', ..., 'standard_edge_histogram_16_15').
+    """
+    expanded_names = []
+    for feature_name in feature_names:
+        if feature_name.split('_')[2] == 'histogram' and len(feature_name.split('_')) == 4:
+            bin_count = get_histogram_bin_count(feature_name)
+            expanded_names += [ '{}_{}'.format(feature_name, bin_index) for bin_index in range(bin_count) ]
+        else:
+            expanded_names.append(feature_name)
+    return expanded_names
+
+class LabelHistogramAccumulator(object):
+    """
+    Computes a fixed-bin histogram of the ingested values for every label,
+    via a single bincount over (bin, label) pairs.
+
+    All values must be binned with the same ``value_range`` to make the histograms
+    comparable (and to allow several chunks of values to be ingested, e.g. one per block).
+    Values outside of the range are counted in the first or last bin.
+    """
+    def __init__(self, num_labels, bin_counts):
+        self._num_labels = num_labels
+
+        # Stored as (bins, labels), so each output column is contiguous.
+        self._histograms = { bin_count : np.zeros( (bin_count, num_labels), dtype=np.uint32 )
+                             for bin_count in set(bin_counts) }
+
+    def ingest(self, labels, values, value_range):
+        """
+        Add the given values (and their labels) to the histograms.
+        """
+        assert labels.shape == values.shape
+        labels = np.asarray(labels).reshape(-1)
+        values = np.asarray(values, dtype=np.float32).reshape(-1)
+        range_min, range_max = map(float, value_range)
+
+        for bin_count, histograms in self._histograms.items():
+            if range_max > range_min:
+                bin_indexes = ((values - range_min) * (bin_count / (range_max - range_min))).astype(np.int64)
+                np.clip(bin_indexes, 0, bin_count-1, out=bin_indexes)
+            else:
+                bin_indexes = np.zeros( values.shape, dtype=np.int64 )
+
+            keys = bin_indexes
+            keys *= self._num_labels
+            keys += labels
+            counts = np.bincount(keys, minlength=bin_count*self._num_labels)
+            histograms += counts.reshape((bin_count, self._num_labels)).astype(np.uint32)
+
+    def histogram_column(self, feature_name):
+        """
+        Return the counts of the given histogram bin column (e.g. 'standard_edge_histogram_16_3')
+        for every label, as a float32 array of length ``num_labels``.
+        """
+        bin_count = get_histogram_bin_count(feature_name)
+        bin_index = get_histogram_bin_index(feature_name)
+        return self._histograms[bin_count][bin_index].astype(np.float32)
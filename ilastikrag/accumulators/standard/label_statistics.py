@@ -0,0 +1,321 @@
+from itertools import izip
+
+import numpy as np
+
+from ilastikrag.lazy_import import lazy_import
+pd = lazy_import('pandas')
+
+from .quantile_util import QuantileSketch, get_quantile_percent
+
+class LabelStatistics(object):
+    """
+    Mergeable sufficient statistics of the values of many labels at once (e.g. edges or superpixels).
+
+    For each label, the following statistics are stored as 1D ``float64`` arrays (indexed by label):
+
+        - ``count``
+        - ``mean``
+        - ``m2``, ``m3``, ``m4`` (the sums of the 2nd, 3rd, and 4th powers of the deviations from the mean)
+        - ``minimum``, ``maximum``
+
+    Optionally, the values are also summarized in a :py:class:`QuantileSketch` (``sketch``).
+
+    From these, the standard features (count, sum, minimum, maximum, mean, variance, skewness,
+    kurtosis, and -- with a sketch -- quantiles) can be computed for each label, via :py:meth:`feature_column()`.
+    The statistics of several labels can be merged (e.g. when their edges or superpixels are merged)
+    via :py:meth:`merge_labels()`, without access to the original values.
+    Merging the central moments (rather than raw power sums) keeps the results accurate,
+    even for values with a large offset.
+    """
+    def __init__(self, num_labels, quantile_sketch=False):
+        """
+        Parameters
+        ----------
+        num_labels
+            All labels must be in the range ``[0, num_labels)``.
+
+        quantile_sketch
+            If True, also keep a :py:class:`QuantileSketch` of the values, for quantile features.
+        """
+        self.num_labels = num_labels
+        self.count = np.zeros( (num_labels,), dtype=np.float64 )
+        self.mean = np.zeros( (num_labels,), dtype=np.float64 )
+        self.m2 = np.zeros( (num_labels,), dtype=np.float64 )
+        self.m3 = np.zeros( (num_labels,), dtype=np.float64 )
+        self.m4 = np.zeros( (num_labels,), dtype=np.float64 )
+        self.minimum = np.zeros( (num_labels,), dtype=np.float64 )
+        self.maximum = np.zeros( (num_labels,), dtype=np.float64 )
+        self.minimum[:] = np.inf
+        self.maximum[:] = -np.inf
+        self.sketch = None
+        if quantile_sketch:
+            self.sketch = QuantileSketch(num_labels)
+
+    def ingest(self, labels, values):
+        """
+        Add the given values (and their labels) to the statistics.
+        """
+        assert labels.shape == values.shape
+        labels = np.asarray(labels).reshape(-1)
+        values = np.asarray(values, dtype=np.float64).reshape(-1)
+
+        chunk = LabelStatistics(self.num_labels)
+        chunk.count = np.bincount(labels, minlength=self.num_labels).astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            chunk.mean = np.bincount(labels, values, minlength=self.num_labels) / chunk.count
+        chunk.mean[chunk.count == 0] = 0.0
+
+        deviations = values - chunk.mean[labels]
+        powers = deviations * deviations
+        chunk.m2 = np.bincount(labels, powers, minlength=self.num_labels)
+        powers *= deviations
+        chunk.m3 = np.bincount(labels, powers, minlength=self.num_labels)
+        powers *= deviations
+        chunk.m4 = np.bincount(labels, powers, minlength=self.num_labels)
+        del deviations, powers
+
+        grouped_values = pd.Series(values).groupby(labels)
+        label_minimums = grouped_values.min()
+        label_maximums = grouped_values.max()
+        chunk.minimum[label_minimums.index.values] = label_minimums.values
+        chunk.maximum[label_maximums.index.values] = label_maximums.values
+
+        self._assign( LabelStatistics._combine([(self, None), (chunk, None)], self.num_labels) )
+        if self.sketch is not None:
+            self.sketch.ingest(labels, values)
+
+    def merge(self, other):
+        """
+        Merge the statistics of another object (with the same labels) into this one.
+        """
+        assert self.num_labels == other.num_labels
+        assert (self.sketch is None) == (other.sketch is None)
+        self._assign( LabelStatistics._combine([(self, None), (other, None)], self.num_labels) )
+        if self.sketch is not None:
+            self.sketch.merge(other.sketch)
+
+    def merge_labels(self, groups, num_groups=None):
+        """
+        Return a new ``LabelStatistics`` object, in which the labels are merged into the given groups.
+
+        Parameters
+        ----------
+        groups
+            1D *ndarray* of length ``num_labels``: The new label of each label,
+            or ``-1`` to discard a label altogether.
+
+        num_groups
+            The number of labels in the result.  By default, ``groups.max()+1``.
+        """
+        groups = np.asarray(groups)
+        assert groups.shape == (self.num_labels,)
+        if num_groups is None:
+            num_groups = int(groups.max()) + 1
+
+        merged = LabelStatistics._combine([(self, groups)], num_groups)
+        if self.sketch is not None:
+            merged.sketch = self.sketch.merge_labels(groups, num_groups)
+        return merged
+
+    def copy(self):
+        """
+        Return a copy of these statistics.
+        """
+        result = LabelStatistics(self.num_labels)
+        for k in ('count', 'mean', 'm2', 'm3', 'm4', 'minimum', 'maximum'):
+            setattr(result, k, getattr(self, k).copy())
+        if self.sketch is not None:
+            result.sketch = self.sketch.merge_labels(np.arange(self.num_labels), self.num_labels)
+        return result
+
+    def merge_into(self, dst_labels, src_labels):
+        """
+        Merge the statistics of each of the ``src_labels`` into the corresponding ``dst_labels`` (in-place).
+        The statistics of the ``src_labels`` themselves are left unchanged.
+        Each label may appear in ``dst_labels`` only once.
+
+        This is much cheaper than :py:meth:`merge_labels()` for merging just a few labels at a time
+        (e.g. during agglomeration), but the quantile ``sketch`` (if any) is not updated.
+        """
+        if len(dst_labels) <= self.SCALAR_MERGE_LIMIT:
+            # For just a few labels, scalar arithmetic is much faster than numpy's per-call overhead.
+            for dst_label, src_label in izip(dst_labels, src_labels):
+                self._merge_label_pair(int(dst_label), int(src_label))
+            return
+
+        dst_labels = np.asarray(dst_labels)
+        src_labels = np.asarray(src_labels)
+        assert len(np.unique(dst_labels)) == len(dst_labels), "dst_labels must be unique"
+
+        n_a = self.count[dst_labels]
+        n_b = self.count[src_labels]
+        n = n_a + n_b
+        m2_a, m2_b = self.m2[dst_labels], self.m2[src_labels]
+        m3_a, m3_b = self.m3[dst_labels], self.m3[src_labels]
+
+        # Pairwise update formulas for the central moments (see Pebay, 2008)
+        delta = self.mean[src_labels] - self.mean[dst_labels]
+        safe_n = np.where(n > 0, n, 1.0)
+        weight = n_b / safe_n
+        n_ab = n_a * weight # (n_a*n_b/n)
+
+        self.m4[dst_labels] += ( self.m4[src_labels]
+                                 + delta**4 * n_ab * (n_a*n_a - n_a*n_b + n_b*n_b) / (safe_n*safe_n)
+                                 + 6 * delta**2 * (n_a*n_a*m2_b + n_b*n_b*m2_a) / (safe_n*safe_n)
+                                 + 4 * delta * (n_a*m3_b - n_b*m3_a) / safe_n )
+        self.m3[dst_labels] += ( m3_b
+                                 + delta**3 * n_ab * (n_a - n_b) / safe_n
+                                 + 3 * delta * (n_a*m2_b - n_b*m2_a) / safe_n )
+        self.m2[dst_labels] += m2_b + delta**2 * n_ab
+        self.mean[dst_labels] += delta * weight
+        self.count[dst_labels] = n
+        self.minimum[dst_labels] = np.minimum(self.minimum[dst_labels], self.minimum[src_labels])
+        self.maximum[dst_labels] = np.maximum(self.maximum[dst_labels], self.maximum[src_labels])
+
+    #: :py:meth:`merge_into()` merges up to this many labels one at a time (without numpy)
+    SCALAR_MERGE_LIMIT = 8
+
+    def _merge_label_pair(self, dst_label, src_label):
+        """
+        Merge the statistics of src_label into dst_label (same formulas as merge_into(), but for scalars).
+        """
+        n_a = self.count.item(dst_label)
+        n_b = self.count.item(src_label)
+        if n_b == 0:
+            return
+        n = n_a + n_b
+        m2_a, m2_b = self.m2.item(dst_label), self.m2.item(src_label)
+        m3_a, m3_b = self.m3.item(dst_label), self.m3.item(src_label)
+
+        delta = self.mean.item(src_label) - self.mean.item(dst_label)
+        weight = n_b / n
+        n_ab = n_a * weight
+
+        self.m4[dst_label] += ( self.m4.item(src_label)
+                                + delta**4 * n_ab * (n_a*n_a - n_a*n_b + n_b*n_b) / (n*n)
+                                + 6 * delta**2 * (n_a*n_a*m2_b + n_b*n_b*m2_a) / (n*n)
+                                + 4 * delta * (n_a*m3_b - n_b*m3_a) / n )
+        self.m3[dst_label] += ( m3_b
+                                + delta**3 * n_ab * (n_a - n_b) / n
+                                + 3 * delta * (n_a*m2_b - n_b*m2_a) / n )
+        self.m2[dst_label] += m2_b + delta**2 * n_ab
+        self.mean[dst_label] += delta * weight
+        self.count[dst_label] = n
+        self.minimum[dst_label] = min(self.minimum.item(dst_label), self.minimum.item(src_label))
+        self.maximum[dst_label] = max(self.maximum.item(dst_label), self.maximum.item(src_label))
+
+    def feature_column(self, feature_name, labels=None):
+        """
+        Return the given feature for every label, as a float32 array of length ``num_labels``
+        (or for only the given ``labels``).
+        Labels without any values are assigned 0.0.
+
+        Parameters
+        ----------
+        feature_name
+            A standard feature name, with or without its prefix, e.g. ``mean``, ``standard_edge_mean``,
+            or ``quantiles_25`` (which requires the ``quantile_sketch``).
+
+        labels
+            1D *ndarray* (Optional) -- compute the feature for only these labels.
+        """
+        feature_name = feature_name.lower()
+        if feature_name.startswith('standard_'):
+            feature_name = '_'.join(feature_name.split('_')[2:])
+
+        if labels is None:
+            take = lambda a: a
+        else:
+            take = lambda a: a[labels]
+
+        count = take(self.count)
+        nonempty = (count > 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if feature_name == 'count':
+                column = count
+            elif feature_name == 'sum':
+                column = count * take(self.mean)
+            elif feature_name == 'mean':
+                column = take(self.mean)
+            elif feature_name == 'minimum':
+                column = take(self.minimum)
+            elif feature_name == 'maximum':
+                column = take(self.maximum)
+            elif feature_name == 'variance':
+                column = take(self.m2) / count
+            elif feature_name == 'skewness':
+                m2 = take(self.m2)
+                column = np.sqrt(count) * take(self.m3) / np.power(m2, 1.5)
+            elif feature_name == 'kurtosis':
+                m2 = take(self.m2)
+                column = count * take(self.m4) / (m2 * m2) - 3.0
+            elif feature_name.startswith('quantiles_'):
+                # As with the other quantile methods, quantiles 0 and 100 are the exact minimum and maximum.
+                percent = get_quantile_percent(feature_name)
+                if percent == 0.0:
+                    column = take(self.minimum)
+                elif percent == 100.0:
+                    column = take(self.maximum)
+                else:
+                    assert self.sketch is not None, \
+                        "Can't compute quantiles without a quantile_sketch"
+                    column = take(self.sketch.quantile_column(percent))
+            else:
+                assert False, "Unsupported statistics feature: {}".format( feature_name )
+
+        column = np.array(column, dtype=np.float32)
+        column[~nonempty] = 0.0
+
+        # (Like vigra) skewness and kurtosis are NaN for constant values, but we replace NaN with 0.0
+        column[np.isnan(column)] = 0.0
+        return column
+
+    #: The features that :py:meth:`feature_column()` can compute (besides ``quantiles_<percent>``)
+    FEATURE_NAMES = ('count', 'sum', 'minimum', 'maximum', 'mean', 'variance', 'skewness', 'kurtosis')
+
+    def _assign(self, other):
+        self.count, self.mean = other.count, other.mean
+        self.m2, self.m3, self.m4 = other.m2, other.m3, other.m4
+        self.minimum, self.maximum = other.minimum, other.maximum
+
+    @classmethod
+    def _combine(cls, parts, num_groups):
+        """
+        Combine the statistics of the given parts into a new LabelStatistics object (without a sketch).
+
+        parts: list of (LabelStatistics, groups), where groups maps each label of
+               that part to a label of the result (or -1), or None for the identity mapping.
+        """
+        all_groups = []
+        all_stats = { k: [] for k in ('count', 'mean', 'm2', 'm3', 'm4', 'minimum', 'maximum') }
+        for stats, groups in parts:
+            if groups is None:
+                groups = np.arange(stats.num_labels)
+            keep = (groups >= 0) & (stats.count > 0)
+            all_groups.append(groups[keep])
+            for k in all_stats.keys():
+                all_stats[k].append(getattr(stats, k)[keep])
+
+        groups = np.concatenate(all_groups)
+        count, mean, m2, m3, m4, minimum, maximum = [ np.concatenate(all_stats[k]) for k in
+                                                      ('count', 'mean', 'm2', 'm3', 'm4', 'minimum', 'maximum') ]
+
+        combined = LabelStatistics(num_groups)
+        combined.count = np.bincount(groups, count, minlength=num_groups)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            combined.mean = np.bincount(groups, count * mean, minlength=num_groups) / combined.count
+        combined.mean[combined.count == 0] = 0.0
+
+        # Shift each part's central moments to the combined mean before adding them up.
+        d = mean - combined.mean[groups]
+        d2 = d * d
+        combined.m2 = np.bincount(groups, m2 + count*d2, minlength=num_groups)
+        combined.m3 = np.bincount(groups, m3 + 3*d*m2 + count*d2*d, minlength=num_groups)
+        combined.m4 = np.bincount(groups, m4 + 4*d*m3 + 6*d2*m2 + count*d2*d2, minlength=num_groups)
+
+        if len(groups):
+            group_minimums = pd.Series(minimum).groupby(groups).min()
+            group_maximums = pd.Series(maximum).groupby(groups).max()
+            combined.minimum[group_minimums.index.values] = group_minimums.values
+            combined.maximum[group_maximums.index.values] = group_maximums.values
+        return combined
@@ -0,0 +1,240 @@
+import numpy as np
+
+#: Valid choices for the ``quantile_method`` of the standard accumulators.
+#:
+#: - ``'histogram'``: Quantiles are estimated from vigra's per-region histograms (64 bins).
+#:   Fast, with a small (constant) amount of memory per region, but only approximate.
+#:   When processed blockwise, the histogram range must be fixed in advance
+#:   (via a prepass over the whole value image).
+#: - ``'exact'``: All values are kept and sorted by region label, and the quantiles are read
+#:   directly from the sorted values.  Exact, but requires ~24 bytes of RAM per value
+#:   (a copy of the labels and values, plus the sort order), and an O(N log N) sort.
+#: - ``'sketch'``: Values are summarized in a mergeable :py:class:`QuantileSketch` per region,
+#:   whose size depends only on the dynamic range of the values, not their number.
+#:   Each quantile is accurate to within 1% (relative error), except for quantiles 0 and 100,
+#:   which are exact.  No prepass is needed, and partial results can be merged.
+QUANTILE_METHODS = ('histogram', 'exact', 'sketch')
+
+def create_quantile_accumulator(quantile_method, num_labels, percents):
+    """
+    Create the object that computes quantiles for the given (non-histogram) quantile_method.
+    Either way, the object provides ``ingest(labels, values)`` and ``quantile_column(percent)``.
+    """
+    if quantile_method == 'exact':
+        return ExactQuantileAccumulator(num_labels, percents)
+    if quantile_method == 'sketch':
+        return QuantileSketch(num_labels)
+    assert False, "Quantiles for quantile_method '{}' are computed by vigra.".format( quantile_method )
+
+def get_quantile_percent(feature_name):
+    """
+    Return the quantile (in percent) of the given quantile feature name,
+    e.g. 'standard_edge_quantiles_25' -> 25.0
+    """
+    return float(feature_name.split('_')[-1])
+
+class ExactQuantileAccumulator(object):
+    """
+    Computes exact per-label quantiles of the values it ingests.
+
+    The values are collected (in one or more chunks, e.g. one per block)
+    and sorted within each label segment when the quantiles are first requested.
+    Quantiles between two values are linearly interpolated (as in ``numpy.percentile()``),
+    so quantile 0 is the minimum and quantile 100 is the maximum of each label.
+    """
+    def __init__(self, num_labels, percents):
+        """
+        Parameters
+        ----------
+        num_labels
+            All labels must be in the range ``[0, num_labels)``.
+
+        percents
+            The quantiles to compute, in percent.
+        """
+        self._num_labels = num_labels
+        self._percents = sorted(set(percents))
+        self._label_chunks = []
+        self._value_chunks = []
+        self._quantiles = None
+
+    def ingest(self, labels, values):
+        """
+        Add the given values (and their labels) to the accumulator.
+        No copy is made of contiguous arrays, so don't modify them afterwards.
+        """
+        assert labels.shape == values.shape
+        self._label_chunks.append( np.asarray(labels).reshape(-1) )
+        self._value_chunks.append( np.asarray(values, dtype=np.float32).reshape(-1) )
+        self._quantiles = None
+
+    def quantile_column(self, percent):
+        """
+        Return the given quantile for every label, as a float32 array of length ``num_labels``.
+        (Labels without any values are assigned 0.0.)
+        """
+        if self._quantiles is None:
+            self._quantiles = self._compute_quantiles()
+        return self._quantiles[self._percents.index(percent)]
+
+    def _compute_quantiles(self):
+        labels = np.concatenate(self._label_chunks)
+        values = np.concatenate(self._value_chunks)
+        self._label_chunks = [labels]
+        self._value_chunks = [values]
+
+        # Sort by label, then by value
+        sorted_values = values[np.lexsort((values, labels))]
+
+        counts = np.bincount(labels, minlength=self._num_labels)
+        segment_starts = np.cumsum(counts) - counts
+
+        nonempty = (counts > 0)
+        segment_starts = segment_starts[nonempty]
+        segment_lasts = counts[nonempty] - 1
+
+        quantiles = np.zeros( (len(self._percents), self._num_labels), dtype=np.float32 )
+        for i, percent in enumerate(self._percents):
+            positions = segment_lasts * (percent / 100.)
+            lower = np.floor(positions).astype(np.int64)
+            upper = np.minimum(lower + 1, segment_lasts)
+            fractions = (positions - lower).astype(np.float32)
+
+            lower_values = sorted_values[segment_starts + lower]
+            upper_values = sorted_values[segment_starts + upper]
+            quantiles[i, nonempty] = lower_values + fractions * (upper_values - lower_values)
+        return quantiles
+
+class QuantileSketch(object):
+    """
+    Mergeable quantile sketch for many labels at once, with bounded relative error.
+
+    Values are assigned to logarithmically spaced buckets (as in DDSketch), so that
+    any value reported from a bucket is within ``relative_accuracy`` of every value in it.
+    Only the (label, bucket) pairs that actually occur are stored, along with their counts,
+    so the memory needed per label is bounded by the number of buckets spanned by that label's
+    values (e.g. ~700 buckets for values spanning 6 orders of magnitude at 1% accuracy),
+    no matter how many values are ingested.
+
+    Sketches of the same labels can be merged (e.g. the results of separate blocks or processes)
+    with :py:meth:`merge()`, which gives the same result as ingesting all values into one sketch.
+
+    Error bound: For each label, the value returned for quantile ``q`` is within
+    ``relative_accuracy * |v|`` of ``v``, the exact (lower) order statistic of rank ``floor(q*(n-1))``.
+    """
+    def __init__(self, num_labels, relative_accuracy=0.01):
+        assert 0.0 < relative_accuracy < 1.0
+        self.num_labels = num_labels
+        self.relative_accuracy = relative_accuracy
+
+        self._gamma = (1. + relative_accuracy) / (1. - relative_accuracy)
+        self._log_gamma = np.log(self._gamma)
+
+        # Bucket indexes for the range of (normal) float32 magnitudes.
+        # Smaller magnitudes are counted as zero.
+        finfo = np.finfo(np.float32)
+        self._min_index = int(np.ceil(np.log(finfo.tiny) / self._log_gamma))
+        max_index = int(np.ceil(np.log(finfo.max) / self._log_gamma))
+        self._index_span = max_index - self._min_index + 1
+
+        # Each value is mapped to an 'ordinal' in [0, 2*index_span],
+        # which increases monotonically with the value (index_span represents zero).
+        self._num_ordinals = 2*self._index_span + 1
+
+        # Sorted, unique keys (label * num_ordinals + ordinal), and their counts
+        self._keys = np.zeros( (0,), dtype=np.int64 )
+        self._counts = np.zeros( (0,), dtype=np.float64 )
+
+    def ingest(self, labels, values):
+        """
+        Add the given values (and their labels) to the sketch.
+        """
+        assert labels.shape == values.shape
+        labels = np.asarray(labels).reshape(-1)
+        values = np.asarray(values, dtype=np.float32).reshape(-1)
+
+        keys = labels.astype(np.int64) * self._num_ordinals
+        keys += self._value_ordinals(values)
+        keys, counts = np.unique(keys, return_counts=True)
+        self._merge_keys(keys, counts)
+
+    def merge(self, other):
+        """
+        Merge the contents of another sketch (with the same labels and accuracy) into this one.
+        """
+        assert self.num_labels == other.num_labels
+        assert self.relative_accuracy == other.relative_accuracy
+        self._merge_keys(other._keys, other._counts)
+
+    def merge_labels(self, groups, num_groups):
+        """
+        Return a new sketch, in which the labels of this sketch are merged into the given groups.
+
+        groups: 1D array of length ``num_labels``: The new label of each label (or -1 to discard it).
+        """
+        groups = np.asarray(groups)
+        assert groups.shape == (self.num_labels,)
+        new_labels = groups[self._keys // self._num_ordinals]
+        keep = (new_labels >= 0)
+
+        keys = new_labels[keep].astype(np.int64) * self._num_ordinals
+        keys += self._keys[keep] % self._num_ordinals
+        keys, inverse = np.unique(keys, return_inverse=True)
+
+        merged = QuantileSketch(num_groups, self.relative_accuracy)
+        merged._keys = keys
+        merged._counts = np.bincount(inverse, self._counts[keep], minlength=len(keys))
+        return merged
+
+    def quantile_column(self, percent):
+        """
+        Return the given quantile (in percent) for every label, as a float32 array of length ``num_labels``.
+        (Labels without any values are assigned 0.0.)
+        """
+        labels = self._keys // self._num_ordinals
+        label_counts = np.bincount(labels, self._counts, minlength=self.num_labels)
+        nonempty = (label_counts > 0)
+
+        cumulative_counts = np.cumsum(self._counts)
+        counts_before_label = np.cumsum(label_counts) - label_counts
+
+        # Find the first bucket (in each label's segment) whose cumulative count exceeds the rank
+        ranks = np.floor( (label_counts[nonempty] - 1) * (percent / 100.) )
+        key_indexes = np.searchsorted(cumulative_counts, counts_before_label[nonempty] + ranks, side='right')
+        ordinals = self._keys[key_indexes] % self._num_ordinals
+
+        column = np.zeros( (self.num_labels,), dtype=np.float32 )
+        column[nonempty] = self._ordinal_values(ordinals)
+        return column
+
+    def _merge_keys(self, keys, counts):
+        if len(self._keys):
+            keys = np.concatenate((self._keys, keys))
+            counts = np.concatenate((self._counts, counts))
+            keys, inverse = np.unique(keys, return_inverse=True)
+            counts = np.bincount(inverse, counts, minlength=len(keys))
+        self._keys = keys
+        self._counts = counts.astype(np.float64, copy=False)
+
+    def _value_ordinals(self, values):
+        """
+        Map values to their (signed) bucket ordinals.
+        """
+        magnitudes = np.abs(values)
+        nonzero = magnitudes >= np.finfo(np.float32).tiny
+
+        indexes = np.zeros( values.shape, dtype=np.int64 )
+        indexes[nonzero] = np.ceil(np.log(magnitudes[nonzero].astype(np.float64)) / self._log_gamma)
+        indexes[nonzero] -= (self._min_index - 1)
+        indexes[values < 0] *= -1
+        indexes += self._index_span
+        return indexes
+
+    def _ordinal_values(self, ordinals):
+        """
+        Map bucket ordinals back to (representative) values.
+        """
+        signed_indexes = ordinals - self._index_span
+        indexes = np.abs(signed_indexes) + (self._min_index - 1)
+        values = np.sign(signed_indexes) * (2 * np.power(self._gamma, indexes) / (self._gamma + 1))
+        return values.astype(np.float32)
@@ -1,9 +1,16 @@
 import logging
 import numpy as np
-import vigra
+
+from ilastikrag.lazy_import import lazy_import
+pd = lazy_import('pandas')
+vigra = lazy_import('vigra')
 
 from ilastikrag.accumulators import BaseEdgeAccumulator
-from .vigra_util import get_vigra_feature_names, append_vigra_features_to_dataframe
+from .vigra_util import get_vigra_feature_names, get_vigra_feature_column, merge_vigra_accumulators
+from .quantile_util import QUANTILE_METHODS, get_quantile_percent, create_quantile_accumulator
+from .histogram_util import HISTOGRAM_BIN_COUNTS, get_histogram_bin_count, expand_histogram_feature_names, \
+                            LabelHistogramAccumulator
+from .label_statistics import LabelStatistics
 
 logger = logging.getLogger(__name__)
 
@@ -33,6 +40,26 @@ class StandardEdgeAccumulator(BaseEdgeAccumulator):
         - standard_edge_quantiles_75
         - standard_edge_quantiles_90
         - standard_edge_quantiles_100
+
+    ..
+
+        - standard_edge_histogram_<nbins> (``nbins`` columns: ``standard_edge_histogram_<nbins>_0``, ``..._1``, etc.)
+
+    The histogram features count the edge pixels in each of ``nbins`` equal-width bins
+    (``nbins`` must be one of :py:data:`~ilastikrag.accumulators.standard.histogram_util.HISTOGRAM_BIN_COUNTS`),
+    spanning the range of all edge values (or the range of the entire value image, if processed blockwise).
+
+    By default, the quantiles are estimated from a histogram of each edge's values.
+    Construct the accumulator with ``quantile_method='exact'`` (or pass the same argument to
+    :py:meth:`Rag.compute_features() <ilastikrag.rag.Rag.compute_features>`) to compute exact
+    quantiles instead, by sorting all edge values, or with ``quantile_method='sketch'`` to
+    compute mergeable approximate quantiles (with bounded memory) via a ``QuantileSketch``.
+    See :py:data:`~ilastikrag.accumulators.standard.quantile_util.QUANTILE_METHODS` for the trade-offs.
+
+    Construct the accumulator with ``keep_statistics=True`` to also collect the (mergeable)
+    sufficient statistics of each edge in a :py:class:`LabelStatistics` object,
+    available via :py:meth:`sufficient_statistics()` until ``cleanup()`` is called.
+    (With ``quantile_method='sketch'``, the statistics include a quantile sketch.)
     """
 
 #     TODO
@@ -45,7 +72,9 @@ class StandardEdgeAccumulator(BaseEdgeAccumulator):
     ACCUMULATOR_ID = 'standard'
     ACCUMULATOR_TYPE = 'edge'
 
-    def __init__(self, rag, feature_names):
+    def __init__(self, rag, feature_names, quantile_method='histogram', keep_statistics=False):
+        assert quantile_method in QUANTILE_METHODS, \
+            "Unknown quantile_method: {}".format( quantile_method )
         self.cleanup() # Initialize members
         feature_names = list(feature_names)
 
@@ -61,11 +90,52 @@ class StandardEdgeAccumulator(BaseEdgeAccumulator):
                               'standard_edge_quantiles_90',
                               'standard_edge_quantiles_100']
 
+        # 'standard_edge_histogram_<nbins>' is shorthand for all of its bins
+        feature_names = expand_histogram_feature_names(feature_names)
+
+        self._quantile_method = quantile_method
+        self._keep_statistics = keep_statistics
+        self._all_feature_names = feature_names
+        self._edge_labels = None
+        self.select_output_columns(feature_names)
+
+        dense_axes = ''.join(rag.dense_edge_tables.keys())
+        self._num_edges = len(rag.unique_edge_tables[dense_axes])
+
+    def select_output_columns(self, column_names):
+        assert set(column_names) <= set(self._all_feature_names), \
+            "Unknown output columns: {}".format( set(column_names) - set(self._all_feature_names) )
+        feature_names = filter(lambda name: name in column_names, self._all_feature_names)
+
         self._feature_names = feature_names
         self._vigra_feature_names = get_vigra_feature_names(feature_names)
 
+        # We compute the histograms ourselves, not with vigra.
+        self._histogram_bin_counts = sorted(set( get_histogram_bin_count(name) for name in feature_names if '_histogram_' in name ))
+        if self._histogram_bin_counts:
+            self._vigra_feature_names.remove('histogram')
+
+        self._quantile_percents = [ get_quantile_percent(name) for name in feature_names if '_quantiles_' in name ]
+        if self._quantile_method != 'histogram' and self._quantile_percents:
+            # vigra won't compute the quantiles; we'll compute them ourselves.
+            self._vigra_feature_names.remove('quantiles')
+            if self._quantile_method == 'sketch' and set([0.0, 100.0]) & set(self._quantile_percents):
+                # Quantiles 0 and 100 are taken from the (exact) min/max instead of the sketch.
+                self._vigra_feature_names = list(set(self._vigra_feature_names) | set(['minimum', 'maximum']))
+
     def cleanup(self):
         self._vigra_acc = None
+        self._quantile_acc = None
+        self._histogram_acc = None
+        self._statistics = None
+
+    def sufficient_statistics(self):
+        """
+        Return the :py:class:`LabelStatistics` of all ingested edge values (indexed by ``edge_label``).
+        Requires ``keep_statistics=True``.
+        """
+        assert self._keep_statistics, "Construct the accumulator with keep_statistics=True"
+        return self._statistics
     
     def ingest_edges(self, rag, edge_values):
         """
@@ -75,20 +145,55 @@ class StandardEdgeAccumulator(BaseEdgeAccumulator):
         The accumulator's 'region' indexes will correspond to the 'edge_label'
         column from the given DataFrames.
         """
-        if edge_values is None:
-            assert self._vigra_feature_names == ['count'], \
-                "Can't compute edge features without a value image (except for standard_edge_count)"
-
-        # Compute histogram_range across all axes (if quantiles are needed)
-        if set(['quantiles', 'histogram']) & set(self._vigra_feature_names):
+        # Compute histogram_range across all axes (if quantiles or histograms are needed)
+        if edge_values is not None and self.requires_value_range():
             logger.debug("Computing global histogram range...")
             histogram_range = [min(map(np.min, edge_values.values())),
                                max(map(np.max, edge_values.values()))]
         else:
             histogram_range = "globalminmax"
 
-        axial_accumulators = []
-        for axiskey, dense_edge_table in rag.dense_edge_tables.items():
+        self._vigra_acc = None
+        self._quantile_acc = None
+        self._histogram_acc = None
+        self._statistics = None
+        self._ingest_axis_tables(rag.dense_edge_tables, edge_values, histogram_range)
+
+    def requires_value_range(self):
+        return bool(set(['quantiles', 'histogram']) & set(self._vigra_feature_names)) or bool(self._histogram_bin_counts)
+
+    def ingest_edges_for_block(self, rag, dense_edge_tables, edge_values, value_range):
+        # The histogram range must be the same for every block,
+        # so we use the range of the whole value image.
+        if self.requires_value_range():
+            histogram_range = list(value_range)
+        else:
+            histogram_range = "globalminmax"
+
+        self._ingest_axis_tables(dense_edge_tables, edge_values, histogram_range)
+
+    def _ingest_axis_tables(self, dense_edge_tables, edge_values, histogram_range):
+        """
+        Compute region features for the given dense_edge_tables (one per axis),
+        and merge them into self._vigra_acc.
+        """
+        if edge_values is None:
+            assert self._vigra_feature_names == ['count'] and not (self._quantile_percents or self._histogram_bin_counts), \
+                "Can't compute edge features without a value image (except for standard_edge_count)"
+
+        if self._quantile_method != 'histogram' and self._quantile_percents and self._quantile_acc is None:
+            self._quantile_acc = create_quantile_accumulator(self._quantile_method, self._num_edges, self._quantile_percents)
+        if self._histogram_bin_counts and self._histogram_acc is None:
+            self._histogram_acc = LabelHistogramAccumulator(self._num_edges, self._histogram_bin_counts)
+        if self._keep_statistics and self._statistics is None:
+            assert edge_values is not None, "Can't compute edge statistics without a value image"
+            self._statistics = LabelStatistics(self._num_edges, quantile_sketch=(self._quantile_method == 'sketch'))
+
+        for axiskey, dense_edge_table in dense_edge_tables.items():
+            if len(dense_edge_table) == 0:
+                # Nothing to do (e.g. no edges along this axis in the current block)
+                continue
+
             logger.debug("Axis {}: Computing region features...".format( axiskey ))
             
             edge_labels = dense_edge_table['edge_label'].values
@@ -99,25 +204,63 @@ class StandardEdgeAccumulator(BaseEdgeAccumulator):
                 # We'll give it some garbage:
                 # Just cast the labels as if they were float.
                 edge_values_thisaxis = edge_labels.view(np.float32)
+
+            if self._quantile_acc is not None:
+                self._quantile_acc.ingest(edge_labels, edge_values_thisaxis)
+            if self._histogram_acc is not None:
+                self._histogram_acc.ingest(edge_labels, edge_values_thisaxis, histogram_range)
+            if self._statistics is not None:
+                self._statistics.ingest(edge_labels, edge_values_thisaxis)
+
+            if not self._vigra_feature_names:
+                continue
         
             # Must add an extra singleton axis here because vigra doesn't support 1D data
             acc = vigra.analysis.extractRegionFeatures( edge_values_thisaxis.reshape((1,-1), order='A'),
                                                         edge_labels.reshape((1,-1), order='A'),
                                                         features=self._vigra_feature_names,
                                                         histogramRange=histogram_range )
-            axial_accumulators.append(acc)
-
-        final_acc = axial_accumulators[0].createAccumulator()
-        for acc in axial_accumulators:
-            # This is an identity lookup, but it's necessary since vigra will complain 
-            # about different maxIds if we call merge() without a lookup 
-            axis_to_final_index_array = np.arange( acc.maxRegionLabel()+1, dtype=np.uint32 )
-            final_acc.merge( acc, axis_to_final_index_array )
-        self._vigra_acc = final_acc
+            self._vigra_acc = merge_vigra_accumulators(self._vigra_acc, acc)
 
     def append_edge_features_to_df(self, edge_df):
         # Add the vigra accumulator results to the dataframe
-        return append_vigra_features_to_dataframe(self._vigra_acc, edge_df, self._feature_names, overwrite_quantile_minmax=True)
+        for feature_name in self._feature_names:
+            edge_df[feature_name] = pd.Series(self._get_feature_column(feature_name), dtype=np.float32, index=edge_df.index)
+        return edge_df
+
+    def output_column_names(self):
+        return list(self._all_feature_names)
+
+    def select_edges(self, edge_labels):
+        self._edge_labels = edge_labels
+        return True
+
+    def write_edge_features(self, edge_ids, out_columns):
+        for feature_name, out_column in out_columns.items():
+            out_column[:] = self._get_feature_column(feature_name)
+
+    def _get_feature_column(self, feature_name):
+        """
+        Return the values of the given feature for the selected edges (see select_edges()),
+        as a float32 array.
+        """
+        column = self._get_all_edges_column(feature_name)
+        if self._edge_labels is not None:
+            column = column[self._edge_labels]
+        return column
+
+    def _get_all_edges_column(self, feature_name):
+        """
+        Return the values of the given feature, as a float32 array indexed by edge_label.
+        (Edges beyond the largest ingested edge_label may be missing.)
+        """
+        if '_histogram_' in feature_name:
+            return self._histogram_acc.histogram_column(feature_name)
+        if self._quantile_acc is not None and '_quantiles_' in feature_name:
+            percent = get_quantile_percent(feature_name)
+            if not (self._quantile_method == 'sketch' and percent in (0.0, 100.0)):
+                return self._quantile_acc.quantile_column(percent)
+        return get_vigra_feature_column(self._vigra_acc, feature_name, overwrite_quantile_minmax=True)
     
     @classmethod
     def supported_features(cls, rag):
@@ -137,5 +280,6 @@ class StandardEdgeAccumulator(BaseEdgeAccumulator):
                  'standard_edge_quantiles_75',
                  'standard_edge_quantiles_90',
                  'standard_edge_quantiles_100' ]
+        names += [ 'standard_edge_histogram_{}'.format(bin_count) for bin_count in HISTOGRAM_BIN_COUNTS ]
         return names
     
@@ -1,10 +1,13 @@
 import logging
 import numpy as np
-import pandas as pd
-import vigra
+
+from ilastikrag.lazy_import import lazy_import
+pd = lazy_import('pandas')
+vigra = lazy_import('vigra')
 
 from ilastikrag.accumulators import BaseFlatEdgeAccumulator
-from .vigra_util import get_vigra_feature_names, append_vigra_features_to_dataframe
+from .vigra_util import get_vigra_feature_names, get_vigra_feature_column, merge_vigra_accumulators
+from .quantile_util import QUANTILE_METHODS, get_quantile_percent, create_quantile_accumulator
 
 logger = logging.getLogger(__name__)
 
@@ -52,11 +55,20 @@ class StandardFlatEdgeAccumulator(BaseFlatEdgeAccumulator):
     ..
         
         - standard_flatedge_correlation
+
+    By default, the quantiles are estimated from a histogram of each edge's values.
+    Construct the accumulator with ``quantile_method='exact'`` (or pass the same argument to
+    :py:meth:`Rag.compute_features() <ilastikrag.rag.Rag.compute_features>`) to compute exact
+    quantiles instead, by sorting all edge values, or with ``quantile_method='sketch'`` to
+    compute mergeable approximate quantiles (with bounded memory) via a ``QuantileSketch``.
+    See :py:data:`~ilastikrag.accumulators.standard.quantile_util.QUANTILE_METHODS` for the trade-offs.
     """
     ACCUMULATOR_ID = 'standard'
     ACCUMULATOR_TYPE = 'flatedge'
     
-    def __init__(self, rag, feature_names):
+    def __init__(self, rag, feature_names, quantile_method='histogram'):
+        assert quantile_method in QUANTILE_METHODS, \
+            "Unknown quantile_method: {}".format( quantile_method )
         self.cleanup() # Initialize members
         feature_names = list(feature_names)
 
@@ -86,15 +98,36 @@ class StandardFlatEdgeAccumulator(BaseFlatEdgeAccumulator):
                               'standard_flatedge_regionaxes_1x',
                               'standard_flatedge_regionaxes_1y']
         
+        self._quantile_method = quantile_method
+        self._all_feature_names = feature_names
+        self._edge_labels = None
+        self.select_output_columns(feature_names)
+        self._num_edges = len(rag.unique_edge_tables['z'])
+
+    def select_output_columns(self, column_names):
+        assert set(column_names) <= set(self._all_feature_names), \
+            "Unknown output columns: {}".format( set(column_names) - set(self._all_feature_names) )
+        feature_names = filter(lambda name: name in column_names, self._all_feature_names)
+
         self._feature_names = feature_names
         self._vigra_feature_names = get_vigra_feature_names(feature_names)
+
+        self._quantile_percents = [ get_quantile_percent(name) for name in feature_names if '_quantiles_' in name ]
+        if self._quantile_method != 'histogram' and self._quantile_percents:
+            # vigra won't compute the quantiles; we'll compute them ourselves.
+            self._vigra_feature_names.remove('quantiles')
+            if self._quantile_method == 'sketch' and set([0.0, 100.0]) & set(self._quantile_percents):
+                # Quantiles 0 and 100 are taken from the (exact) min/max instead of the sketch.
+                self._vigra_feature_names = list(set(self._vigra_feature_names) | set(['minimum', 'maximum']))
     
     def cleanup(self):
         self._vigra_acc = None
+        self._region_vigra_acc = None
+        self._quantile_acc = None
 
     def ingest_values(self, rag, value_img):
         if value_img is None:
-            assert self._vigra_feature_names == ['count'], \
+            assert self._vigra_feature_names == ['count'] and not self._quantile_percents, \
                 "Can't compute flatedge features without a value image (except for standard_flatedge_count)"
 
         if value_img is not None:
@@ -112,14 +145,107 @@ class StandardFlatEdgeAccumulator(BaseFlatEdgeAccumulator):
             value_img = rag.label_img[:-1].view(np.float32)
             value_img = vigra.taggedView(value_img, rag.label_img.axistags)
 
-        self._vigra_acc = vigra.analysis.extractRegionFeatures( value_img,
-                                                                rag.flat_edge_label_img,
-                                                                features=self._vigra_feature_names,
-                                                                histogramRange="globalminmax" )
+        if self._quantile_method != 'histogram' and self._quantile_percents:
+            self._quantile_acc = create_quantile_accumulator(self._quantile_method, self._num_edges, self._quantile_percents)
+            self._quantile_acc.ingest(rag.flat_edge_label_img, value_img)
+
+        if self._vigra_feature_names:
+            self._vigra_acc = vigra.analysis.extractRegionFeatures( value_img,
+                                                                    rag.flat_edge_label_img,
+                                                                    features=self._vigra_feature_names,
+                                                                    histogramRange="globalminmax" )
+
+    def requires_value_range(self):
+        return bool(set(['quantiles', 'histogram']) & set(self._vigra_feature_names))
+
+    def ingest_values_for_block(self, rag, block_start, block_stop, value_block, value_range):
+        flat_edge_label_img = rag.flat_edge_label_img
+
+        # The coordinate-based features ('regionradii', 'regionaxes') don't depend on the pixel values,
+        # so we compute them just once, over the entire flat_edge_label_img (which is in RAM anyway).
+        region_feature_names = filter(lambda name: name.startswith('region'), self._vigra_feature_names)
+        value_feature_names = filter(lambda name: not name.startswith('region'), self._vigra_feature_names)
+
+        if region_feature_names and self._region_vigra_acc is None:
+            logger.debug("Computing flatedge region features...")
+            dummy_values = vigra.taggedView(flat_edge_label_img.view(np.float32), flat_edge_label_img.axistags)
+            self._region_vigra_acc = vigra.analysis.extractRegionFeatures( dummy_values,
+                                                                           flat_edge_label_img,
+                                                                           features=region_feature_names )
+
+        block_stop = min(block_stop, flat_edge_label_img.shape[0])
+        exact_quantiles = (self._quantile_method != 'histogram' and self._quantile_percents)
+        if not (value_feature_names or exact_quantiles) or block_start >= block_stop:
+            # (The last slice of the volume has no z-edges of its own.)
+            return
+
+        logger.debug("Computing flatedge features for block {}-{}...".format( block_start, block_stop ))
+
+        # Average the values on either side of each flat edge.
+        # (value_block includes the halo slice we need.)
+        value_block = value_block[:block_stop-block_start+1].astype(np.float32, copy=False)
+        value_block = (value_block[1:] + value_block[:-1]) / 2.
+
+        if exact_quantiles:
+            if self._quantile_acc is None:
+                self._quantile_acc = create_quantile_accumulator(self._quantile_method, self._num_edges, self._quantile_percents)
+            self._quantile_acc.ingest(flat_edge_label_img[block_start:block_stop], value_block)
+
+        if not value_feature_names:
+            return
+
+        if self.requires_value_range():
+            histogram_range = list(value_range)
+        else:
+            histogram_range = "globalminmax"
+
+        acc = vigra.analysis.extractRegionFeatures( value_block,
+                                                    flat_edge_label_img[block_start:block_stop],
+                                                    features=value_feature_names,
+                                                    histogramRange=histogram_range )
+        self._vigra_acc = merge_vigra_accumulators(self._vigra_acc, acc)
 
     def append_edge_features_to_df(self, edge_df):
         # Add the vigra accumulator results to the dataframe
-        return append_vigra_features_to_dataframe(self._vigra_acc, edge_df, self._feature_names, overwrite_quantile_minmax=True)
+        for feature_name in self._feature_names:
+            edge_df[feature_name] = pd.Series(self._get_feature_column(feature_name), dtype=np.float32, index=edge_df.index)
+        return edge_df
+
+    def output_column_names(self):
+        return list(self._all_feature_names)
+
+    def select_edges(self, edge_labels):
+        self._edge_labels = edge_labels
+        return True
+
+    def write_edge_features(self, edge_ids, out_columns):
+        for feature_name, out_column in out_columns.items():
+            out_column[:] = self._get_feature_column(feature_name)
+
+    def _get_feature_column(self, feature_name):
+        """
+        Return the values of the given feature for the selected edges (see select_edges()),
+        as a float32 array.
+        """
+        column = self._get_all_edges_column(feature_name)
+        if self._edge_labels is not None:
+            column = column[self._edge_labels]
+        return column
+
+    def _get_all_edges_column(self, feature_name):
+        """
+        Return the values of the given feature, as a float32 array indexed by edge_label.
+        (Edges beyond the largest ingested edge_label may be missing.)
+        """
+        if self._quantile_acc is not None and '_quantiles_' in feature_name:
+            percent = get_quantile_percent(feature_name)
+            if not (self._quantile_method == 'sketch' and percent in (0.0, 100.0)):
+                return self._quantile_acc.quantile_column(percent)
+
+        # If we ingested blockwise, the region features live in a separate accumulator.
+        if self._region_vigra_acc is not None and feature_name.split('_')[2].startswith('region'):
+            return get_vigra_feature_column(self._region_vigra_acc, feature_name)
+        return get_vigra_feature_column(self._vigra_acc, feature_name, overwrite_quantile_minmax=True)
 
     @classmethod
     def supported_features(cls, rag):
@@ -1,10 +1,15 @@
 import logging
 import numpy as np
-import pandas as pd
-import vigra
+
+from ilastikrag.lazy_import import lazy_import
+vigra = lazy_import('vigra')
 
 from ilastikrag.accumulators import BaseSpAccumulator
-from .vigra_util import get_vigra_feature_names, append_vigra_features_to_dataframe
+from .vigra_util import get_vigra_feature_names, get_vigra_feature_column, merge_vigra_accumulators
+from .quantile_util import QUANTILE_METHODS, get_quantile_percent, create_quantile_accumulator
+from .histogram_util import HISTOGRAM_BIN_COUNTS, get_histogram_bin_count, expand_histogram_feature_names, \
+                            LabelHistogramAccumulator
+from .label_statistics import LabelStatistics
 
 logger = logging.getLogger(__name__)
 
@@ -55,11 +60,30 @@ class StandardSpAccumulator(BaseSpAccumulator):
         - standard_sp_regionaxes_2y
         - standard_sp_regionaxes_2z
 
+    ..
+
+        - standard_sp_histogram_<nbins> (``nbins`` features: ``standard_sp_histogram_<nbins>_0``, ``..._1``, etc.)
+
+    The histogram features count the pixels of each superpixel in each of ``nbins`` equal-width bins
+    (``nbins`` must be one of :py:data:`~ilastikrag.accumulators.standard.histogram_util.HISTOGRAM_BIN_COUNTS`),
+    spanning the range of the entire value image.
+
     All input feature names result in *two* output columns, for the ``_sum`` and ``_difference``
     between the two superpixels adjacent to the edge.
 
     As a special case, the output columns for the ``sp_count`` feature are 
     reduced via cube-root (or square-root), as specified in the multicut paper.
+
+    By default, the quantiles are estimated from a histogram of each superpixel's values.
+    Construct the accumulator with ``quantile_method='exact'`` (or pass the same argument to
+    :py:meth:`Rag.compute_features() <ilastikrag.rag.Rag.compute_features>`) to compute exact
+    quantiles instead, by sorting all pixel values, or with ``quantile_method='sketch'`` to
+    compute mergeable approximate quantiles (with bounded memory) via a ``QuantileSketch``.
+    See :py:data:`~ilastikrag.accumulators.standard.quantile_util.QUANTILE_METHODS` for the trade-offs.
+
+    Construct the accumulator with ``keep_statistics=True`` to also collect the (mergeable)
+    sufficient statistics of each superpixel in a :py:class:`LabelStatistics` object,
+    available via :py:meth:`sufficient_statistics()` until ``cleanup()`` is called.
     """
 
     # TODO
@@ -70,7 +94,9 @@ class StandardSpAccumulator(BaseSpAccumulator):
     ACCUMULATOR_ID = 'standard'
     ACCUMULATOR_TYPE = 'sp'
 
-    def __init__(self, rag, feature_names):
+    def __init__(self, rag, feature_names, quantile_method='histogram', keep_statistics=False):
+        assert quantile_method in QUANTILE_METHODS, \
+            "Unknown quantile_method: {}".format( quantile_method )
         self.cleanup() # Initialize members
         feature_names = list(feature_names)
         label_img = rag.label_img
@@ -100,12 +126,61 @@ class StandardSpAccumulator(BaseSpAccumulator):
                 for axisname in map( lambda k: 'xyz'[k], range(label_img.ndim) ):
                     feature_names.append( 'standard_sp_regionaxes_{}{}'.format( component_index, axisname ) )            
         
+        # 'standard_sp_histogram_<nbins>' is shorthand for all of its bins
+        feature_names = expand_histogram_feature_names(feature_names)
+
+        self._ndim = label_img.ndim
+        self._num_sp_labels = rag.max_sp+1
+        self._quantile_method = quantile_method
+        self._keep_statistics = keep_statistics
+        self._all_feature_names = feature_names
+        self.select_output_columns(self.output_column_names())
+
+    def output_column_names(self):
+        column_names = []
+        for sp_feature in self._all_feature_names:
+            column_names += [sp_feature + '_sum', sp_feature + '_difference']
+        return column_names
+
+    def select_output_columns(self, column_names):
+        unknown_columns = set(column_names) - set(self.output_column_names())
+        assert not unknown_columns, "Unknown output columns: {}".format( unknown_columns )
+
+        # Each sp feature is needed if either of its output columns is selected.
+        self._output_columns = list(column_names)
+        feature_names = filter( lambda name: name + '_sum' in column_names or name + '_difference' in column_names,
+                                self._all_feature_names )
+
         self._feature_names = feature_names
         self._vigra_feature_names = get_vigra_feature_names(feature_names)
-        self._ndim = label_img.ndim
+
+        # We compute the histograms ourselves, not with vigra.
+        self._histogram_bin_counts = sorted(set( get_histogram_bin_count(name) for name in feature_names if '_histogram_' in name ))
+        if self._histogram_bin_counts:
+            self._vigra_feature_names.remove('histogram')
+
+        self._quantile_percents = [ get_quantile_percent(name) for name in feature_names if '_quantiles_' in name ]
+        if self._quantile_method != 'histogram' and self._quantile_percents:
+            # vigra won't compute the quantiles; we'll compute them ourselves.
+            self._vigra_feature_names.remove('quantiles')
+            if self._quantile_method == 'sketch' and set([0.0, 100.0]) & set(self._quantile_percents):
+                # Quantiles 0 and 100 are taken from the (exact) min/max instead of the sketch.
+                self._vigra_feature_names = list(set(self._vigra_feature_names) | set(['minimum', 'maximum']))
     
     def cleanup(self):
         self._vigra_acc = None
+        self._region_vigra_acc = None
+        self._quantile_acc = None
+        self._histogram_acc = None
+        self._statistics = None
+
+    def sufficient_statistics(self):
+        """
+        Return the :py:class:`LabelStatistics` of all ingested pixel values (indexed by sp id).
+        Requires ``keep_statistics=True``.
+        """
+        assert self._keep_statistics, "Construct the accumulator with keep_statistics=True"
+        return self._statistics
 
     def ingest_values(self, rag, value_img):
         logger.debug("Computing SP features...")
@@ -120,88 +195,182 @@ class StandardSpAccumulator(BaseSpAccumulator):
             for feat in self._vigra_feature_names:
                 assert feat.startswith('region') or feat == 'count', \
                     "Can't compute feature {} without a value image!"
+            assert not (self._quantile_percents or self._histogram_bin_counts), \
+                "Can't compute quantiles or histograms without a value image!"
+            assert not self._keep_statistics, "Can't compute sp statistics without a value image!"
             
             # Vigra wants a value image, even though we won't be using it.
             # We'll give it some garbage:
             # Just cast the labels as if they were float.
             value_img = rag.label_img.view(np.float32)
-        
-        self._vigra_acc = vigra.analysis.extractRegionFeatures( value_img,
-                                                                rag.label_img,
-                                                                features=self._vigra_feature_names,
-                                                                histogramRange="globalminmax" )
-    
-    def append_edge_features_to_df(self, edge_df):
-        # Create an almost-empty dataframe to store the sp features
-        logger.debug("Saving SP features to DataFrame...")
-        index_u32 = pd.Index(np.arange(self._vigra_acc.maxRegionLabel()+1), dtype=np.uint32)
-        sp_df = pd.DataFrame({ 'sp_id' : np.arange(self._vigra_acc.maxRegionLabel()+1, dtype=np.uint32) }, index=index_u32)
 
-        # Add the vigra accumulator results to the SP dataframe
-        sp_df = append_vigra_features_to_dataframe(self._vigra_acc, sp_df, self._feature_names, overwrite_quantile_minmax=True)
-        
-        # Combine SP features and append to the edge_df
-        edge_df = self._append_sp_features_onto_edge_features( edge_df, sp_df )
-        return edge_df
+        if self._keep_statistics:
+            self._statistics = self._create_statistics()
+            self._statistics.ingest(rag.label_img, value_img)
+
+        if self._quantile_method != 'histogram' and self._quantile_percents:
+            self._quantile_acc = create_quantile_accumulator(self._quantile_method, self._num_sp_labels, self._quantile_percents)
+            self._quantile_acc.ingest(rag.label_img, value_img)
+
+        if self._histogram_bin_counts:
+            value_range = (value_img.min(), value_img.max())
+            self._histogram_acc = LabelHistogramAccumulator(self._num_sp_labels, self._histogram_bin_counts)
+            self._histogram_acc.ingest(rag.label_img, value_img, value_range)
+
+        if self._vigra_feature_names:
+            self._vigra_acc = vigra.analysis.extractRegionFeatures( value_img,
+                                                                    rag.label_img,
+                                                                    features=self._vigra_feature_names,
+                                                                    histogramRange="globalminmax" )
+
+    def requires_value_range(self):
+        return bool(set(['quantiles', 'histogram']) & set(self._vigra_feature_names)) or bool(self._histogram_bin_counts)
+
+    def ingest_values_for_block(self, rag, block_start, block_stop, value_block, value_range):
+        # The coordinate-based features ('regionradii', 'regionaxes') can't be merged across
+        # blocks, since vigra computes them in block-local coordinates.
+        # But they don't depend on the pixel values, so we compute them just once,
+        # over the entire label image (which is in RAM anyway).
+        region_feature_names = filter(lambda name: name.startswith('region'), self._vigra_feature_names)
+        value_feature_names = filter(lambda name: not name.startswith('region'), self._vigra_feature_names)
+
+        if region_feature_names and self._region_vigra_acc is None:
+            logger.debug("Computing SP region features...")
+            self._region_vigra_acc = vigra.analysis.extractRegionFeatures( rag.label_img.view(np.float32),
+                                                                           rag.label_img,
+                                                                           features=region_feature_names )
+
+        label_block = rag.label_img[block_start:block_stop]
+        value_block = value_block[:block_stop-block_start].astype(np.float32, copy=False)
+
+        if self._quantile_method != 'histogram' and self._quantile_percents:
+            if self._quantile_acc is None:
+                self._quantile_acc = create_quantile_accumulator(self._quantile_method, self._num_sp_labels, self._quantile_percents)
+            self._quantile_acc.ingest(label_block, value_block)
+
+        if self._histogram_bin_counts:
+            if self._histogram_acc is None:
+                self._histogram_acc = LabelHistogramAccumulator(self._num_sp_labels, self._histogram_bin_counts)
+            self._histogram_acc.ingest(label_block, value_block, value_range)
 
+        if self._keep_statistics:
+            if self._statistics is None:
+                self._statistics = self._create_statistics()
+            self._statistics.ingest(label_block, value_block)
 
-    def _append_sp_features_onto_edge_features(self, edge_df, sp_df):
+        if not value_feature_names:
+            return
+
+        logger.debug("Computing SP features for block {}-{}...".format( block_start, block_stop ))
+        if self.requires_value_range():
+            histogram_range = list(value_range)
+        else:
+            histogram_range = "globalminmax"
+
+        acc = vigra.analysis.extractRegionFeatures( value_block,
+                                                    label_block,
+                                                    features=value_feature_names,
+                                                    histogramRange=histogram_range )
+        self._vigra_acc = merge_vigra_accumulators(self._vigra_acc, acc)
+    
+    def _create_statistics(self):
+        return LabelStatistics(self._num_sp_labels, quantile_sketch=(self._quantile_method == 'sketch'))
+
+    def append_edge_features_to_df(self, edge_df):
         """
-        Given a DataFrame with edge features and another DataFrame with superpixel features,
-        add columns to the edge_df for each of the names in self._feature_names.
-        
         For each sp feature, *two* columns are added to the output, for the sum and (absolute)
         difference between the feature values for the two superpixels adjacent to the edge.
 
         As a special case, the 'count' and 'sum' sp features are normalized first, by
         taking their cube roots (or square roots), as indicated in the Multicut paper.
-        
-        Returns the augmented edge_df.
-
-        Parameters
-        ----------
-        edge_df
-            The dataframe with edge features.
-            First columns must be 'sp1', 'sp2'.
-            len(edge_df) == self.num_edges
-                 
-        sp_df
-            The dataframe with raw superpixel features.
-            First column must be 'sp_id'.
-            len(sp_df) == self.num_sp
         """
-        # Add two columns to the edge_df for every sp_df column (for sp1 and sp2)
-        # note: pd.merge() is like a SQL 'join' operation.
-        edge_df = pd.merge( edge_df, sp_df, left_on=['sp1'], right_on=['sp_id'], how='left', copy=False)
-        edge_df = pd.merge( edge_df, sp_df, left_on=['sp2'], right_on=['sp_id'], how='left', copy=False, suffixes=('_sp1', '_sp2'))
-        del edge_df['sp_id_sp1']
-        del edge_df['sp_id_sp2']
-    
-        # Now create sum/difference columns
-        for sp_feature in self._feature_names:
-            sp_feature_sum = ( edge_df[sp_feature + '_sp1'].values
-                             + edge_df[sp_feature + '_sp2'].values )
+        logger.debug("Broadcasting SP features onto edges...")
+        sp1 = edge_df['sp1'].values
+        sp2 = edge_df['sp2'].values
+
+        # Only the selected output columns are added
+        output_columns = set(self._output_columns)
+        for block_start in range(0, len(self._feature_names), self.FEATURE_BLOCK_SIZE):
+            block_names = self._feature_names[block_start:block_start+self.FEATURE_BLOCK_SIZE]
+            sums, differences = self._broadcast_sp_features_onto_edges( block_names, sp1, sp2 )
+            for sp_feature, sum_column, difference_column in zip(block_names, sums, differences):
+                if sp_feature + '_sum' in output_columns:
+                    edge_df[sp_feature + '_sum'] = sum_column
+                if sp_feature + '_difference' in output_columns:
+                    edge_df[sp_feature + '_difference'] = difference_column
+
+        return edge_df
+
+    def write_edge_features(self, edge_ids, out_columns):
+        # Only broadcast the sp features for the given columns
+        feature_names = filter( lambda name: name + '_sum' in out_columns or name + '_difference' in out_columns,
+                                self._feature_names )
+
+        for block_start in range(0, len(feature_names), self.FEATURE_BLOCK_SIZE):
+            block_names = feature_names[block_start:block_start+self.FEATURE_BLOCK_SIZE]
+            sums, differences = self._broadcast_sp_features_onto_edges( block_names, edge_ids[:,0], edge_ids[:,1] )
+            for sp_feature, sum_column, difference_column in zip(block_names, sums, differences):
+                if sp_feature + '_sum' in out_columns:
+                    out_columns[sp_feature + '_sum'][:] = sum_column
+                if sp_feature + '_difference' in out_columns:
+                    out_columns[sp_feature + '_difference'][:] = difference_column
+
+    #: The sp features are broadcast onto the edges in blocks of this many features,
+    #: to limit the size of temporary arrays.
+    FEATURE_BLOCK_SIZE = 16
+
+    def _broadcast_sp_features_onto_edges(self, feature_names, sp1, sp2):
+        """
+        For the given sp features, gather the feature values for each edge's superpixels (sp1, sp2)
+        and compute the sum and (absolute) difference between them.
+
+        Returns
+        -------
+        (sums, differences)
+            Two float32 arrays, each of shape ``(len(feature_names), len(sp1))``,
+            i.e. one row per feature (and one column per edge).
+        """
+        # The raw sp features, one row per feature, indexed by sp id
+        sp_feature_columns = map(self._get_sp_feature_column, feature_names)
+        num_labels = max(map(len, sp_feature_columns))
+        sp_features = np.zeros( (len(feature_names), num_labels), dtype=np.float32 )
+        for feature_index, column in enumerate(sp_feature_columns):
+            sp_features[feature_index, :len(column)] = column
+        del sp_feature_columns
+
+        # Allocate the output and gather the sp1 values into it directly.
+        sums, differences = np.empty( (2, len(feature_names), len(sp1)), dtype=np.float32 )
+        np.take(sp_features, sp1, axis=1, out=sums)
+        sp2_features = np.take(sp_features, sp2, axis=1)
+
+        np.subtract(sums, sp2_features, out=differences)
+        np.abs(differences, out=differences)
+        sums += sp2_features
+        del sp2_features
+
+        for feature_index, sp_feature in enumerate(feature_names):
             if sp_feature.endswith('_count') or sp_feature.endswith('_sum'):
                 # Special case for count
-                sp_feature_sum = np.power(sp_feature_sum,
-                                          np.float32(1./self._ndim),
-                                          out=sp_feature_sum)
-            edge_df[sp_feature + '_sum'] = sp_feature_sum
-    
-            sp_feature_difference = ( edge_df[sp_feature + '_sp1'].values
-                                    - edge_df[sp_feature + '_sp2'].values )
-            sp_feature_difference = np.abs(sp_feature_difference, out=sp_feature_difference)
-            if sp_feature.endswith('_count') or sp_feature.endswith('_sum'):
-                sp_feature_difference = np.power(sp_feature_difference,
-                                                 np.float32(1./self._ndim),
-                                                 out=sp_feature_difference)
-            edge_df[sp_feature + '_difference'] = sp_feature_difference
-    
-            # Don't need these any more
-            del edge_df[sp_feature + '_sp1']
-            del edge_df[sp_feature + '_sp2']
-        
-        return edge_df
+                np.power( sums[feature_index], np.float32(1./self._ndim), out=sums[feature_index] )
+                np.power( differences[feature_index], np.float32(1./self._ndim), out=differences[feature_index] )
+
+        return sums, differences
+
+    def _get_sp_feature_column(self, sp_feature):
+        """
+        Return the raw values of the given sp feature, as a float32 array indexed by sp id.
+        """
+        if '_histogram_' in sp_feature:
+            return self._histogram_acc.histogram_column(sp_feature)
+        if self._quantile_acc is not None and '_quantiles_' in sp_feature:
+            percent = get_quantile_percent(sp_feature)
+            if not (self._quantile_method == 'sketch' and percent in (0.0, 100.0)):
+                return self._quantile_acc.quantile_column(percent)
+
+        # If we ingested blockwise, the region features live in a separate accumulator.
+        if self._region_vigra_acc is not None and sp_feature.split('_')[2].startswith('region'):
+            return get_vigra_feature_column(self._region_vigra_acc, sp_feature)
+        return get_vigra_feature_column(self._vigra_acc, sp_feature, overwrite_quantile_minmax=True)
 
     @classmethod
     def supported_features(cls, rag):
@@ -222,6 +391,8 @@ class StandardSpAccumulator(BaseSpAccumulator):
                  'standard_sp_quantiles_90',
                  'standard_sp_quantiles_100' ]
 
+        names += [ 'standard_sp_histogram_{}'.format(bin_count) for bin_count in HISTOGRAM_BIN_COUNTS ]
+
         names += ['standard_sp_regionradii',
                   'standard_sp_regionradii_0',
                   'standard_sp_regionradii_1']
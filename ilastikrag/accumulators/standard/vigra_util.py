@@ -1,5 +1,7 @@
 import numpy as np
-import pandas as pd
+
+from ilastikrag.lazy_import import lazy_import
+pd = lazy_import('pandas')
 
 def append_vigra_features_to_dataframe( acc, df, feature_names, replace_nan=0.0, overwrite_quantile_minmax=False):
     """
@@ -31,43 +33,55 @@ def append_vigra_features_to_dataframe( acc, df, feature_names, replace_nan=0.0,
         that was chosen before min/max were chosen.
         (If not, then the values will be the same anyway.)
     """
-    # Add a column for each feature we'll need
-    vigra_feature_names = map(lambda name: name.split('_')[2], feature_names )
-    for feature_name, vigra_feature_name in zip(feature_names, vigra_feature_names):
-        if 'quantiles' in feature_name:
-            quantile_suffix = feature_name.split('_')[-1]
-
-            # Special treatment for 'minimum' and 'maximum',
-            # because 'quantile_0' and 'quantile_100' are the min/max for the first block only,
-            # whereas 'minimum' and 'maximum' are global to all blocks.
-            if overwrite_quantile_minmax and quantile_suffix == '0':
-                df[feature_name] = pd.Series(acc['minimum'], dtype=np.float32, index=df.index)
-            if overwrite_quantile_minmax and quantile_suffix == '100':
-                df[feature_name] = pd.Series(acc['maximum'], dtype=np.float32, index=df.index)
-            else:
-                q_index = ['0', '10', '25', '50', '75', '90', '100'].index(quantile_suffix)
-                df[feature_name] = pd.Series(acc['quantiles'][:, q_index], dtype=np.float32, index=df.index)
-
-        elif 'regionradii' in feature_name:
-            radii_suffix = feature_name.split('_')[-1]
-            r_index = int(radii_suffix)
-            df[feature_name] = pd.Series(acc['regionradii'][:, r_index], dtype=np.float32, index=df.index)
-
-        elif 'regionaxes' in feature_name:
-            suffix = feature_name.split('_')[-1]
-            assert len(suffix) == 2
-            r_index, axis = suffix
-            axis_index = 'xyz'.index(axis) # vigra puts results in xyz order, regardless of array order.
-            df[feature_name] = pd.Series(acc['regionaxes'][:, r_index, axis_index], dtype=np.float32, index=df.index)
+    for feature_name in feature_names:
+        column = get_vigra_feature_column(acc, feature_name, replace_nan, overwrite_quantile_minmax)
+        df[feature_name] = pd.Series(column, dtype=np.float32, index=df.index)
+    return df
+
+def get_vigra_feature_column( acc, feature_name, replace_nan=0.0, overwrite_quantile_minmax=False ):
+    """
+    Extract a single feature from the given RegionFeaturesAccumulator,
+    as a 1D float32 array with one element per region label.
+
+    See ``append_vigra_features_to_dataframe()`` for parameter details.
+    """
+    vigra_feature_name = feature_name.split('_')[2]
+    if 'quantiles' in feature_name:
+        quantile_suffix = feature_name.split('_')[-1]
 
+        # Special treatment for 'minimum' and 'maximum',
+        # because 'quantile_0' and 'quantile_100' are the min/max for the first block only,
+        # whereas 'minimum' and 'maximum' are global to all blocks.
+        if overwrite_quantile_minmax and quantile_suffix == '0':
+            column = acc['minimum']
+        elif overwrite_quantile_minmax and quantile_suffix == '100':
+            column = acc['maximum']
         else:
-            df[feature_name] = pd.Series(acc[vigra_feature_name], dtype=np.float32, index=df.index)
+            q_index = ['0', '10', '25', '50', '75', '90', '100'].index(quantile_suffix)
+            column = acc['quantiles'][:, q_index]
+
+    elif 'regionradii' in feature_name:
+        radii_suffix = feature_name.split('_')[-1]
+        r_index = int(radii_suffix)
+        column = acc['regionradii'][:, r_index]
 
-        # Only some features might include NaN values.
-        if vigra_feature_name in ('kurtosis', 'skewness') and replace_nan is not None:
-            df[feature_name].fillna( replace_nan, inplace=True )
+    elif 'regionaxes' in feature_name:
+        suffix = feature_name.split('_')[-1]
+        assert len(suffix) == 2
+        r_index, axis = suffix
+        axis_index = 'xyz'.index(axis) # vigra puts results in xyz order, regardless of array order.
+        column = acc['regionaxes'][:, int(r_index), axis_index]
+
+    else:
+        column = acc[vigra_feature_name]
+
+    column = np.array(column, dtype=np.float32)
+
+    # Only some features might include NaN values.
+    if vigra_feature_name in ('kurtosis', 'skewness') and replace_nan is not None:
+        column[np.isnan(column)] = replace_nan
     
-    return df
+    return column
 
 def get_vigra_feature_names(feature_names):
     """
@@ -84,3 +98,18 @@ def get_vigra_feature_names(feature_names):
     # drop duplicates (from multiple quantile selections)
     return list(set(vigra_feature_names))
 
+
+def merge_vigra_accumulators(final_acc, acc):
+    """
+    Merge the given RegionFeatureAccumulator into ``final_acc``, and return ``final_acc``.
+    If ``final_acc`` is None, a new (empty) accumulator is created first.
+    Both accumulators must use the same region labels (e.g. the same ``edge_label`` values).
+    """
+    if final_acc is None:
+        final_acc = acc.createAccumulator()
+
+    # This is an identity lookup, but it's necessary since vigra will complain 
+    # about different maxIds if we call merge() without a lookup 
+    identity_index_array = np.arange( acc.maxRegionLabel()+1, dtype=np.uint32 )
+    final_acc.merge( acc, identity_index_array )
+    return final_acc
@@ -0,0 +1,236 @@
+import heapq
+import logging
+from itertools import izip
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class Agglomerator(object):
+    """
+    Greedy agglomerative clustering of superpixels, driven by a priority queue of edge scores.
+
+    Starting from the :py:class:`~ilastikrag.rag_statistics.RagStatistics` of a Rag
+    (see :py:meth:`Rag.compute_statistics() <ilastikrag.rag.Rag.compute_statistics>`),
+    the edge with the lowest score is merged, repeatedly, until the lowest score reaches the threshold
+    (or the requested number of segments remains).
+
+    After each merge, the two segments' edges to their common neighbors are merged,
+    along with their statistics (no pixel data is needed), and the merged edges are re-scored.
+    Outdated entries in the priority queue are skipped when they reach the front.
+    The segment that each superpixel belongs to is tracked in a union-find forest.
+
+    The cost of each merge is proportional to the number of neighbors of the segment with fewer neighbors,
+    so the agglomeration scales to millions of edges.
+    (Unless ``rescore_neighbors=True``, in which case all edges of the merged segment must be re-scored.)
+
+    Attributes
+    ----------
+    edge_ids
+        *ndarray, shape=(N,2)* -- The current ``(sp1, sp2)`` pair of each edge, where ``sp1`` and ``sp2``
+        are the ids of the segments' representative superpixels.
+        (The rows of edges that have been merged away are left as they were.)
+
+    edge_statistics
+        :py:class:`~ilastikrag.accumulators.standard.label_statistics.LabelStatistics`
+        of the current edges (one label per row of ``edge_ids``).
+
+    sp_statistics
+        :py:class:`~ilastikrag.accumulators.standard.label_statistics.LabelStatistics`
+        of the current segments (indexed by representative sp id).
+
+    merge_history
+        *list* of ``(sp1, sp2, score)`` for each merge so far, where ``sp2`` was merged into ``sp1``.
+
+    Example
+    -------
+    ::
+
+       >>> stats = rag.compute_statistics(boundary_probabilities)
+       >>> agglomerator = Agglomerator(stats, edge_score='mean')
+       >>> sp_mapping = agglomerator.agglomerate(threshold=0.5)
+       >>> segmentation = sp_mapping[rag.label_img]
+    """
+    def __init__(self, statistics, edge_score='mean', rescore_neighbors=False):
+        """
+        Parameters
+        ----------
+        statistics
+            :py:class:`~ilastikrag.rag_statistics.RagStatistics` of the Rag to agglomerate.
+            (It is not modified.)
+
+        edge_score
+            Either the name of an edge statistic (e.g. ``'mean'``, ``'maximum'``, see
+            :py:meth:`LabelStatistics.feature_column()
+            <ilastikrag.accumulators.standard.label_statistics.LabelStatistics.feature_column>`),
+            or a function ``edge_score(agglomerator, edge_indexes)`` that returns
+            the (float) scores of the given edges (rows of ``agglomerator.edge_ids``),
+            e.g. by applying a classifier to features computed from ``agglomerator.edge_statistics``
+            and ``agglomerator.sp_statistics``. |br|
+            Edges with lower scores are merged first. |br|
+            Quantiles (other than ``quantiles_0`` and ``quantiles_100``) can't be used as scores, since
+            the quantile sketches aren't updated when edges are merged (see :py:meth:`LabelStatistics.merge_into()
+            <ilastikrag.accumulators.standard.label_statistics.LabelStatistics.merge_into>`).
+
+        rescore_neighbors
+            *bool* (Optional) -- Re-score *all* edges of a segment after it is merged, not just the edges
+            whose statistics changed.  Required if ``edge_score`` depends on ``sp_statistics``
+            (e.g. segment sizes).
+        """
+        if isinstance(edge_score, str):
+            feature_name = edge_score
+            if '_quantiles_' in '_' + feature_name.lower():
+                assert float(feature_name.split('_')[-1]) in (0.0, 100.0), \
+                    "Can't agglomerate by {}: Quantile sketches aren't updated when edges are merged."\
+                    .format( feature_name )
+            edge_score = lambda agglomerator, edge_indexes: \
+                agglomerator.edge_statistics.feature_column(feature_name, edge_indexes)
+        self._edge_score = edge_score
+        self._rescore_neighbors = rescore_neighbors
+
+        self.edge_ids = statistics.edge_ids.copy()
+        self.edge_statistics = statistics.edge_statistics.copy()
+        self.sp_statistics = statistics.sp_statistics.copy()
+        self.merge_history = []
+
+        num_edges = len(self.edge_ids)
+        num_sp_labels = self.sp_statistics.num_labels
+        self._sp_exists = (self.sp_statistics.count > 0)
+        self._sp_exists[self.edge_ids.reshape(-1)] = True
+        self.num_segments = int(self._sp_exists.sum())
+
+        # Union-find forest over sp ids
+        self._parents = np.arange(num_sp_labels, dtype=np.uint32)
+
+        # For each segment, { neighbor : edge_index }
+        logger.debug("Building adjacency lists for {} edges...".format( num_edges ))
+        self._neighbors = {}
+        for edge_index, (sp1, sp2) in enumerate(self.edge_ids.tolist()):
+            self._neighbors.setdefault(sp1, {})[sp2] = edge_index
+            self._neighbors.setdefault(sp2, {})[sp1] = edge_index
+
+        logger.debug("Scoring {} edges...".format( num_edges ))
+        self._edge_alive = np.ones( (num_edges,), dtype=bool )
+        self._edge_scores = np.asarray(self._edge_score(self, np.arange(num_edges)), dtype=np.float64)
+        self._heap = zip(self._edge_scores.tolist(), range(num_edges))
+        heapq.heapify(self._heap)
+
+    def agglomerate(self, threshold=np.inf, num_segments=None):
+        """
+        Merge edges (lowest score first) until the lowest remaining score is at least ``threshold``,
+        or until only ``num_segments`` segments remain. |br|
+        Can be called repeatedly (with increasing thresholds) to continue the agglomeration,
+        e.g. to produce a hierarchy of segmentations.
+
+        Parameters
+        ----------
+        threshold
+            *float* (Optional) -- Don't merge edges with this score (or higher).
+
+        num_segments
+            *int* (Optional) -- Stop once this many segments remain.
+
+        Returns
+        -------
+        *ndarray*
+            The current :py:meth:`sp_mapping()`.
+        """
+        heap = self._heap
+        num_merges = 0
+        while heap and (num_segments is None or self.num_segments > num_segments):
+            score, edge_index = heap[0]
+            if score >= threshold:
+                break
+            heapq.heappop(heap)
+            if not self._edge_alive[edge_index] or score != self._edge_scores[edge_index]:
+                # Outdated entry
+                continue
+            self._merge_edge(edge_index, score)
+            num_merges += 1
+
+        logger.debug("Merged {} edges; {} segments remain".format( num_merges, self.num_segments ))
+        return self.sp_mapping()
+
+    def sp_mapping(self):
+        """
+        Return the current segment of each superpixel, as a ``uint32`` array indexed by sp id
+        (i.e. a lookup table for relabeling ``rag.label_img``). |br|
+        The segments are numbered consecutively, starting at 1.
+        (Sp ids that don't exist in the Rag are mapped to 0.)
+        """
+        roots = self._parents
+        while True:
+            grandparents = roots[roots]
+            if (grandparents == roots).all():
+                break
+            roots = grandparents
+
+        mapping = np.zeros( roots.shape, dtype=np.uint32 )
+        _, segment_ids = np.unique(roots[self._sp_exists], return_inverse=True)
+        mapping[self._sp_exists] = segment_ids + 1
+        return mapping
+
+    @classmethod
+    def edge_decisions(cls, sp_mapping, edge_ids):
+        """
+        Convert an ``sp_mapping`` into edge decisions for the given edges (e.g. ``rag.edge_ids``),
+        as expected by :py:meth:`Rag.naive_segmentation_from_edge_decisions()
+        <ilastikrag.rag.Rag.naive_segmentation_from_edge_decisions>`:
+        ``True`` for edges between different segments.
+        """
+        return sp_mapping[edge_ids[:, 0]] != sp_mapping[edge_ids[:, 1]]
+
+    def _merge_edge(self, edge_index, score):
+        """
+        Merge the two segments on either side of the given edge,
+        along with their edges to their common neighbors, and re-score the affected edges.
+        """
+        sp_a, sp_b = self.edge_ids[edge_index].tolist()
+        neighbors_a = self._neighbors[sp_a]
+        neighbors_b = self._neighbors[sp_b]
+
+        # Merge the segment with fewer neighbors into the other one,
+        # to minimize the bookkeeping.
+        if len(neighbors_a) < len(neighbors_b):
+            sp_a, sp_b = sp_b, sp_a
+            neighbors_a, neighbors_b = neighbors_b, neighbors_a
+
+        del neighbors_a[sp_b]
+        del neighbors_b[sp_a]
+        self._edge_alive[edge_index] = False
+
+        dst_edges = []
+        src_edges = []
+        for sp_c, edge_bc in neighbors_b.iteritems():
+            neighbors_c = self._neighbors[sp_c]
+            del neighbors_c[sp_b]
+            edge_ac = neighbors_a.get(sp_c)
+            if edge_ac is None:
+                # Move edge (b,c) to (a,c)
+                neighbors_a[sp_c] = edge_bc
+                neighbors_c[sp_a] = edge_bc
+                self.edge_ids[edge_bc] = (min(sp_a, sp_c), max(sp_a, sp_c))
+            else:
+                # Merge edge (b,c) into (a,c)
+                dst_edges.append(edge_ac)
+                src_edges.append(edge_bc)
+                self._edge_alive[edge_bc] = False
+        del self._neighbors[sp_b]
+
+        if dst_edges:
+            self.edge_statistics.merge_into(dst_edges, src_edges)
+        self.sp_statistics.merge_into([sp_a], [sp_b])
+        self._parents[sp_b] = sp_a
+        self.num_segments -= 1
+        self.merge_history.append( (sp_a, sp_b, score) )
+
+        if self._rescore_neighbors:
+            edge_indexes = np.fromiter(neighbors_a.itervalues(), dtype=np.intp, count=len(neighbors_a))
+        else:
+            edge_indexes = np.array(dst_edges, dtype=np.intp)
+
+        if len(edge_indexes):
+            scores = np.asarray(self._edge_score(self, edge_indexes), dtype=np.float64)
+            self._edge_scores[edge_indexes] = scores
+            for entry in izip(scores.tolist(), edge_indexes.tolist()):
+                heapq.heappush(self._heap, entry)
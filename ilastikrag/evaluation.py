@@ -0,0 +1,203 @@
+import numpy as np
+
+from .lazy_import import lazy_import
+pd = lazy_import('pandas')
+
+from .util import sparse_contingency_table, mapping_from_contingency_table
+
+class SegmentationEvaluator(object):
+    """
+    Evaluates segmentations of a Rag's superpixels against a groundtruth segmentation.
+
+    The groundtruth volume is read only once, to compute the :py:func:`~ilastikrag.util.sparse_contingency_table`
+    of the superpixels vs. the groundtruth.  Afterwards, any segmentation that is composed of whole superpixels
+    (e.g. the result of an :py:class:`~ilastikrag.agglomeration.Agglomerator`) can be evaluated
+    from its ``sp_mapping`` alone, without touching the voxels again.
+
+    Example
+    -------
+    ::
+
+       >>> evaluator = SegmentationEvaluator(rag, groundtruth_vol, ignore_label=0)
+       >>> merge_vi, split_vi = evaluator.variation_of_information(sp_mapping)
+       >>> are, precision, recall = evaluator.adapted_rand_error(sp_mapping)
+       >>> edge_labels = evaluator.edge_merge_probabilities()
+    """
+    def __init__(self, rag, groundtruth_vol, blocksize=None, ignore_label=None):
+        """
+        Parameters
+        ----------
+        rag
+            :py:class:`~ilastikrag.rag.Rag`
+
+        groundtruth_vol
+            Groundtruth label volume, same shape as ``rag.label_img``.
+            (May also be an on-disk array, e.g. an ``h5py.Dataset``, which is read blockwise.)
+
+        blocksize
+            *int* (Optional) -- read the volumes in blocks of this many slices.
+
+        ignore_label
+            *int* (Optional) -- A groundtruth label to ignore in all metrics (e.g. ``0`` for unlabeled voxels).
+        """
+        assert tuple(groundtruth_vol.shape) == tuple(rag.label_img.shape), \
+            "groundtruth_vol has the wrong shape: {}".format( groundtruth_vol.shape )
+        if blocksize is None and ( not isinstance(groundtruth_vol, np.ndarray)
+                                   or isinstance(groundtruth_vol, np.memmap) ):
+            blocksize = rag._default_blocksize()
+
+        self.rag = rag
+        self.ignore_label = ignore_label
+        self.sp_table = sparse_contingency_table(rag.label_img, groundtruth_vol, blocksize)
+
+    def contingency_table(self, sp_mapping=None):
+        """
+        Return the sparse contingency table of the segmentation vs. the groundtruth,
+        with columns ``['label1', 'label2', 'count']`` (segment id, groundtruth id, voxel count).
+        (Without any ``ignore_label`` rows.)
+
+        Parameters
+        ----------
+        sp_mapping
+            1D *ndarray* (Optional), indexed by sp id: The segment id of each superpixel. |br|
+            By default, each superpixel is its own segment.
+        """
+        table = self.sp_table
+        if self.ignore_label is not None:
+            table = table[table['label2'].values != self.ignore_label]
+        if sp_mapping is None:
+            return table
+
+        segment_ids = np.asarray(sp_mapping)[table['label1'].values].astype(np.uint64)
+        packed_pairs = (segment_ids << np.uint64(32)) | table['label2'].values.astype(np.uint64)
+        packed_pairs, inverse = np.unique(packed_pairs, return_inverse=True)
+        counts = np.bincount(inverse, table['count'].values, minlength=len(packed_pairs))
+
+        return pd.DataFrame({ 'label1': (packed_pairs >> np.uint64(32)).astype(np.uint32),
+                              'label2': (packed_pairs & np.uint64(0xFFFFFFFF)).astype(np.uint32),
+                              'count': counts.astype(np.uint64) },
+                            columns=['label1', 'label2', 'count'])
+
+    def variation_of_information(self, sp_mapping=None):
+        """
+        Compute the variation of information (in bits) between the segmentation and the groundtruth.
+
+        Parameters
+        ----------
+        sp_mapping
+            1D *ndarray* (Optional), indexed by sp id: The segment id of each superpixel. |br|
+            By default, the superpixels themselves are evaluated.
+
+        Returns
+        -------
+        ``(merge_error, split_error)``
+            The conditional entropies ``H(groundtruth|segmentation)`` (false merges) and
+            ``H(segmentation|groundtruth)`` (false splits).  The VI is their sum.
+        """
+        counts, segment_sizes, groundtruth_sizes = self._overlap_sizes(sp_mapping)
+        total = counts.sum()
+        merge_error = np.sum(counts * np.log2(segment_sizes / counts)) / total
+        split_error = np.sum(counts * np.log2(groundtruth_sizes / counts)) / total
+        return merge_error, split_error
+
+    def adapted_rand_error(self, sp_mapping=None):
+        """
+        Compute the adapted Rand error (as defined for the SNEMI3D challenge) of the segmentation.
+
+        Parameters
+        ----------
+        sp_mapping
+            1D *ndarray* (Optional), indexed by sp id: The segment id of each superpixel. |br|
+            By default, the superpixels themselves are evaluated.
+
+        Returns
+        -------
+        ``(error, precision, recall)``
+            Where ``error = 1 - F-score`` of the Rand ``precision`` and ``recall``.
+        """
+        table = self.contingency_table(sp_mapping)
+        counts = table['count'].values.astype(np.float64)
+        segment_sizes = pd.Series(counts).groupby(table['label1'].values).sum().values
+        groundtruth_sizes = pd.Series(counts).groupby(table['label2'].values).sum().values
+
+        sum_overlaps = np.sum(counts * counts)
+        precision = sum_overlaps / np.sum(segment_sizes * segment_sizes)
+        recall = sum_overlaps / np.sum(groundtruth_sizes * groundtruth_sizes)
+        error = 1.0 - 2.0 * precision * recall / (precision + recall)
+        return error, precision, recall
+
+    def edge_merge_probabilities(self):
+        """
+        Compute a soft groundtruth label for each edge of the Rag: The probability that two voxels,
+        chosen randomly from the two superpixels on either side of the edge, belong to the same groundtruth
+        object.  (Voxels with the ``ignore_label`` are not counted.)
+
+        Returns
+        -------
+        1D ``float32`` *ndarray*, in the same order as ``rag.edge_ids``.
+        """
+        table = self.contingency_table()
+        sp_ids = table['label1'].values
+        gt_ids = table['label2'].values
+        counts = table['count'].values.astype(np.float64)
+
+        # The fraction of each superpixel (not counting ignored voxels) that overlaps each groundtruth object
+        num_sp_labels = self.rag.max_sp+1
+        sp_sizes = np.bincount(sp_ids, counts, minlength=num_sp_labels)
+        fractions = counts / sp_sizes[sp_ids]
+
+        # The table is sorted by sp id, so each superpixel's rows are contiguous
+        rows_per_sp = np.bincount(sp_ids, minlength=num_sp_labels)
+        first_rows = np.cumsum(rows_per_sp) - rows_per_sp
+
+        # For each edge, iterate over the rows of the superpixel with fewer groundtruth objects,
+        # and look up the same groundtruth object in the other superpixel.
+        edge_ids = self.rag.edge_ids
+        swap = rows_per_sp[edge_ids[:, 0]] > rows_per_sp[edge_ids[:, 1]]
+        sp_small = np.where(swap, edge_ids[:, 1], edge_ids[:, 0])
+        sp_large = np.where(swap, edge_ids[:, 0], edge_ids[:, 1])
+
+        row_counts = rows_per_sp[sp_small]
+        edge_indexes = np.repeat(np.arange(len(edge_ids)), row_counts)
+        row_offsets = np.arange(row_counts.sum()) - np.repeat(np.cumsum(row_counts) - row_counts, row_counts)
+        small_rows = first_rows[sp_small][edge_indexes] + row_offsets
+
+        packed_table = (sp_ids.astype(np.uint64) << np.uint64(32)) | gt_ids.astype(np.uint64)
+        packed_lookups = ( (sp_large[edge_indexes].astype(np.uint64) << np.uint64(32))
+                           | gt_ids[small_rows].astype(np.uint64) )
+        large_rows = np.searchsorted(packed_table, packed_lookups)
+        large_rows[large_rows == len(packed_table)] = 0
+        found = (packed_table[large_rows] == packed_lookups)
+
+        products = np.where(found, fractions[small_rows] * fractions[large_rows], 0.0)
+        probabilities = np.bincount(edge_indexes, products, minlength=len(edge_ids))
+        return probabilities.astype(np.float32)
+
+    def edge_decisions(self, sp_mapping=None):
+        """
+        Same as :py:meth:`Rag.edge_decisions_from_groundtruth() <ilastikrag.rag.Rag.edge_decisions_from_groundtruth>`,
+        but computed from the contingency table. |br|
+        If an ``sp_mapping`` is given, returns the decisions for the segmentation's edges instead
+        (i.e. ``True`` for the edges between two segments that are both matched to different groundtruth objects),
+        in the same order as ``rag.edge_ids``.
+        """
+        table = self.contingency_table(sp_mapping)
+        mapping = mapping_from_contingency_table(table)
+        edge_ids = self.rag.edge_ids
+        if sp_mapping is not None:
+            edge_ids = np.asarray(sp_mapping)[edge_ids]
+
+        # Segments that only overlap ignored voxels aren't in the table
+        mapping = np.append(mapping, np.zeros( (max(0, edge_ids.max()+1 - len(mapping)),), dtype=mapping.dtype ))
+        return mapping[edge_ids[:, 0]] != mapping[edge_ids[:, 1]]
+
+    def _overlap_sizes(self, sp_mapping=None):
+        """
+        Return the overlap counts of the contingency table (as float64), along with the total size of
+        the segment and of the groundtruth object of each row.
+        """
+        table = self.contingency_table(sp_mapping)
+        counts = table['count'].values.astype(np.float64)
+        segment_sizes = pd.Series(counts).groupby(table['label1'].values).transform('sum').values
+        groundtruth_sizes = pd.Series(counts).groupby(table['label2'].values).transform('sum').values
+        return counts, segment_sizes, groundtruth_sizes
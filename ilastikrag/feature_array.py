@@ -0,0 +1,65 @@
+import numpy as np
+
+from .lazy_import import lazy_import
+pd = lazy_import('pandas')
+
+class FeatureArray(object):
+    """
+    Columnar container for edge features, as returned by ``Rag.compute_features(..., asarray=True)``.
+
+    The features are stored in a single 2D ``float32`` array of shape ``(N_edges, N_features)``,
+    without any pandas overhead.  The array may be a ``numpy.memmap`` if you provided one
+    via ``compute_features(..., out=...)``.
+
+    Attributes
+    ----------
+    edge_ids
+        *ndarray*, shape ``(N_edges, 2)`` -- the ``(sp1, sp2)`` pair for each row.
+
+    values
+        *ndarray* (``float32``), shape ``(N_edges, N_features)``
+
+    column_names
+        *list of str* -- the feature name for each column of ``values``.
+    """
+    def __init__(self, edge_ids, values, column_names):
+        assert values.ndim == 2
+        assert len(edge_ids) == values.shape[0]
+        assert len(column_names) == values.shape[1]
+        self.edge_ids = edge_ids
+        self.values = values
+        self.column_names = list(column_names)
+        self.column_index = { name : i for i, name in enumerate(self.column_names) }
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, column_name):
+        """
+        Return a view of the given feature column (or the ``sp1``/``sp2`` edge id column).
+        """
+        if column_name == 'sp1':
+            return self.edge_ids[:, 0]
+        if column_name == 'sp2':
+            return self.edge_ids[:, 1]
+        return self.values[:, self.column_index[column_name]]
+
+    def to_dataframe(self):
+        """
+        Return the features as a DataFrame with columns ``['sp1', 'sp2', ...feature names...]``,
+        exactly as ``compute_features()`` would have returned them.
+        """
+        index_u32 = pd.Index(np.arange(len(self.edge_ids)), dtype=np.uint32)
+        edge_df = pd.DataFrame(self.edge_ids, columns=['sp1', 'sp2'], index=index_u32)
+        for i, column_name in enumerate(self.column_names):
+            edge_df[column_name] = pd.Series(self.values[:, i], dtype=np.float32, index=index_u32)
+        return edge_df
+
+    def as_structured(self):
+        """
+        Return the feature values as a 1D structured array with one ``float32`` field per feature.
+        No data is copied if ``values`` is C-contiguous.
+        """
+        dtype = [(str(name), np.float32) for name in self.column_names]
+        values = np.ascontiguousarray(self.values)
+        return values.view(dtype).reshape(-1)
@@ -0,0 +1,69 @@
+class FeaturePlan(object):
+    """
+    A validated, reusable recipe for computing a fixed list of features on a particular Rag,
+    as returned by :py:meth:`Rag.plan_features() <ilastikrag.rag.Rag.plan_features>`.
+
+    All of the per-call preparation of ``Rag.compute_features()`` (parsing and grouping the
+    feature names, checking them against each accumulator's ``supported_features()``,
+    constructing the accumulators and selecting their output columns) is done once,
+    when the plan is created.  Afterwards, :py:meth:`compute()` can be called for any number
+    of value images, with almost no overhead beyond the feature computation itself.
+
+    The plan owns its accumulators, so a plan must not be used from several threads at once.
+
+    Attributes
+    ----------
+    rag
+        The :py:class:`~ilastikrag.rag.Rag` the plan was created for.
+
+    feature_names
+        *list of str* -- the feature names the plan was created with.
+
+    edge_groups
+        *list of str* -- the edge groups the plan computes features for.
+    """
+    def __init__(self, rag, feature_names, group_plans):
+        """
+        Don't construct a FeaturePlan directly.  Use :py:meth:`Rag.plan_features() <ilastikrag.rag.Rag.plan_features>`.
+
+        group_plans: OrderedDict of { edge_group : (edge_ids, accumulators, output_columns) }
+        """
+        self.rag = rag
+        self.feature_names = list(feature_names)
+        self.edge_groups = list(group_plans.keys())
+        self._group_plans = group_plans
+
+    def compute(self, value_img, blocksize=None, asarray=False, out=None, edges=None, roi=None, roi_whole_edges=False):
+        """
+        Compute the planned features for the given value image.
+        The parameters and results are the same as for
+        :py:meth:`Rag.compute_features() <ilastikrag.rag.Rag.compute_features>`.
+
+        Parameters
+        ----------
+        value_img
+            *VigraArray*, same shape as ``rag.label_img`` (or ``None``, for label-only features).
+
+        blocksize
+            *int* (Optional) -- process ``value_img`` in blocks of this many slices.
+
+        asarray
+            *bool* (Optional) -- return a ``FeatureArray`` instead of a DataFrame.
+
+        out
+            *ndarray* (Optional) -- ``float32`` array to write the features into.
+
+        edges
+            *ndarray* (Optional) -- compute the features for only these edges
+            (``edge_label`` values or ``(sp1, sp2)`` pairs).
+
+        roi, roi_whole_edges
+            (Optional) -- compute the features for only the edges within this region of interest.
+
+        Returns
+        -------
+        *pandas.DataFrame* or *FeatureArray*
+            (Or an ``OrderedDict`` of them, if the plan has more than one edge group.)
+        """
+        return self.rag._compute_planned_features(self, value_img, blocksize, asarray, out, edges,
+                                                  roi, roi_whole_edges)
@@ -0,0 +1,239 @@
+import os
+import json
+import logging
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class FeatureStore(object):
+    """
+    Persists computed edge features next to a serialized Rag, so that later sessions
+    can read them back instead of recomputing them.
+
+    The store lives in a ``features`` group (or subdirectory) of the ``h5py.Group`` that the Rag
+    was serialized to (see :py:meth:`Rag.serialize_hdf5() <ilastikrag.rag.Rag.serialize_hdf5>`),
+    or of the directory it was saved to (see :py:meth:`Rag.save() <ilastikrag.rag.Rag.save>`).
+    Features are stored per edge group, and keyed by the *fingerprint* of the value image they were
+    computed from (see :py:func:`~ilastikrag.util.value_fingerprint`), and by feature name.
+
+    The store is append-only: Features that are already stored (for the same edge group and fingerprint)
+    are never overwritten.  Each feature's columns are written before the feature is listed in the
+    store's metadata, so an interrupted write leaves the store as it was.
+
+    Layout (hdf5)::
+
+        features/<edge_group>/<fingerprint>/<column_name>   (one dataset per column)
+        features/<edge_group>/<fingerprint>.attrs['feature_columns']   (JSON: { feature_name : [column_name, ...] })
+
+    Layout (directory)::
+
+        features/<edge_group>/<fingerprint>/<column_name>.npy
+        features/<edge_group>/<fingerprint>/manifest.json
+
+    Usually, you won't use the store directly.  Pass it to
+    :py:meth:`Rag.compute_features() <ilastikrag.rag.Rag.compute_features>` instead,
+    which reads the stored features and computes (and stores) only the missing ones.
+
+    Example
+    -------
+    ::
+
+       >>> with h5py.File('my_rag.h5', 'r+') as f:
+       ...     rag = Rag.deserialize_hdf5(f['rag'], label_img=superpixels)
+       ...     store = FeatureStore(f['rag'])
+       ...     features_df = rag.compute_features(grayscale_img, ['standard_edge_mean'], feature_store=store)
+    """
+    def __init__(self, location, compression='lzf', compression_opts=None, mmap=False):
+        """
+        Parameters
+        ----------
+        location
+            An ``h5py.Group``, or *str* -- the path of a directory.
+
+        compression, compression_opts
+            Passed directly to ``h5py.Group.create_dataset`` (hdf5 stores only).
+
+        mmap
+            If True, read the columns of a directory store as read-only memory maps.
+        """
+        self._location = location
+        self._is_directory = isinstance(location, basestring)
+        self._compression = compression
+        self._compression_opts = compression_opts
+        self._mmap = mmap
+
+    def fingerprints(self, edge_group):
+        """
+        Return the fingerprints of the value images that features were stored for (in the given edge group).
+        """
+        if self._is_directory:
+            group_dir = os.path.join(self._location, 'features', edge_group)
+            if not os.path.exists(group_dir):
+                return []
+            return sorted( fingerprint for fingerprint in os.listdir(group_dir)
+                           if os.path.exists(os.path.join(group_dir, fingerprint, 'manifest.json')) )
+
+        group_name = 'features/{}'.format(edge_group)
+        if group_name not in self._location:
+            return []
+        return sorted( fingerprint for fingerprint, group in self._location[group_name].items()
+                       if 'feature_columns' in group.attrs )
+
+    def stored_features(self, edge_group, fingerprint):
+        """
+        Return an ``OrderedDict`` of ``{ feature_name : [column_name, ...] }`` for
+        the features that are stored for the given edge group and value image fingerprint.
+        """
+        return self._read_metadata(edge_group, fingerprint)['feature_columns']
+
+    def missing_features(self, edge_group, fingerprint, feature_names):
+        """
+        Return the subset of the given feature names that aren't stored yet.
+        """
+        stored_names = self.stored_features(edge_group, fingerprint)
+        return [name for name in feature_names if name not in stored_names]
+
+    def write(self, edge_group, fingerprint, feature_names, features_df):
+        """
+        Store the given features, i.e. the columns of ``features_df`` that belong to them.
+        (Features that are already stored are skipped.)
+
+        Parameters
+        ----------
+        edge_group, fingerprint
+            *str* -- Where to store the features.
+
+        feature_names
+            *list of str* -- The names of the features the columns were computed for,
+            e.g. ``['standard_edge_mean', 'standard_sp_count']``.  |br|
+            Each column belongs to the feature whose name it equals or starts with (followed by ``_``),
+            e.g. ``standard_sp_count_sum`` belongs to ``standard_sp_count``
+            (but ``standard_edge_quantiles_100`` doesn't belong to ``standard_edge_quantiles_10``).
+
+        features_df
+            *pandas.DataFrame* -- as returned by ``Rag.compute_features()``, for *all* edges of the edge group.
+        """
+        metadata = self._read_metadata(edge_group, fingerprint)
+        feature_columns = metadata['feature_columns']
+        if metadata['num_rows'] is None:
+            metadata['num_rows'] = len(features_df)
+        assert metadata['num_rows'] == len(features_df), \
+            "Features must be stored for all edges: expected {} rows, got {}"\
+            .format( metadata['num_rows'], len(features_df) )
+
+        new_columns = OrderedDict()
+        for feature_name in feature_names:
+            if feature_name in feature_columns:
+                continue
+            column_names = [ colname for colname in features_df.columns.values[2:]
+                             if colname == feature_name or colname.startswith(feature_name + '_') ]
+            assert column_names, "No columns found for feature: {}".format( feature_name )
+            new_columns[feature_name] = column_names
+
+        if not new_columns:
+            return
+
+        logger.debug("Storing {} features for edge group {}".format( len(new_columns), edge_group ))
+        stored_column_names = set( sum(feature_columns.values(), []) )
+        for column_names in new_columns.values():
+            for colname in column_names:
+                if colname not in stored_column_names:
+                    self._write_column(edge_group, fingerprint, colname, features_df[colname].values)
+                    stored_column_names.add(colname)
+
+        # Update the metadata last, so an interrupted write() doesn't list incomplete features.
+        feature_columns.update(new_columns)
+        self._write_metadata(edge_group, fingerprint, metadata)
+
+    def read(self, edge_group, fingerprint, feature_names):
+        """
+        Read the columns of the given (stored) features.
+
+        Returns
+        -------
+        *OrderedDict*
+            ``{ column_name : ndarray }``, in the order of the given feature names.
+        """
+        feature_columns = self.stored_features(edge_group, fingerprint)
+        missing_names = [name for name in feature_names if name not in feature_columns]
+        assert not missing_names, \
+            "Features aren't stored for edge group {}: {}".format( edge_group, missing_names )
+
+        columns = OrderedDict()
+        for feature_name in feature_names:
+            for colname in feature_columns[feature_name]:
+                if colname not in columns:
+                    columns[colname] = self._read_column(edge_group, fingerprint, colname)
+        return columns
+
+    def _read_metadata(self, edge_group, fingerprint):
+        """
+        Return the metadata of the given edge group and fingerprint (or empty metadata, if there isn't any yet).
+        """
+        metadata = None
+        if self._is_directory:
+            manifest_path = os.path.join(self._fingerprint_dir(edge_group, fingerprint), 'manifest.json')
+            if os.path.exists(manifest_path):
+                with open(manifest_path, 'r') as f:
+                    metadata = json.load(f, object_pairs_hook=OrderedDict)
+        else:
+            group_name = self._fingerprint_group_name(edge_group, fingerprint)
+            if group_name in self._location and 'feature_columns' in self._location[group_name].attrs:
+                attrs = self._location[group_name].attrs
+                metadata = { 'num_rows': int(attrs['num_rows']),
+                             'feature_columns': json.loads(attrs['feature_columns'], object_pairs_hook=OrderedDict) }
+
+        if metadata is None:
+            return { 'num_rows': None, 'feature_columns': OrderedDict() }
+
+        # JSON gives us unicode names
+        metadata['feature_columns'] = OrderedDict( (str(name), map(str, column_names))
+                                                   for name, column_names in metadata['feature_columns'].items() )
+        return metadata
+
+    def _write_metadata(self, edge_group, fingerprint, metadata):
+        if self._is_directory:
+            fingerprint_dir = self._fingerprint_dir(edge_group, fingerprint)
+            if not os.path.exists(fingerprint_dir):
+                os.makedirs(fingerprint_dir)
+
+            # Write a temporary file and rename it over the old manifest,
+            # so an interrupted write never leaves a truncated manifest behind.
+            manifest_path = os.path.join(fingerprint_dir, 'manifest.json')
+            tmp_path = manifest_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(metadata, f, indent=2)
+            os.rename(tmp_path, manifest_path)
+        else:
+            attrs = self._location.require_group(self._fingerprint_group_name(edge_group, fingerprint)).attrs
+            attrs['num_rows'] = metadata['num_rows']
+            attrs['feature_columns'] = json.dumps(metadata['feature_columns'])
+
+    def _write_column(self, edge_group, fingerprint, colname, values):
+        if self._is_directory:
+            fingerprint_dir = self._fingerprint_dir(edge_group, fingerprint)
+            if not os.path.exists(fingerprint_dir):
+                os.makedirs(fingerprint_dir)
+            np.save(os.path.join(fingerprint_dir, colname + '.npy'), values)
+        else:
+            group = self._location.require_group(self._fingerprint_group_name(edge_group, fingerprint))
+            if colname in group:
+                # Left over from an interrupted write()
+                del group[colname]
+            group.create_dataset(colname, data=values,
+                                 compression=self._compression, compression_opts=self._compression_opts)
+
+    def _read_column(self, edge_group, fingerprint, colname):
+        if self._is_directory:
+            mmap_mode = 'r' if self._mmap else None
+            return np.load(os.path.join(self._fingerprint_dir(edge_group, fingerprint), colname + '.npy'),
+                           mmap_mode=mmap_mode)
+        return self._location[self._fingerprint_group_name(edge_group, fingerprint)][colname][:]
+
+    def _fingerprint_dir(self, edge_group, fingerprint):
+        return os.path.join(self._location, 'features', edge_group, fingerprint)
+
+    def _fingerprint_group_name(self, edge_group, fingerprint):
+        return 'features/{}/{}'.format(edge_group, fingerprint)
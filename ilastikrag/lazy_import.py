@@ -0,0 +1,36 @@
+import sys
+import types
+import importlib
+
+def lazy_import(module_name):
+    """
+    Return a placeholder for the given module, which imports the real module on first attribute access.
+
+    The heavy dependencies (pandas, vigra) are imported this way throughout ilastikrag,
+    so that ``import ilastikrag`` stays cheap for programs that never touch them
+    (e.g. workers that only deserialize a Rag and read its ``edge_ids``).
+    If the module has already been imported, it is returned directly.
+
+    Example
+    -------
+    ::
+
+       >>> pd = lazy_import('pandas')   # Nothing is imported yet
+       >>> df = pd.DataFrame()          # Now pandas is imported
+    """
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+    return LazyModule(module_name)
+
+class LazyModule(types.ModuleType):
+    """
+    Module placeholder returned by :py:func:`lazy_import()`.
+    """
+    def __getattr__(self, name):
+        # Only called for attributes that aren't in our __dict__ yet.
+        module = importlib.import_module(self.__name__)
+
+        # Copy the module's namespace, so subsequent lookups don't come through here.
+        self.__dict__.update(module.__dict__)
+        return getattr(module, name)
@@ -0,0 +1,198 @@
+import os
+import time
+import threading
+from collections import OrderedDict, namedtuple
+
+from .lazy_import import lazy_import
+pd = lazy_import('pandas')
+
+_STATM_PATH = '/proc/self/statm'
+
+def resident_memory_mb():
+    """
+    Return the resident memory of this process, in MB (or ``None``, if it can't be determined on this platform).
+    """
+    try:
+        with open(_STATM_PATH, 'r') as f:
+            resident_pages = int(f.read().split()[1])
+    except IOError:
+        return None
+    return resident_pages * os.sysconf('SC_PAGE_SIZE') / float(2**20)
+
+class StageStats(namedtuple('StageStats', 'calls wall_seconds cpu_seconds peak_mb')):
+    """
+    The measurements of one stage of a :py:class:`Profile`, summed over all of its ``calls``
+    (e.g. once per block, for blockwise feature computation).
+
+    Attributes
+    ----------
+    calls
+        *int* -- How many times the stage was entered.
+
+    wall_seconds, cpu_seconds
+        *float* -- The total wall time and CPU time (of all threads) spent in the stage.
+
+    peak_mb
+        *float* -- The largest growth of the process's resident memory during any call of the stage,
+        relative to the start of that call (or ``None``, if it can't be measured on this platform).
+    """
+    __slots__ = ()
+
+class Profile(object):
+    """
+    Per-stage timing and memory measurements of one Rag operation
+    (e.g. the construction of the Rag, or one call to ``compute_features()``),
+    as found in :py:attr:`Rag.last_profile <ilastikrag.rag.Rag.last_profile>`
+    if the Rag's :py:attr:`profile <ilastikrag.rag.Rag.profile>` flag is set.
+
+    Stages are nested: Each stage is named by its path, e.g. ``'compute_features/compute/extract_edge_values'``.
+    The accumulators are profiled as stages named ``accumulator:<id>_<type>``
+    (which include both ingesting the values and producing the features).
+
+    The peak memory of each stage is determined by sampling the resident memory of the process
+    in a background thread (every ``sample_interval`` seconds), so the peaks of very short stages
+    may be underestimated.  Memory that was allocated by *other* threads (e.g. an unrelated
+    computation that runs at the same time) is included, too.
+
+    Attributes
+    ----------
+    name
+        *str* -- The name of the profiled operation (and its outermost stage).
+
+    stages
+        *OrderedDict* of ``{ path : StageStats }``, in the order the stages were first entered.
+
+    Example
+    -------
+    ::
+
+       >>> rag = Rag(superpixels, profile=True)
+       >>> print rag.last_profile.report()
+       >>> features_df = rag.compute_features(grayscale, ['standard_edge_mean'])
+       >>> rag.last_profile['compute_features'].wall_seconds
+       >>> rag.last_profile.to_dataframe()
+    """
+    def __init__(self, name, sample_interval=0.005):
+        self.name = name
+        self.stages = OrderedDict()
+        self._sample_interval = sample_interval
+        self._active_stages = []
+        self._sampler = None
+        self._stopped = threading.Event()
+
+    def __getitem__(self, path):
+        return self.stages[path]
+
+    def stage(self, name):
+        """
+        Return a context manager that measures the enclosed code as the given stage
+        (nested within the current stage, if any).
+        """
+        return _Stage(self, name)
+
+    def start(self):
+        """
+        Start profiling (and sampling the memory usage).  Called by the Rag.
+        """
+        if resident_memory_mb() is not None:
+            self._sampler = threading.Thread(target=self._sample_memory)
+            self._sampler.daemon = True
+            self._sampler.start()
+
+    def stop(self):
+        """
+        Stop profiling.  Called by the Rag.
+        """
+        self._stopped.set()
+        if self._sampler is not None:
+            self._sampler.join()
+            self._sampler = None
+
+    def report(self):
+        """
+        Return a table of the measurements of each stage (as a *str*), with nested stages indented.
+        """
+        lines = [ "{:<60} {:>6} {:>10} {:>10} {:>10}".format('stage', 'calls', 'wall [s]', 'cpu [s]', 'peak [MB]') ]
+        for path, stats in self.stages.items():
+            depth = path.count('/')
+            name = '  '*depth + path.split('/')[-1]
+            peak_mb = '' if stats.peak_mb is None else '{:.1f}'.format(stats.peak_mb)
+            lines.append( "{:<60} {:>6} {:>10.3f} {:>10.3f} {:>10}"
+                          .format(name, stats.calls, stats.wall_seconds, stats.cpu_seconds, peak_mb) )
+        return '\n'.join(lines)
+
+    def to_dataframe(self):
+        """
+        Return the measurements as a *pandas.DataFrame*, indexed by stage path,
+        with columns ``['calls', 'wall_seconds', 'cpu_seconds', 'peak_mb']``.
+        """
+        return pd.DataFrame( self.stages.values(), index=self.stages.keys(), columns=StageStats._fields )
+
+    def _enter_stage(self, name):
+        if self._active_stages:
+            path = self._active_stages[-1][0] + '/' + name
+        else:
+            path = name
+        if path not in self.stages:
+            # Reserve the stage's place in the (ordered) report.
+            self.stages[path] = StageStats(0, 0.0, 0.0, None)
+
+        start_mb = resident_memory_mb()
+        # [path, start_wall, start_cpu, start_mb, max_mb]
+        self._active_stages.append( [path, time.time(), time.clock(), start_mb, start_mb] )
+
+    def _exit_stage(self):
+        path, start_wall, start_cpu, start_mb, max_mb = self._active_stages.pop()
+        wall_seconds = time.time() - start_wall
+        cpu_seconds = time.clock() - start_cpu
+
+        peak_mb = None
+        if start_mb is not None:
+            peak_mb = max(max_mb, resident_memory_mb()) - start_mb
+
+        stats = self.stages[path]
+        if stats.peak_mb is not None:
+            peak_mb = max(peak_mb, stats.peak_mb)
+        self.stages[path] = StageStats( stats.calls + 1,
+                                        stats.wall_seconds + wall_seconds,
+                                        stats.cpu_seconds + cpu_seconds,
+                                        peak_mb )
+
+    def _sample_memory(self):
+        while not self._stopped.wait(self._sample_interval):
+            current_mb = resident_memory_mb()
+            for active_stage in list(self._active_stages):
+                active_stage[4] = max(active_stage[4], current_mb)
+
+class _Stage(object):
+    __slots__ = ('_profile', '_name')
+
+    def __init__(self, profile, name):
+        self._profile = profile
+        self._name = name
+
+    def __enter__(self):
+        self._profile._enter_stage(self._name)
+
+    def __exit__(self, *args):
+        self._profile._exit_stage()
+
+class _NullStage(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+class _NullProfile(object):
+    """
+    Stand-in for a Profile when profiling is disabled.  Its stages don't measure anything.
+    """
+    _NULL_STAGE = _NullStage()
+
+    def stage(self, name):
+        return self._NULL_STAGE
+
+NULL_PROFILE = _NullProfile()
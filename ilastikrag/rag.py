@@ -1,21 +1,30 @@
+import os
+import json
+from functools import partial
+from contextlib import contextmanager
 from collections import defaultdict, OrderedDict, namedtuple
 from itertools import izip, imap, groupby
 
 import numpy as np
-import pandas as pd
-import vigra
+
+from .lazy_import import lazy_import
+pd = lazy_import('pandas')
+vigra = lazy_import('vigra')
 
 import logging
 logger = logging.getLogger(__name__)
 
 from .util import label_vol_mapping, edge_mask_for_axis, edge_ids_for_axis, \
                   unique_edge_labels, extract_edge_values_for_axis, nonzero_coord_array, \
-                  dataframe_to_hdf5, dataframe_from_hdf5
+                  dataframe_to_hdf5, dataframe_from_hdf5, dataframe_to_npy, dataframe_from_npy, \
+                  connected_components, relabel, value_fingerprint, LazyDict
 
-from .accumulators.base import BaseEdgeAccumulator, BaseSpAccumulator
-from .accumulators.standard import StandardEdgeAccumulator, StandardSpAccumulator, StandardFlatEdgeAccumulator
-from .accumulators.similarity import SimilarityFlatEdgeAccumulator
-from .accumulators.edgeregion import EdgeRegionEdgeAccumulator
+from .accumulators.base import BaseEdgeAccumulator, BaseSpAccumulator, BaseFlatEdgeAccumulator
+from .accumulators.registry import AccumulatorRegistry, ENTRY_POINT_GROUP, cached_supported_features
+from .feature_array import FeatureArray
+from .feature_plan import FeaturePlan
+from .rag_statistics import RagStatistics
+from .profiling import Profile, NULL_PROFILE
 
 class Rag(object):
     """
@@ -101,7 +110,18 @@ class Rag(object):
     # Used internally, during initialization
     _EdgeData = namedtuple("_EdgeData", "mask mask_coords ids forwardness")
     
-    def __init__( self, label_img, flat_superpixels=False ):
+    #: If True, each construction, ``compute_features()`` and ``compute_statistics()`` call
+    #: is profiled, and its measurements are stored in :py:attr:`last_profile`. |br|
+    #: (Set via the constructor, or at any time afterwards, e.g. for a deserialized Rag.)
+    profile = False
+
+    #: The :py:class:`~ilastikrag.profiling.Profile` of the most recent profiled operation (or ``None``).
+    last_profile = None
+
+    # The Profile of the operation in progress (if any)
+    _profile = NULL_PROFILE
+
+    def __init__( self, label_img, flat_superpixels=False, profile=False ):
         """
         Parameters
         ----------
@@ -114,7 +134,20 @@ class Rag(object):
         flat_superpixels
             *bool* |br|
             Set to ``True`` if ``label_img`` is a 3D volume whose superpixels are flat in the xy direction.
+
+        profile
+            *bool* |br|
+            Measure the time and memory of each stage of the construction (and of later feature computations).
+            See :py:attr:`profile` and :py:attr:`last_profile`.
         """
+        self.profile = profile
+
+        # Indexes for computing features on a subset of the edges (created on demand)
+        self._edge_face_index = None
+        self._face_grid_index = None
+        self._sp_slice_ranges = None
+        self._edge_lookup_keys = {}
+
         if isinstance(label_img, str) and label_img == '__will_deserialize__':
             return
 
@@ -131,35 +164,21 @@ class Rag(object):
         self._label_img = label_img.withAxes(axes)
         self._flat_superpixels = flat_superpixels
         
-        edge_datas = OrderedDict()
-        for axis, axiskey in enumerate(label_img.axistags.keys()):
-
-            if flat_superpixels and axiskey == 'z':
-                edge_mask = None # edge_ids_for_axis() supports edge_mask=None
-                edge_mask_coords = None
-            else:
-                edge_mask = edge_mask_for_axis(label_img, axis)
-                edge_mask_coords = nonzero_coord_array(edge_mask).transpose()
-                
-                # Save RAM: Convert to the smallest dtype we can get away with.
-                if (np.array(label_img.shape) < 2**16).all():
-                    edge_mask_coords = edge_mask_coords.astype(np.uint16)
-                else:
-                    edge_mask_coords = edge_mask_coords.astype(np.uint32)
-                    
-            edge_ids = edge_ids_for_axis(label_img, edge_mask, axis)
-            edge_forwardness = edge_ids[:,0] < edge_ids[:,1]
-            edge_ids.sort()
-
-            edge_datas[axiskey] = Rag._EdgeData(edge_mask, edge_mask_coords, edge_ids, edge_forwardness)
-
-        self._init_unique_edge_tables(edge_datas)
-        self._init_dense_edge_tables(edge_datas)
-
-        self._init_edge_ids()
-        self._init_sp_attributes()
-        if flat_superpixels:
-            self._init_flat_edge_label_img(edge_datas)
+        with self._profiling('construction'):
+            edge_datas = OrderedDict()
+            for axiskey in label_img.axistags.keys():
+                edge_datas[axiskey] = self._edge_data_for_axis(label_img, axiskey)
+
+            with self._profile.stage('unique_edge_labels'):
+                self._init_unique_edge_tables(edge_datas)
+            self._init_dense_edge_tables(edge_datas)
+
+            with self._profile.stage('sp_attributes'):
+                self._init_edge_ids()
+                self._init_sp_attributes()
+            if flat_superpixels:
+                with self._profile.stage('flat_edge_label_img'):
+                    self._init_flat_edge_label_img(edge_datas)
 
     @property
     def label_img(self):
@@ -272,6 +291,61 @@ class Rag(object):
         """
         return self._dense_edge_tables
 
+    @contextmanager
+    def _profiling(self, name):
+        """
+        Context manager.  Profile the enclosed operation as a new :py:attr:`last_profile`
+        (if profiling is enabled), or as a stage of the operation that is already being profiled.
+        """
+        if not self.profile or self._profile is not NULL_PROFILE:
+            with self._profile.stage(name):
+                yield
+            return
+
+        profile = self.last_profile = self._profile = Profile(name)
+        profile.start()
+        try:
+            with profile.stage(name):
+                yield
+        finally:
+            profile.stop()
+            self._profile = NULL_PROFILE
+
+    def _accumulator_stage(self, acc):
+        """
+        Return a context manager that profiles the enclosed code as a stage of the given accumulator.
+        """
+        if self._profile is NULL_PROFILE:
+            return NULL_PROFILE.stage(None)
+        return self._profile.stage('accumulator:{}_{}'.format(acc.ACCUMULATOR_ID, acc.ACCUMULATOR_TYPE))
+
+    def _edge_data_for_axis(self, label_img, axiskey):
+        """
+        Scan the given label image for the pixel edges along the given axis, and return them as an _EdgeData tuple.
+        """
+        axis = label_img.axistags.index(axiskey)
+
+        if self._flat_superpixels and axiskey == 'z':
+            edge_mask = None # edge_ids_for_axis() supports edge_mask=None
+            edge_mask_coords = None
+        else:
+            with self._profile.stage('edge_mask:' + axiskey):
+                edge_mask = edge_mask_for_axis(label_img, axis)
+                edge_mask_coords = nonzero_coord_array(edge_mask).transpose()
+                
+                # Save RAM: Convert to the smallest dtype we can get away with.
+                if (np.array(label_img.shape) < 2**16).all():
+                    edge_mask_coords = edge_mask_coords.astype(np.uint16)
+                else:
+                    edge_mask_coords = edge_mask_coords.astype(np.uint32)
+                
+        with self._profile.stage('edge_ids:' + axiskey):
+            edge_ids = edge_ids_for_axis(label_img, edge_mask, axis)
+            edge_forwardness = edge_ids[:,0] < edge_ids[:,1]
+            edge_ids.sort()
+
+        return Rag._EdgeData(edge_mask, edge_mask_coords, edge_ids, edge_forwardness)
+
     def _init_unique_edge_tables(self, edge_datas):
         """
         Initialize the edge_label_lookup_df attribute.
@@ -323,38 +397,84 @@ class Rag(object):
         """
         Construct the N dense_edge_tables (one for each axis)
         """
-        if self._flat_superpixels:
-            dense_axes = 'yx'
-        else:
-            dense_axes = ''.join(self._label_img.axistags.keys())
-        
         # Now create an dense_edge_table for each axis
         self._dense_edge_tables = OrderedDict()
-        for axiskey in dense_axes:
-            edge_data = edge_datas[axiskey]
+        for axiskey in self._dense_axes():
+            with self._profile.stage('dense_edge_table:' + axiskey):
+                self._dense_edge_tables[axiskey] = self._dense_edge_table_for_axis(edge_datas[axiskey])
 
-            # Use uint32 index instead of deafult int64 to save ram            
-            index_u32 = pd.Index(np.arange(len(edge_data.ids)), dtype=np.uint32)
+    def _dense_axes(self):
+        """
+        Return the axes that have a dense_edge_table, e.g. 'zyx' (or 'yx' for flat superpixels).
+        """
+        if self._flat_superpixels:
+            return 'yx'
+        return ''.join(self._label_img.axistags.keys())
 
-            # Initialize with edge sp ids and directionality
-            edge_table = pd.DataFrame( columns=['sp1', 'sp2', 'is_forward'],
-                                       index=index_u32,
-                                       data={ 'sp1': edge_data.ids[:, 0],
-                                              'sp2': edge_data.ids[:, 1],
-                                              'is_forward': edge_data.forwardness } )
+    def _dense_edge_table_for_axis(self, edge_data):
+        """
+        Construct the dense_edge_table for the given _EdgeData (of one axis).
+        """
+        # Use uint32 index instead of deafult int64 to save ram            
+        index_u32 = pd.Index(np.arange(len(edge_data.ids)), dtype=np.uint32)
+
+        # Initialize with edge sp ids and directionality
+        edge_table = pd.DataFrame( columns=['sp1', 'sp2', 'is_forward'],
+                                   index=index_u32,
+                                   data={ 'sp1': edge_data.ids[:, 0],
+                                          'sp2': edge_data.ids[:, 1],
+                                          'is_forward': edge_data.forwardness } )
+
+        # Add 'edge_label' column. Note: pd.merge() is like a SQL 'join'
+        with self._profile.stage('merge'):
+            dense_edge_table = pd.merge(edge_table, self._unique_edge_tables[self._dense_axes()], on=['sp1', 'sp2'], how='left', copy=False)
+        
+        # Append columns for coordinates
+        for key, coords, in zip(self._label_img.axistags.keys(), edge_data.mask_coords):
+            dense_edge_table[key] = coords
 
-            # Add 'edge_label' column. Note: pd.merge() is like a SQL 'join'
-            dense_edge_table = pd.merge(edge_table, self._unique_edge_tables[dense_axes], on=['sp1', 'sp2'], how='left', copy=False)
-            
-            # Append columns for coordinates
-            for key, coords, in zip(self._label_img.axistags.keys(), edge_data.mask_coords):
-                dense_edge_table[key] = coords
+        # Set column names
+        coord_cols = self._label_img.axistags.keys()
+        dense_edge_table.columns = ['sp1', 'sp2', 'forwardness', 'edge_label'] + coord_cols
+        return dense_edge_table
 
-            # Set column names
-            coord_cols = self._label_img.axistags.keys()
-            dense_edge_table.columns = ['sp1', 'sp2', 'forwardness', 'edge_label'] + coord_cols
+    def _init_derived_edge_tables(self, lazy=False, num_threads=None):
+        """
+        For a Rag that was deserialized without its dense_edge_tables (and flat_edge_label_img),
+        re-derive them from the labels and the unique_edge_tables.
 
-            self._dense_edge_tables[axiskey] = dense_edge_table
+        If ``lazy``, each dense table is computed when it is first accessed.
+        Otherwise, they are computed in parallel (one thread per axis).
+        """
+        if isinstance(self._label_img, Rag._EmptyLabels):
+            def raise_missing_labels():
+                raise NotImplementedError("The dense edge tables were not serialized, and can't be "
+                                          "re-derived because the labels were not deserialized, either.")
+            self._dense_edge_tables = LazyDict( (axiskey, raise_missing_labels) for axiskey in self._dense_axes() )
+            self._flat_edge_label_img = None
+            return
+
+        def compute_dense_table(axiskey):
+            logger.debug("Deriving dense edge table for axis {}".format( axiskey ))
+            return self._dense_edge_table_for_axis( self._edge_data_for_axis(self._label_img, axiskey) )
+
+        dense_axes = self._dense_axes()
+        if lazy:
+            self._dense_edge_tables = LazyDict( (axiskey, partial(compute_dense_table, axiskey))
+                                                for axiskey in dense_axes )
+        else:
+            from multiprocessing import cpu_count
+            from multiprocessing.pool import ThreadPool
+
+            pool = ThreadPool( min(num_threads or cpu_count(), len(dense_axes)) )
+            try:
+                dense_tables = pool.map(compute_dense_table, dense_axes)
+            finally:
+                pool.close()
+            self._dense_edge_tables = OrderedDict( zip(dense_axes, dense_tables) )
+
+        if self._flat_superpixels:
+            self._init_flat_edge_label_img( { 'z': self._edge_data_for_axis(self._label_img, 'z') } )
 
     def _init_sp_attributes(self):
         """
@@ -376,11 +496,15 @@ class Rag(object):
         self._max_sp = self._sp_ids.max()
 
 
-    # Initialize Rag.DEFAULT_ACCUMULATOR_CLASSES
-    DEFAULT_ACCUMULATOR_CLASSES = {}
-    for acc_cls in [StandardEdgeAccumulator, StandardSpAccumulator, StandardFlatEdgeAccumulator,
-                    EdgeRegionEdgeAccumulator, SimilarityFlatEdgeAccumulator]:
-        DEFAULT_ACCUMULATOR_CLASSES[(acc_cls.ACCUMULATOR_ID, acc_cls.ACCUMULATOR_TYPE)] = acc_cls
+    # The built-in accumulators (and those registered by other packages),
+    # which are only imported when first needed.
+    DEFAULT_ACCUMULATOR_CLASSES = AccumulatorRegistry([
+        (('standard', 'edge'),       'ilastikrag.accumulators.standard:StandardEdgeAccumulator'),
+        (('standard', 'sp'),         'ilastikrag.accumulators.standard:StandardSpAccumulator'),
+        (('standard', 'flatedge'),   'ilastikrag.accumulators.standard:StandardFlatEdgeAccumulator'),
+        (('edgeregion', 'edge'),     'ilastikrag.accumulators.edgeregion:EdgeRegionEdgeAccumulator'),
+        (('similarity', 'flatedge'), 'ilastikrag.accumulators.similarity:SimilarityFlatEdgeAccumulator') ],
+        entry_point_group=ENTRY_POINT_GROUP )
 
     def supported_features(self, accumulator_set="default"):
         """
@@ -392,30 +516,33 @@ class Rag(object):
         accumulator_set:
             A list of acumulators to consider in addition to the built-in accumulators.
             If ``accumulator_set="default"``, then only the built-in accumulators are considered.
+            (The built-in accumulators include those in ``Rag.DEFAULT_ACCUMULATOR_CLASSES``,
+            i.e. any that were registered via the ``ilastikrag.accumulators`` entry point group.)
         
         Returns
         -------
         *list* of *str*
             The list acceptable feature names.
         """
-        Rag._check_accumulator_conflicts(accumulator_set)
+        accumulators_by_key = Rag._check_accumulator_conflicts(accumulator_set)
 
         feature_groups = {}
-        if accumulator_set != "default":
-            for acc in accumulator_set:
-                feature_groups[(acc.ACCUMULATOR_ID, acc.ACCUMULATOR_TYPE)] = acc.supported_features()
+        for key, acc in accumulators_by_key.items():
+            feature_groups[key] = cached_supported_features(type(acc), self)
 
-        for (acc_id, acc_type) in Rag.DEFAULT_ACCUMULATOR_CLASSES.keys():
-            if (acc_id, acc_type) not in feature_groups:
-                acc_cls = Rag.DEFAULT_ACCUMULATOR_CLASSES[(acc_id, acc_type)]
-                feature_groups[(acc_id, acc_type)] = acc_cls.supported_features(self)
+        for key in Rag.DEFAULT_ACCUMULATOR_CLASSES.keys():
+            if key not in feature_groups:
+                acc_cls = Rag.DEFAULT_ACCUMULATOR_CLASSES[key]
+                feature_groups[key] = cached_supported_features(acc_cls, self)
 
         feature_names = []
         for group_names in feature_groups.values():
             feature_names += group_names
         return feature_names
 
-    def compute_features(self, value_img, feature_names, edge_group=None, accumulator_set="default"):
+    def compute_features(self, value_img, feature_names, edge_group=None, accumulator_set="default", blocksize=None,
+                         asarray=False, out=None, quantile_method="histogram", edges=None, roi=None,
+                         roi_whole_edges=False, feature_store=None, fingerprint=None):
         """
         The primary API function for computing features. |br|
         Returns a pandas DataFrame with columns ``['sp1', 'sp2', ...output feature names...]``
@@ -464,11 +591,99 @@ class Rag(object):
             A list of acumulators to use in addition to the built-in accumulators.
             If ``accumulator_set="default"``, then only the built-in accumulators can be used.
 
+        blocksize
+            *int* (Optional)                                                                      |br|
+            If provided, ``value_img`` is processed in blocks of ``blocksize`` slices along its
+            first axis (usually ``z``), so that only one block of pixel values is held in RAM at a time.
+
+            In that case, ``value_img`` may also be an ``h5py.Dataset`` or ``numpy.memmap``
+            (with the same axis order as ``self.label_img``).
+            Such value images are always processed blockwise (with a default ``blocksize``,
+            if you don't provide one).
+
+            Histogram-based features (e.g. quantiles) are computed with the value range of the entire
+            value image, so they may differ slightly from the results of non-blockwise processing.
+
+        asarray
+            *bool* (Optional)                                                                     |br|
+            If True, return a :py:class:`~ilastikrag.feature_array.FeatureArray` instead of a DataFrame.
+            The features are written directly into the columns of a single 2D ``float32`` array,
+            which avoids the overhead of building (and copying) a DataFrame column by column.
+
+        out
+            *ndarray* (Optional)                                                                  |br|
+            A ``float32`` array of shape ``(N_edges, N_features)`` to write the features into,
+            e.g. a ``numpy.memmap``.  Implies ``asarray=True``.
+            Only valid if a single ``edge_group`` is requested.
+
+        quantile_method
+            *str* (Optional)                                                                      |br|
+            How the built-in accumulators compute ``quantiles`` features:
+
+            - ``'histogram'`` (default): Estimate the quantiles from a 64-bin histogram per edge
+              (or superpixel).  Fast and needs little memory, but the results are only approximate.
+            - ``'exact'``: Sort the values within each edge (or superpixel) and read the exact quantiles
+              (linearly interpolated, as in ``numpy.percentile()``).  This requires an extra ~24 bytes
+              of RAM per value (the sort is over all edge pixels, or for ``sp`` features, the entire volume),
+              and is typically a few times slower than the histogram method.
+            - ``'sketch'``: Summarize the values in a mergeable quantile sketch with bounded memory per
+              edge (or superpixel).  Each quantile is within 1% (relative error) of the exact value.
+              Unlike the histogram method, no global value range is needed when processing blockwise.
+
+            (Has no effect on accumulators you pass in via ``accumulator_set``.)
+
+        edges
+            *ndarray* (Optional)                                                                  |br|
+            Compute the features for only these edges, given either as ``edge_label`` values
+            (i.e. row numbers of ``unique_edge_tables[edge_group]``), or as an array of ``(sp1, sp2)`` pairs.
+            The result has one row per requested edge, in the same order.
+            Only valid if a single ``edge_group`` is requested.
+
+            Only the pixels of the requested edges are processed by the ``edge`` accumulators,
+            and only the slices (along the first axis) that contain the superpixels adjacent to
+            those edges are processed by the ``sp`` and ``flatedge`` accumulators.
+            (Histogram-based features use the value range of those slices,
+            so they may differ slightly from the results for all edges.) |br|
+            Finding those slices requires one pass over the entire ``label_img`` (on first use),
+            so the first call is not proportionally cheaper for a small subset of the edges. |br|
+            If any of the accumulators can't process a subset of the edges (or can't process the
+            values blockwise), the features are computed for all edges, and the requested rows are selected.
+
+        roi
+            *tuple* ``(start, stop)`` (Optional)                                                  |br|
+            Compute the features for only the edges within this region of interest,
+            i.e. the edges that would be present if ``label_img`` were cropped to
+            ``label_img[start[0]:stop[0], start[1]:stop[1], ...]``.
+            The ``edge`` features are computed over only the edge pixels within the roi
+            (unless ``roi_whole_edges=True``), but ``sp`` and ``flatedge`` features always
+            describe entire superpixels and edges.
+            The result has one row per edge, ordered as in ``unique_edge_tables[edge_group]``.
+            Only valid if a single ``edge_group`` is requested.
+
+        roi_whole_edges
+            *bool* (Optional)                                                                     |br|
+            If True, compute the ``edge`` features of each edge within the roi
+            over *all* of its pixels, including those outside of the roi.
+
+        feature_store
+            :py:class:`~ilastikrag.feature_store.FeatureStore` (Optional)                         |br|
+            Read the requested features from this store, if they were already computed for the same
+            ``value_img`` (e.g. in an earlier session).  Only the missing features are computed,
+            and they are added to the store.
+            Can't be combined with ``edges`` or ``roi``.
+
+        fingerprint
+            *str* (Optional)                                                                      |br|
+            Identifies ``value_img`` in the ``feature_store``.
+            By default, it is computed from the contents of ``value_img``
+            (see :py:func:`~ilastikrag.util.value_fingerprint`), which requires reading the entire image.
+
         Returns
         -------
         *pandas.DataFrame*
-            All unique superpixel edges in the volume,
+            All unique superpixel edges in the volume (or the requested ``edges``),
             with computed features stored in the columns.
+            (Or a ``FeatureArray`` with the same contents, if ``asarray=True``.)
 
         Example
         -------
@@ -490,9 +705,179 @@ class Rag(object):
         +---------+---------+------------------------+---------------------------+----------------------------------+
 
         """
-        assert value_img is None or hasattr(value_img, 'axistags'), \
-            "For optimal performance, make sure label_img is a VigraArray with accurate axistags"
-        dense_axes =''.join(self.dense_edge_tables.keys())
+        with self._profiling('compute_features'):
+            with self._profile.stage('plan_features'):
+                plan = self.plan_features(feature_names, edge_group, accumulator_set, quantile_method)
+            if feature_store is not None:
+                assert edges is None and roi is None, \
+                    "Can't select edges or an roi when using a feature_store (features are stored for all edges)."
+                return self._compute_stored_features(plan, feature_store, fingerprint, value_img, accumulator_set,
+                                                     blocksize, asarray, out, quantile_method)
+            return self._compute_planned_features(plan, value_img, blocksize, asarray, out, edges, roi, roi_whole_edges)
+
+    def _compute_stored_features(self, plan, feature_store, fingerprint, value_img, accumulator_set="default",
+                                 blocksize=None, asarray=False, out=None, quantile_method="histogram"):
+        """
+        Read the features of the given FeaturePlan from the given FeatureStore,
+        after computing (and storing) the ones that aren't stored yet.
+        See compute_features() for details.
+        """
+        if out is not None:
+            assert len(plan.edge_groups) == 1, \
+                "Can't use an out array with more than one edge_group."
+            asarray = True
+
+        if fingerprint is None:
+            fingerprint = value_fingerprint(value_img, self._choose_blocksize(value_img, blocksize))
+        if quantile_method != "histogram":
+            # The quantile features depend on the method, too.
+            fingerprint = '{}_{}'.format(fingerprint, quantile_method)
+
+        results = OrderedDict()
+        for edge_group, (edge_ids, accumulators, _output_columns) in plan._group_plans.items():
+            # Same order as the columns from compute_features()
+            feature_names = [name for _acc, feature_group_names in accumulators for name in feature_group_names]
+
+            missing_names = feature_store.missing_features(edge_group, fingerprint, feature_names)
+            if missing_names:
+                logger.debug("Computing {} features that aren't stored yet".format( len(missing_names) ))
+                features_df = self.compute_features(value_img, missing_names, edge_group, accumulator_set,
+                                                    blocksize, quantile_method=quantile_method)
+                feature_store.write(edge_group, fingerprint, missing_names, features_df)
+
+            columns = feature_store.read(edge_group, fingerprint, feature_names)
+            if asarray:
+                if out is None:
+                    out = np.empty( (len(edge_ids), len(columns)), dtype=np.float32 )
+                assert out.shape == (len(edge_ids), len(columns)), \
+                    "out array has the wrong shape: {}".format( out.shape )
+                for column_index, values in enumerate(columns.values()):
+                    out[:, column_index] = values
+                results[edge_group] = FeatureArray(edge_ids, out, columns.keys())
+                out = None
+            else:
+                index_u32 = pd.Index(np.arange(len(edge_ids)), dtype=np.uint32)
+                edge_df = pd.DataFrame(edge_ids, columns=['sp1', 'sp2'], index=index_u32)
+                for colname, values in columns.items():
+                    edge_df[colname] = values
+                results[edge_group] = edge_df
+
+        if len(results) == 1:
+            return results.values()[0]
+        return results
+
+    def plan_features(self, feature_names, edge_group=None, accumulator_set="default", quantile_method="histogram"):
+        """
+        Prepare the computation of the given features, and return it as a reusable
+        :py:class:`~ilastikrag.feature_plan.FeaturePlan`. |br|
+        The feature names are parsed and validated, and the accumulators are constructed, only once.
+
+        Use this instead of :py:meth:`compute_features()` if you need the same features
+        for many value images, e.g. for several channels or time points on the same superpixels.
+
+        Parameters
+        ----------
+        feature_names, edge_group, accumulator_set, quantile_method
+            Same as for :py:meth:`compute_features()`.
+
+        Returns
+        -------
+        :py:class:`~ilastikrag.feature_plan.FeaturePlan`
+
+        Example
+        -------
+        ::
+
+           >>> plan = rag.plan_features(['standard_edge_mean', 'standard_sp_count'])
+           >>> for channel_img in channel_imgs:
+           ...     feature_df = plan.compute(channel_img)
+        """
+        edge_groups = self._get_edge_groups(edge_group)
+        accumulators_by_key = Rag._check_accumulator_conflicts(accumulator_set)
+        feature_groups = self._get_feature_groups(feature_names)
+        dense_axes = ''.join(self.dense_edge_tables.keys())
+
+        group_plans = OrderedDict()
+        for edge_group in edge_groups:
+            if edge_group == dense_axes:
+                edge_ids = self.unique_edge_tables[dense_axes][['sp1', 'sp2']].values
+                acc_types = ('edge', 'sp')
+            else:
+                # FIXME: This recomputes the sp features
+                edge_ids = self.unique_edge_tables['z'][['sp1', 'sp2']].values
+                acc_types = ('flatedge', 'sp')
+
+            accumulators = self._create_accumulators(feature_groups, acc_types, accumulators_by_key, quantile_method)
+            output_columns = self._plan_output_columns(accumulators)
+            group_plans[edge_group] = (edge_ids, accumulators, output_columns)
+
+        return FeaturePlan(self, feature_names, group_plans)
+
+    def compute_statistics(self, value_img, blocksize=None, quantile_sketch=False):
+        """
+        Compute the (mergeable) sufficient statistics of the pixel values on each edge and in each superpixel,
+        i.e. their counts, means, central moments, minimums and maximums (and optionally, quantile sketches). |br|
+        The standard features of the edges can be computed from the result, and also the features of the
+        edges that result from merging superpixels (see :py:meth:`RagStatistics.merge_edges()
+        <ilastikrag.rag_statistics.RagStatistics.merge_edges>`), without reading the value image again.
+
+        Only the edges in :py:attr:`dense_edge_tables` are included
+        (i.e. for flat superpixels, only the ``yx`` edges).
+
+        Parameters
+        ----------
+        value_img
+            *VigraArray*, same shape as ``self.label_img``.
+
+        blocksize
+            *int* (Optional) -- process ``value_img`` in blocks of this many slices
+            (as in :py:meth:`compute_features()`).
+
+        quantile_sketch
+            *bool* (Optional) -- also keep a ``QuantileSketch`` of the edge and superpixel values,
+            so that approximate quantiles can be computed (for merged edges, too).
+
+        Returns
+        -------
+        :py:class:`~ilastikrag.rag_statistics.RagStatistics`
+
+        Example
+        -------
+        ::
+
+           >>> stats = rag.compute_statistics(probability_img)
+           >>> merged_stats = stats.merge_edges(sp_groups)
+           >>> features_df = merged_stats.edge_features(['standard_edge_mean', 'standard_sp_count'])
+        """
+        with self._profiling('compute_statistics'):
+            assert value_img is not None, "Can't compute statistics without a value image"
+            blocksize = self._choose_blocksize(value_img, blocksize)
+
+            quantile_method = 'sketch' if quantile_sketch else 'histogram'
+            edge_acc = Rag.DEFAULT_ACCUMULATOR_CLASSES[('standard', 'edge')](self, [], quantile_method, keep_statistics=True)
+            sp_acc = Rag.DEFAULT_ACCUMULATOR_CLASSES[('standard', 'sp')](self, [], quantile_method, keep_statistics=True)
+            accumulators = [(edge_acc, []), (sp_acc, [])]
+            try:
+                if blocksize:
+                    self._ingest_values_blockwise(accumulators, value_img, blocksize)
+                else:
+                    self._ingest_values(accumulators, value_img)
+
+                dense_axes = ''.join(self.dense_edge_tables.keys())
+                edge_ids = self.unique_edge_tables[dense_axes][['sp1', 'sp2']].values
+                return RagStatistics( edge_ids,
+                                      edge_acc.sufficient_statistics(),
+                                      sp_acc.sufficient_statistics(),
+                                      self._label_img.ndim )
+            finally:
+                edge_acc.cleanup()
+                sp_acc.cleanup()
+
+    def _get_edge_groups(self, edge_group=None):
+        """
+        Validate the given edge_group (str or list-of-str) and return it as a list.
+        """
+        dense_axes = ''.join(self.dense_edge_tables.keys())
 
         if self.flat_superpixels:
             valid_edge_groups = ('z', 'yx')
@@ -503,75 +888,148 @@ class Rag(object):
             assert not self._flat_superpixels, "Must provide an edge_group"
             edge_group = dense_axes
 
-        edge_group = str(edge_group)
-
-        results = OrderedDict()
-        if isinstance(edge_group, str):
-            results[edge_group] = None
+        if isinstance(edge_group, basestring):
+            edge_groups = [str(edge_group)]
         else:
-            for t in edge_group:
-                results[t] = None
-        assert all(edge_group in valid_edge_groups for edge_group in results.keys()), \
+            edge_groups = list(OrderedDict.fromkeys(map(str, edge_group)))
+        assert all(edge_group in valid_edge_groups for edge_group in edge_groups), \
             "Unsupported edge_group."
-        
-        feature_groups = self._get_feature_groups(feature_names, accumulator_set)
-        
-        if dense_axes in results.keys():
-            # Create a DataFrame for the results
-            dense_axes = ''.join(self.dense_edge_tables.keys())
-            dense_edge_ids = self.unique_edge_tables[dense_axes][['sp1', 'sp2']].values
-            
-            index_u32 = pd.Index(np.arange(len(dense_edge_ids)), dtype=np.uint32)
-            edge_df = pd.DataFrame(dense_edge_ids, columns=['sp1', 'sp2'], index=index_u32)
-    
-            # Compute and append columns
-            if 'edge' in feature_groups:
-                edge_df = self._append_edge_features_for_values(edge_df, feature_groups['edge'], value_img, accumulator_set)
-    
-            if 'sp' in feature_groups:
-                edge_df = self._append_sp_features_for_values(edge_df, feature_groups['sp'], value_img, accumulator_set)
-            
-            results[dense_axes] = edge_df
-
-            # Typecheck the columns to help new accumulator authors spot problems in their code.
-            dtypes = { colname: series.dtype for colname, series in edge_df.iterkv() }
-            assert all(dtype != np.float64 for dtype in dtypes.values()), \
-                "An accumulator returned float64 features. That's a waste of ram.\n"\
-                "dtypes were: {}".format(dtypes)
+        return edge_groups
 
+    def _get_edge_labels(self, edge_group, edges):
+        """
+        Convert the given edges of the given edge_group (either edge_label values,
+        or an array of (sp1, sp2) pairs) to a 1D array of edge_label values.
+        """
+        edge_table = self.unique_edge_tables[edge_group]
+        edges = np.asarray(edges)
+        assert len(edges) > 0, "No edges selected."
+
+        if edges.ndim == 1:
+            edge_labels = edges.astype(np.intp)
+            assert ((edge_labels >= 0) & (edge_labels < len(edge_table))).all(), \
+                "Invalid edge labels for edge_group '{}'".format( edge_group )
+            return edge_labels
+
+        assert edges.ndim == 2 and edges.shape[1] == 2, \
+            "edges must be a list of edge labels or (sp1, sp2) pairs"
+
+        # The unique_edge_table is sorted by (sp1, sp2),
+        # so we can look up the packed pairs with a binary search.
+        table_keys = self._edge_lookup_keys.get(edge_group)
+        if table_keys is None:
+            table_keys = self._pack_edge_ids(edge_table[['sp1', 'sp2']].values)
+            self._edge_lookup_keys[edge_group] = table_keys
+
+        keys = self._pack_edge_ids(np.sort(edges, axis=1))
+        edge_labels = np.searchsorted(table_keys, keys)
+        found = (edge_labels < len(table_keys))
+        found[found] = (table_keys[edge_labels[found]] == keys[found])
+        assert found.all(), \
+            "Some edges are not in edge_group '{}': {}".format( edge_group, edges[~found][:10].tolist() )
+        return edge_labels
+
+    def _get_roi_edges(self, edge_group, roi, whole_edges=False):
+        """
+        Find the edges of the given edge_group within the given roi.
 
-        # FIXME: This recomputes the sp features
-        if 'z' in results.keys():
-            # Create a DataFrame for the results
-            index_u32 = pd.Index(np.arange(len(self.unique_edge_tables['z'])), dtype=np.uint32)
-            edge_df = pd.DataFrame(self.unique_edge_tables['z'][['sp1', 'sp2']].values, columns=['sp1', 'sp2'], index=index_u32)
-    
-            # Compute and append columns
-            if 'flatedge' in feature_groups:
-                edge_df = self._append_flatedge_features_for_values(edge_df, feature_groups['flatedge'], value_img, accumulator_set)
-    
-            if 'sp' in feature_groups:
-                edge_df = self._append_sp_features_for_values(edge_df, feature_groups['sp'], value_img, accumulator_set)
+        Returns: (edge_labels, dense_edge_tables), where dense_edge_tables contains only the pixel faces
+                 inside the roi (or is None, if the features should cover whole edges).
+        """
+        start, stop = roi
+        start = np.maximum(0, start).astype(int)
+        stop = np.minimum(self._label_img.shape, stop).astype(int)
+        assert len(start) == len(stop) == self._label_img.ndim, \
+            "roi must have one (start, stop) coordinate per label_img axis"
+        assert (start < stop).all(), "roi is empty: {}".format( roi )
+
+        dense_axes = ''.join(self.dense_edge_tables.keys())
+        if edge_group == dense_axes:
+            dense_edge_tables = self._dense_edge_tables_in_roi(start, stop)
+            edge_labels = np.unique(np.concatenate([ dense_edge_table['edge_label'].values
+                                                     for dense_edge_table in dense_edge_tables.values() ]))
+            if whole_edges:
+                dense_edge_tables = None
+        else:
+            # Flat edges are labeled in the slice before them, but also need the slice after them.
+            flat_roi = tuple( slice(a, b) for (a, b) in zip(start, stop) )
+            flat_roi = (slice(start[0], stop[0]-1),) + flat_roi[1:]
+            edge_labels = np.unique(np.asarray(self.flat_edge_label_img[flat_roi]))
+            dense_edge_tables = None
 
-            results['z'] = edge_df
-            
-            # Typecheck the columns to help new accumulator authors spot problems in their code.
-            dtypes = { colname: series.dtype for colname, series in edge_df.iterkv() }
-            assert all(dtype != np.float64 for dtype in dtypes.values()), \
-                "An accumulator returned float64 features. That's a waste of ram.\n"\
-                "dtypes were: {}".format(dtypes)
+        assert len(edge_labels) > 0, "There are no edges within the roi: {}".format( roi )
+        return edge_labels.astype(np.intp), dense_edge_tables
 
-        if len(results) == 1:
-            return results.values()[0]
-        return results
+    @classmethod
+    def _pack_edge_ids(cls, edge_ids):
+        """
+        Pack each (sp1, sp2) pair into a single uint64.
+        """
+        edge_ids = edge_ids.astype(np.uint64)
+        return (edge_ids[:, 0] << np.uint64(32)) | edge_ids[:, 1]
 
-    def _get_feature_groups(self, feature_names, accumulator_set="default"):
+    def _compute_planned_features(self, plan, value_img, blocksize=None, asarray=False, out=None, edges=None,
+                                  roi=None, roi_whole_edges=False):
+        """
+        Compute the features of the given FeaturePlan for the given value_img.
+        See compute_features() for details.
+        """
+        assert plan.rag is self, "This FeaturePlan was created for a different Rag."
+        blocksize = self._choose_blocksize(value_img, blocksize)
+
+        if out is not None:
+            assert len(plan.edge_groups) == 1, \
+                "Can't use an out array with more than one edge_group."
+            asarray = True
+
+        with self._profiling('compute'):
+            edge_labels = None
+            roi_edge_tables = None
+            if edges is not None or roi is not None:
+                assert len(plan.edge_groups) == 1, \
+                    "Can't select edges with more than one edge_group."
+                assert edges is None or roi is None, \
+                    "Can't select edges and an roi at the same time."
+            if edges is not None:
+                edge_labels = self._get_edge_labels(plan.edge_groups[0], edges)
+            if roi is not None:
+                edge_labels, roi_edge_tables = self._get_roi_edges(plan.edge_groups[0], roi, roi_whole_edges)
+
+            results = OrderedDict()
+            for edge_group, (edge_ids, accumulators, output_columns) in plan._group_plans.items():
+                with self._profile.stage('edge_group:' + edge_group):
+                    results[edge_group] = self._compute_features_for_values(edge_ids, accumulators, output_columns,
+                                                                            value_img, blocksize, asarray, out,
+                                                                            edge_labels, roi_edge_tables)
+
+            if len(results) == 1:
+                return results.values()[0]
+            return results
+
+    def _choose_blocksize(self, value_img, blocksize=None):
+        """
+        Return the blocksize to process the given value_img with (or None, to process it all at once),
+        and check the value_img.
+        """
+        if value_img is None:
+            # Nothing to stream
+            blocksize = None
+        elif blocksize is None and ( not isinstance(value_img, np.ndarray)
+                                     or isinstance(value_img, np.memmap) ):
+            # Value images that live on disk are always processed blockwise.
+            blocksize = self._default_blocksize()
+
+        assert value_img is None or blocksize or hasattr(value_img, 'axistags'), \
+            "For optimal performance, make sure value_img is a VigraArray with accurate axistags"
+        assert not blocksize or tuple(value_img.shape) == tuple(self._label_img.shape), \
+            "value_img has the wrong shape: {}".format( value_img.shape )
+        return blocksize
+
+    def _get_feature_groups(self, feature_names):
         """
         For the given list of feature_names, return features grouped in a dict:
             feature_groups[acc_type][acc_id] : [feature_name1, feature_name2, ...]
         """
-        Rag._check_accumulator_conflicts(accumulator_set)
-
         feature_names = map(str.lower, feature_names)
         sorted_feature_names = sorted(feature_names, key=lambda name: name.split('_')[:2])
 
@@ -590,109 +1048,533 @@ class Rag(object):
 
         return feature_groups
 
-    def _append_edge_features_for_values(self, edge_df, edge_feature_groups, value_img, accumulator_set="default"):
+    def _compute_features_for_values(self, edge_ids, accumulators, output_columns, value_img,
+                                     blocksize=None, asarray=False, out=None, edge_labels=None,
+                                     dense_edge_tables=None):
         """
-        Compute edge features and append them as columns to the given DataFrame.
+        Compute features with the given (planned) accumulators for the given edges.
+        Returns a DataFrame with columns (sp1, sp2, ...features...), or a FeatureArray if asarray=True.
         
-        edge_df: DataFrame with columns (sp1, sp2) at least.
-        edge_feature_groups: Dict of { accumulator_id : [feature_name, feature_name...] }
+        edge_ids: ndarray of (sp1, sp2) pairs, in the same order as the corresponding unique_edge_table.
+        accumulators: list of (accumulator, feature_group_names), as returned by _create_accumulators()
+        output_columns: The planned column names of each accumulator (see _plan_output_columns())
+        value_img: ndarray of pixel values (or h5py.Dataset, if blocksize is given), or None
+        blocksize: If not None, ingest value_img in blocks of this many slices.
+        asarray: If True, return a FeatureArray instead of a DataFrame.
+        out: (Optional) float32 array of shape (len(edge_ids), N_features) to write the FeatureArray values into.
+        edge_labels: (Optional) Compute features for only these rows of the unique_edge_table.
+        dense_edge_tables: (Optional) Compute the edge features over only these pixel faces of the given edge_labels.
+        """
+        try:
+            # The same accumulator instance may be shared by several plans,
+            # so make sure it provides the columns of this one.
+            for (acc, _names), column_names in zip(accumulators, output_columns):
+                if column_names is not None:
+                    acc.select_output_columns(column_names)
+
+            row_labels = None
+            if not self._select_edges(accumulators, edge_labels):
+                assert dense_edge_tables is None, \
+                    "Can't restrict features to an roi: Not all accumulators support edge subsets."
+                # Some accumulator can't handle a subset of the edges.
+                # Compute features for all edges, and select the rows afterwards.
+                row_labels, edge_labels = edge_labels, None
+
+            if edge_labels is not None:
+                edge_ids = edge_ids[edge_labels]
+                self._ingest_values_for_edges(accumulators, value_img, blocksize, edge_labels, edge_ids, dense_edge_tables)
+            elif blocksize:
+                self._ingest_values_blockwise(accumulators, value_img, blocksize)
+            else:
+                self._ingest_values(accumulators, value_img)
+
+            if asarray:
+                if row_labels is None:
+                    return self._write_feature_array(accumulators, output_columns, edge_ids, out)
+                features = self._write_feature_array(accumulators, output_columns, edge_ids)
+                if out is None:
+                    out = features.values[row_labels]
+                else:
+                    out[:] = features.values[row_labels]
+                return FeatureArray(edge_ids[row_labels], out, features.column_names)
+
+            # Create a DataFrame for the results
+            if edge_labels is None:
+                index_u32 = pd.Index(np.arange(len(edge_ids)), dtype=np.uint32)
+            else:
+                index_u32 = pd.Index(edge_labels, dtype=np.uint32)
+            edge_df = pd.DataFrame(edge_ids, columns=['sp1', 'sp2'], index=index_u32)
+
+            # Compute and append columns
+            for acc, feature_group_names in accumulators:
+                num_columns = len(edge_df.columns)
+                with self._accumulator_stage(acc):
+                    edge_df = acc.append_edge_features_to_df(edge_df)
+
+                # Accumulators without an output column plan may provide more
+                # features than the user is asking for right now.  Drop them all at once.
+                extra_columns = filter(lambda colname: not Rag._is_requested_column(acc, feature_group_names, colname),
+                                       edge_df.columns.values[num_columns:])
+                if extra_columns:
+                    edge_df.drop(extra_columns, axis=1, inplace=True)
+
+            if row_labels is not None:
+                edge_df = edge_df.iloc[row_labels]
+        finally:
+            for acc, _feature_group_names in accumulators:
+                acc.cleanup()
+
+        # Typecheck the columns to help new accumulator authors spot problems in their code.
+        dtypes = { colname: series.dtype for colname, series in edge_df.iterkv() }
+        assert all(dtype != np.float64 for dtype in dtypes.values()), \
+            "An accumulator returned float64 features. That's a waste of ram.\n"\
+            "dtypes were: {}".format(dtypes)
+
+        return edge_df
+
+    def _create_accumulators(self, feature_groups, acc_types, accumulators_by_key, quantile_method="histogram"):
+        """
+        Create an accumulator for each feature group of the given types.
+        Returns a list of (accumulator, feature_group_names) pairs.
+
+        accumulators_by_key: The user's accumulators, as returned by _check_accumulator_conflicts()
+        """
+        accumulators = []
+        for acc_type in acc_types:
+            if acc_type not in feature_groups:
+                continue
+
+            if acc_type == 'sp' and isinstance(self._label_img, Rag._EmptyLabels):
+                raise NotImplementedError("Can't compute superpixel-based features.\n"
+                                          "You deserialized the Rag without deserializing the labels.")
+            if acc_type == 'flatedge' and isinstance(self._label_img, Rag._EmptyLabels):
+                raise NotImplementedError("Can't compute flatedge features.\n"
+                                          "You deserialized the Rag without deserializing the labels.")
+
+            for acc_id, feature_group_names in feature_groups[acc_type].items():
+                acc = self._select_accumulator_for_group(acc_id, acc_type, feature_group_names, accumulators_by_key, quantile_method)
+                unsupported_names = set(feature_group_names) - set(cached_supported_features(type(acc), self))
+                assert not unsupported_names, \
+                    "Some of your requested features aren't supported by this accumulator: {}".format(unsupported_names)
+                accumulators.append( (acc, feature_group_names) )
+        return accumulators
+
+    def _plan_output_columns(self, accumulators):
+        """
+        Determine which output columns each of the given accumulators must provide,
+        and tell each accumulator (before it ingests any values), so it can skip the rest.
+
+        Returns a list with the (ordered) output column names of each accumulator,
+        or None for accumulators that don't implement output_column_names().
+        """
+        output_columns = []
+        for acc, feature_group_names in accumulators:
+            column_names = acc.output_column_names()
+            if column_names is not None:
+                column_names = filter(lambda colname: Rag._is_requested_column(acc, feature_group_names, colname),
+                                      column_names)
+                acc.select_output_columns(column_names)
+            output_columns.append(column_names)
+        return output_columns
+
+    def _select_edges(self, accumulators, edge_labels):
+        """
+        Tell the (non-sp) accumulators which edges features are needed for (or None for all edges).
+        If any of them doesn't support edge subsets, all edges are selected instead, and False is returned.
+        (Edge subsets are ingested blockwise, so accumulators without blockwise support don't support them, either.)
+        """
+        supported = []
+        for acc, _names in accumulators:
+            if acc.ACCUMULATOR_TYPE != 'sp':
+                supported.append( acc.select_edges(edge_labels) )
+            supported.append( Rag._supports_blockwise(acc) )
+
+        if edge_labels is not None and not all(supported):
+            self._select_edges(accumulators, None)
+            return False
+        return True
+
+    @classmethod
+    def _supports_blockwise(cls, acc):
+        """
+        Return True if the given accumulator reimplements its base class's blockwise ingest function.
+        """
+        if acc.ACCUMULATOR_TYPE == 'edge':
+            base_class, method_name = BaseEdgeAccumulator, 'ingest_edges_for_block'
+        elif acc.ACCUMULATOR_TYPE == 'sp':
+            base_class, method_name = BaseSpAccumulator, 'ingest_values_for_block'
+        else:
+            base_class, method_name = BaseFlatEdgeAccumulator, 'ingest_values_for_block'
+
+        if not isinstance(acc, base_class):
+            return True
+        return getattr(type(acc), method_name).__func__ is not getattr(base_class, method_name).__func__
+
+    @classmethod
+    def _is_requested_column(cls, acc, feature_group_names, colname):
+        """
+        Accumulators may provide more features than the user is asking for.
+        Return False for output columns that weren't requested.
+        """
+        acc_prefix = '{}_{}_'.format(acc.ACCUMULATOR_ID, acc.ACCUMULATOR_TYPE)
+        return not colname.startswith(acc_prefix) or any(colname.startswith(name) for name in feature_group_names)
+
+    def _write_feature_array(self, accumulators, output_columns, edge_ids, out=None):
+        """
+        Write the features of the given (already ingested) accumulators
+        into the columns of a 2D float32 array and return it as a FeatureArray.
+
+        output_columns: The planned column names of each accumulator (see _plan_output_columns())
+
+        Accumulators that don't implement output_column_names() are
+        asked for a DataFrame instead, which is then copied into the array.
+        """
+        acc_columns = []
+        for (acc, feature_group_names), column_names in zip(accumulators, output_columns):
+            fallback_df = None
+            if column_names is None:
+                fallback_df = pd.DataFrame(edge_ids, columns=['sp1', 'sp2'])
+                with self._accumulator_stage(acc):
+                    fallback_df = acc.append_edge_features_to_df(fallback_df)
+                column_names = filter(lambda colname: Rag._is_requested_column(acc, feature_group_names, colname),
+                                      fallback_df.columns.values[2:])
+            acc_columns.append( (acc, column_names, fallback_df) )
+
+        all_column_names = sum( (column_names for (_acc, column_names, _df) in acc_columns), [] )
+        shape = ( len(edge_ids), len(all_column_names) )
+        if out is None:
+            out = np.empty(shape, dtype=np.float32)
+        assert tuple(out.shape) == shape, \
+            "out array has the wrong shape: {} (expected {})".format(out.shape, shape)
+        assert out.dtype == np.float32, \
+            "out array must have dtype float32, not {}".format(out.dtype)
+
+        first_column = 0
+        for acc, column_names, fallback_df in acc_columns:
+            out_columns = OrderedDict()
+            for column_name in column_names:
+                out_columns[column_name] = out[:, first_column]
+                first_column += 1
+
+            if fallback_df is None:
+                with self._accumulator_stage(acc):
+                    acc.write_edge_features(edge_ids, out_columns)
+            else:
+                for column_name, out_column in out_columns.items():
+                    out_column[:] = fallback_df[column_name].values
+
+        return FeatureArray(edge_ids, out, all_column_names)
+
+    def _ingest_values(self, accumulators, value_img):
+        """
+        Pass the entire value_img (or the edge values extracted from it)
+        to each of the given accumulators.
+
+        accumulators: list of (accumulator, feature_group_names)
         value_img: ndarray of pixel values, or None
-        accumulator_set: A list of additional accumulators to consider, or "default" to just use built-in.
         """
-        # Extract values at the edge pixels
+        edge_values = None
+        if value_img is not None and any(acc.ACCUMULATOR_TYPE == 'edge' for acc, _names in accumulators):
+            edge_values = self._extract_edge_values(self.dense_edge_tables, value_img)
+
+        for acc, _names in accumulators:
+            with self._accumulator_stage(acc):
+                if acc.ACCUMULATOR_TYPE == 'edge':
+                    acc.ingest_edges(self, edge_values)
+                else:
+                    acc.ingest_values(self, value_img)
+
+    def _ingest_values_blockwise(self, accumulators, value_img, blocksize, dense_edge_tables=None, slice_range=None):
+        """
+        Pass the given value_img to each of the given accumulators, one block at a time.
+        Each block consists of ``blocksize`` slices along the first axis, and is read only once.
+        Edge accumulators receive only the rows of the dense_edge_tables that lie within the block.
+
+        accumulators: list of (accumulator, feature_group_names)
+        value_img: ndarray, h5py.Dataset, or anything else that supports slicing along the first axis.
+        dense_edge_tables: (Optional) A subset of the rows of self.dense_edge_tables (still in scan-order)
+        slice_range: (Optional) (start, stop) Process only these slices of the value_img.
+        """
+        if dense_edge_tables is None:
+            dense_edge_tables = self.dense_edge_tables
+        if slice_range is None:
+            slice_range = (0, self._label_img.shape[0])
+
+        value_range = None
+        if any(acc.requires_value_range() for acc, _names in accumulators):
+            logger.debug("Computing global value range...")
+            with self._profile.stage('value_range'):
+                value_range = self._blockwise_value_range(value_img, blocksize, *slice_range)
+
+        # The dense edge tables are in scan-order (sorted by the first coordinate),
+        # so the rows for each block are contiguous.
+        first_axiskey = self._label_img.axistags.keys()[0]
+        first_coords = OrderedDict( (axiskey, dense_edge_table[first_axiskey].values)
+                                    for axiskey, dense_edge_table in dense_edge_tables.items() )
+        need_edge_values = any(acc.ACCUMULATOR_TYPE == 'edge' for acc, _names in accumulators)
+
+        for block_start, block_stop, value_block in self._iter_value_blocks(value_img, blocksize, *slice_range):
+            if need_edge_values:
+                block_edge_tables = OrderedDict()
+                for axiskey, dense_edge_table in dense_edge_tables.items():
+                    row_start, row_stop = np.searchsorted(first_coords[axiskey], [block_start, block_stop])
+                    block_edge_tables[axiskey] = dense_edge_table.iloc[row_start:row_stop]
+                block_edge_values = self._extract_edge_values(block_edge_tables, value_block, block_start)
+
+            for acc, _names in accumulators:
+                with self._accumulator_stage(acc):
+                    if acc.ACCUMULATOR_TYPE == 'edge':
+                        acc.ingest_edges_for_block(self, block_edge_tables, block_edge_values, value_range)
+                    else:
+                        acc.ingest_values_for_block(self, block_start, block_stop, value_block, value_range)
+
+    def _ingest_values_for_edges(self, accumulators, value_img, blocksize, edge_labels, edge_ids, dense_edge_tables=None):
+        """
+        Ingest only what is needed to compute features for the given subset of edges:
+        The edge accumulators receive only the pixels of those edges (via the edge face index),
+        and the sp/flatedge accumulators receive only the slices (along the first axis)
+        that contain the superpixels adjacent to those edges.
+
+        edge_labels: 1D array of edge_label values (rows of the unique_edge_table of the edge group)
+        edge_ids: The (sp1, sp2) pairs of those edges
+        dense_edge_tables: (Optional) The pixel faces to use for the edge accumulators.
+                           By default, all pixel faces of the given edges.
+        """
+        first_axiskey = self._label_img.axistags.keys()[0]
+        slice_start, slice_stop = self._label_img.shape[0], 0
+
+        if any(acc.ACCUMULATOR_TYPE == 'edge' for acc, _names in accumulators):
+            if dense_edge_tables is None:
+                dense_edge_tables = self._dense_edge_tables_for_edges(edge_labels)
+            for dense_edge_table in dense_edge_tables.values():
+                if len(dense_edge_table):
+                    first_coords = dense_edge_table[first_axiskey].values
+                    slice_start = min(slice_start, first_coords[0])
+                    slice_stop = max(slice_stop, first_coords[-1]+1)
+
+        if any(acc.ACCUMULATOR_TYPE != 'edge' for acc, _names in accumulators):
+            first_slices, last_slices = self._get_sp_slice_ranges()
+            sp_ids = np.unique(edge_ids)
+            slice_start = min(slice_start, first_slices[sp_ids].min())
+            slice_stop = max(slice_stop, last_slices[sp_ids].max()+1)
+
         if value_img is None:
-            edge_values = None
-        else:
-            edge_values = OrderedDict()
+            # Nothing to read.  (The sp/flatedge accumulators see the whole label image.)
+            for acc, _names in accumulators:
+                with self._accumulator_stage(acc):
+                    if acc.ACCUMULATOR_TYPE == 'edge':
+                        acc.ingest_edges_for_block(self, dense_edge_tables, None, None)
+                    else:
+                        acc.ingest_values(self, None)
+            return
+
+        logger.debug("Computing features for {} edges in slices {}-{}...".format( len(edge_labels), slice_start, slice_stop ))
+        if not blocksize:
+            blocksize = slice_stop - slice_start
+        self._ingest_values_blockwise(accumulators, value_img, blocksize, dense_edge_tables, (slice_start, slice_stop))
+
+    def _dense_edge_tables_for_edges(self, edge_labels):
+        """
+        Return the rows of the dense_edge_tables that belong to the given edges,
+        still in scan-order (sorted by the first coordinate).
+        """
+        edge_labels = np.unique(edge_labels)
+        edge_tables = OrderedDict()
+        for axiskey, face_index in self._get_edge_face_index().items():
+            rows = Rag._gather_bucket_rows(face_index, edge_labels)
+            edge_tables[axiskey] = self.dense_edge_tables[axiskey].iloc[rows]
+        return edge_tables
+
+    def _dense_edge_tables_in_roi(self, start, stop):
+        """
+        Return the rows of the dense_edge_tables whose pixel faces lie entirely within the given roi,
+        (i.e. the faces that would be present if the label image were cropped to the roi),
+        still in scan-order (sorted by the first coordinate).
+        """
+        cell_size = Rag.FACE_INDEX_CELL_SIZE
+        coord_cols = self._label_img.axistags.keys()
+        grid_shape, face_grid_index = self._get_face_grid_index()
+
+        # All grid cells that overlap the roi
+        cell_ranges = [ np.arange(a // cell_size, (b-1) // cell_size + 1) for (a, b) in zip(start, stop) ]
+        cell_coords = np.meshgrid(*cell_ranges, indexing='ij')
+        cell_ids = np.ravel_multi_index([c.reshape(-1) for c in cell_coords], grid_shape)
+
+        edge_tables = OrderedDict()
+        for axiskey, cell_index in face_grid_index.items():
+            rows = Rag._gather_bucket_rows(cell_index, cell_ids)
+            cell_table = self.dense_edge_tables[axiskey].iloc[rows]
+
+            # Discard the faces in those cells that aren't inside the roi.
+            # (A face along an axis also needs the pixel after it.)
+            inside = np.ones( (len(cell_table),), dtype=bool )
+            for coord_key, a, b in zip(coord_cols, start, stop):
+                if coord_key == axiskey:
+                    b -= 1
+                coords = cell_table[coord_key].values
+                inside &= (coords >= a)
+                inside &= (coords < b)
+            edge_tables[axiskey] = cell_table[inside]
+        return edge_tables
+
+    def _get_edge_face_index(self):
+        """
+        Return the edge-sorted face index, which lists the rows of each
+        dense_edge_table (i.e. the pixel faces) that belong to each edge.
+        (Computed on first use.)
+
+        Returns: OrderedDict of { axiskey : (face_order, face_starts) } (see _build_bucket_index())
+        """
+        if self._edge_face_index is None:
+            dense_axes = ''.join(self.dense_edge_tables.keys())
+            num_edges = len(self.unique_edge_tables[dense_axes])
+
+            self._edge_face_index = OrderedDict()
             for axiskey, dense_edge_table in self.dense_edge_tables.items():
-                axis_index = self._label_img.axistags.keys().index(axiskey)
-                logger.debug("Axis {}: Extracting values...".format( axiskey ))
-                coord_cols = self._label_img.axistags.keys()
-                mask_coords = tuple(series.values for _colname, series in dense_edge_table[coord_cols].iteritems())
-                edge_values[axiskey] = extract_edge_values_for_axis(axis_index, mask_coords, value_img)
-
-        # Create an accumulator for each group
-        for acc_id, feature_group_names in edge_feature_groups.items():
-            edge_accumulator = self._select_accumulator_for_group(acc_id, 'edge', feature_group_names, accumulator_set)
-            unsupported_names = set(feature_group_names) - set(edge_accumulator.supported_features(self))
-            assert not unsupported_names, \
-                "Some of your requested features aren't supported by this accumulator: {}".format(unsupported_names)
-            
-            with edge_accumulator:
-                edge_accumulator.ingest_edges( self, edge_values )
-                edge_df = edge_accumulator.append_edge_features_to_df(edge_df)
+                logger.debug("Axis {}: Indexing edge faces...".format( axiskey ))
+                edge_labels = dense_edge_table['edge_label'].values
+                self._edge_face_index[axiskey] = Rag._build_bucket_index(edge_labels, num_edges)
+        return self._edge_face_index
 
-            # If the accumulator provided more features than the
-            # user is asking for right now, remove the extra columns
-            for colname in edge_df.columns.values[2:]:
-                if '_edge_' in colname and not any(colname.startswith(name) for name in feature_group_names):
-                    del edge_df[colname]
+    #: The spatial index for ``compute_features(..., roi=...)`` groups the pixel faces
+    #: into cubic cells with this many pixels per side.
+    FACE_INDEX_CELL_SIZE = 32
 
-        return edge_df
+    def _get_face_grid_index(self):
+        """
+        Return the spatial index of the pixel faces, which lists the rows of each
+        dense_edge_table that lie in each cell of a regular grid.
+        (Computed on first use.)
 
-    def _append_sp_features_for_values(self, edge_df, sp_feature_groups, value_img, accumulator_set="default"):
+        Returns: (grid_shape, OrderedDict of { axiskey : (face_order, face_starts) })
         """
-        Compute superpixel-based features and append them as columns to the given DataFrame.
-        
-        edge_df: DataFrame with columns (sp1, sp2) at least.
-        sp_feature_groups: Dict of { accumulator_id : [feature_name, feature_name...] }
-        value_img: ndarray of pixel values, or None
-        accumulator_set: A list of additional accumulators to consider, or "default" to just use built-in.
+        if self._face_grid_index is None:
+            cell_size = Rag.FACE_INDEX_CELL_SIZE
+            coord_cols = self._label_img.axistags.keys()
+            grid_shape = tuple( (np.array(self._label_img.shape) + cell_size - 1) // cell_size )
+
+            face_grid_index = OrderedDict()
+            for axiskey, dense_edge_table in self.dense_edge_tables.items():
+                logger.debug("Axis {}: Indexing face locations...".format( axiskey ))
+                cell_coords = [ dense_edge_table[coord_key].values // cell_size for coord_key in coord_cols ]
+                cell_ids = np.ravel_multi_index(cell_coords, grid_shape)
+                face_grid_index[axiskey] = Rag._build_bucket_index(cell_ids, int(np.prod(grid_shape)))
+            self._face_grid_index = (grid_shape, face_grid_index)
+        return self._face_grid_index
+
+    @classmethod
+    def _build_bucket_index(cls, bucket_ids, num_buckets):
         """
-        if isinstance(self._label_img, Rag._EmptyLabels):
-            raise NotImplementedError("Can't compute superpixel-based features.\n"
-                                      "You deserialized the Rag without deserializing the labels.")
-
-        # Create an accumulator for each group
-        for acc_id, feature_group_names in sp_feature_groups.items():
-            sp_accumulator = self._select_accumulator_for_group(acc_id, 'sp', feature_group_names, accumulator_set)
-            unsupported_names = set(feature_group_names) - set(sp_accumulator.supported_features(self))
-            assert not unsupported_names, \
-                "Some of your requested features aren't supported by this accumulator: {}".format(unsupported_names)
-
-            with sp_accumulator:
-                sp_accumulator.ingest_values(self, value_img)
-                edge_df = sp_accumulator.append_edge_features_to_df(edge_df)
-
-                # If the accumulator provided more features than the
-                # user is asking for right now, remove the extra columns
-                for colname in edge_df.columns.values[2:]:
-                    if '_sp_' in colname and not any(colname.startswith(name) for name in feature_group_names):
-                        del edge_df[colname]
-        return edge_df
+        Index the given rows by their bucket_ids (e.g. edge labels or grid cells).
+        Returns (row_order, bucket_starts), where the rows in bucket ``b`` are
+        ``row_order[bucket_starts[b]:bucket_starts[b+1]]`` (in their original order).
+        """
+        row_order = np.argsort(bucket_ids, kind='mergesort').astype(np.uint32)
+        bucket_starts = np.zeros( (num_buckets+1,), dtype=np.intp )
+        np.cumsum(np.bincount(bucket_ids, minlength=num_buckets), out=bucket_starts[1:])
+        return row_order, bucket_starts
 
-    def _append_flatedge_features_for_values(self, edge_df, flatedge_feature_groups, value_img, accumulator_set="default"):
+    @classmethod
+    def _gather_bucket_rows(cls, bucket_index, bucket_ids):
         """
-        Compute superpixel-based features and append them as columns to the given DataFrame.
-        
-        edge_df: DataFrame with columns (sp1, sp2) at least.
-        flatedge_feature_groups: Dict of { accumulator_id : [feature_name, feature_name...] }
-        value_img: ndarray of pixel values, or None
-        accumulator_set: A list of additional accumulators to consider, or "default" to just use built-in.
+        Return the (sorted) rows in the given (unique) buckets of the given bucket_index.
         """
-        if isinstance(self._label_img, Rag._EmptyLabels):
-            raise NotImplementedError("Can't compute flatedge features.\n"
-                                      "You deserialized the Rag without deserializing the labels.")
-
-        # Create an accumulator for each group
-        for acc_id, feature_group_names in flatedge_feature_groups.items():
-            flatedge_accumulator = self._select_accumulator_for_group(acc_id, 'flatedge', feature_group_names, accumulator_set)
-            unsupported_names = set(feature_group_names) - set(flatedge_accumulator.supported_features(self))
-            assert not unsupported_names, \
-                "Some of your requested features aren't supported by this accumulator: {}".format(unsupported_names)
-
-            with flatedge_accumulator:
-                flatedge_accumulator.ingest_values(self, value_img)
-                edge_df = flatedge_accumulator.append_edge_features_to_df(edge_df)
-
-                # If the accumulator provided more features than the
-                # user is asking for right now, remove the extra columns
-                for colname in edge_df.columns.values[2:]:
-                    if '_flatedge_' in colname and not any(colname.startswith(name) for name in feature_group_names):
-                        del edge_df[colname]
-        return edge_df
+        row_order, bucket_starts = bucket_index
+
+        # Concatenate the (contiguous) ranges of row_order for the given buckets
+        starts = bucket_starts[bucket_ids]
+        lengths = bucket_starts[bucket_ids+1] - starts
+        range_offsets = np.cumsum(lengths) - lengths
+        positions = np.repeat(starts - range_offsets, lengths) + np.arange(lengths.sum())
+        return np.sort(row_order[positions])
 
-    def edge_decisions_from_groundtruth(self, groundtruth_vol, asdict=False):
+    def _get_sp_slice_ranges(self):
+        """
+        Return the first and last slice (along the first axis) of each superpixel,
+        as two arrays indexed by superpixel id.
+        (Computed on first use, which requires a pass over every slice of the label_img.)
+        """
+        if self._sp_slice_ranges is None:
+            logger.debug("Indexing superpixel slice ranges...")
+            num_slices = self._label_img.shape[0]
+            first_slices = np.zeros( (self._max_sp+1,), dtype=np.intp )
+            first_slices[:] = num_slices
+            last_slices = np.zeros( (self._max_sp+1,), dtype=np.intp )
+            for z in range(num_slices):
+                slice_sp_ids = pd.unique(np.asarray(self._label_img[z]).reshape(-1))
+                first_slices[slice_sp_ids] = np.minimum(first_slices[slice_sp_ids], z)
+                last_slices[slice_sp_ids] = z
+            self._sp_slice_ranges = (first_slices, last_slices)
+        return self._sp_slice_ranges
+
+    def _extract_edge_values(self, dense_edge_tables, value_img, block_start=0):
+        """
+        Extract the values at the edge pixels listed in the given dense_edge_tables.
+        If value_img is just one block of the full volume, block_start indicates
+        the offset of the block along the first axis.
+
+        Returns: OrderedDict of 1D float32 arrays, in the same order as dense_edge_tables[k]
+        """
+        coord_cols = self._label_img.axistags.keys()
+        edge_values = OrderedDict()
+        with self._profile.stage('extract_edge_values'):
+            for axiskey, dense_edge_table in dense_edge_tables.items():
+                axis_index = coord_cols.index(axiskey)
+                logger.debug("Axis {}: Extracting values...".format( axiskey ))
+                mask_coords = [series.values for _colname, series in dense_edge_table[coord_cols].iteritems()]
+                if block_start:
+                    mask_coords[0] = mask_coords[0] - block_start
+                edge_values[axiskey] = extract_edge_values_for_axis(axis_index, tuple(mask_coords), value_img)
+        return edge_values
+
+    #: If ``compute_features()`` must process a value image blockwise, but no ``blocksize`` was given,
+    #: a block size (in slices) is chosen to hold roughly this many voxels.
+    DEFAULT_BLOCK_VOXELS = 2**26
+
+    def _default_blocksize(self):
+        slice_voxels = int(np.prod(self._label_img.shape[1:]))
+        return max(1, Rag.DEFAULT_BLOCK_VOXELS // slice_voxels)
+
+    def _iter_value_blocks(self, value_img, blocksize, start=0, stop=None):
+        """
+        Generator.  Read the given value_img in blocks of ``blocksize`` slices along the first axis
+        (from slice ``start`` to ``stop``, or the whole image by default).
+        
+        Yields: (block_start, block_stop, value_block), where value_block is a VigraArray
+                with the values of slices [block_start, block_stop+1).
+                That is, each block includes one extra slice of 'halo' (except for the last block),
+                since edges along the first axis need the values on both sides.
+        """
+        axes = ''.join(self._label_img.axistags.keys())
+        if hasattr(value_img, 'axistags'):
+            value_img = value_img.withAxes(axes)
+
+        if stop is None:
+            stop = self._label_img.shape[0]
+        for block_start in range(start, stop, blocksize):
+            block_stop = min(block_start + blocksize, stop)
+            value_block = np.asarray(value_img[block_start:block_stop+1])
+            yield block_start, block_stop, vigra.taggedView(value_block, axes)
+
+    def _blockwise_value_range(self, value_img, blocksize, start=0, stop=None):
+        """
+        Return the (min, max) of the given value_img (as float32),
+        reading only one block at a time.
+        If start/stop are given, only those slices (and the halo slice after them) are considered.
+        """
+        num_slices = self._label_img.shape[0]
+        if stop is None:
+            stop = num_slices
+        stop = min(stop+1, num_slices)
+
+        value_min, value_max = np.inf, -np.inf
+        for block_start in range(start, stop, blocksize):
+            value_block = np.asarray(value_img[block_start:min(block_start+blocksize, stop)])
+            value_min = min(value_min, value_block.min())
+            value_max = max(value_max, value_block.max())
+        return (np.float32(value_min), np.float32(value_max))
+
+    def edge_decisions_from_groundtruth(self, groundtruth_vol, asdict=False, blocksize=None):
         """
         Given a reference segmentation, return a boolean array of "decisions"
         indicating whether each edge in this RAG should be ON or OFF for best
@@ -702,9 +1584,17 @@ class Rag(object):
         An OFF edge means that the two superpixels are merged in the reference volume.
         
         If ``asdict=True``, return the result as a dict of ``{(sp1, sp2) : bool}``
+
+        The superpixels are matched to the groundtruth via a sparse contingency table
+        (see :py:func:`~ilastikrag.util.sparse_contingency_table`), so the groundtruth IDs may be large.
+        If ``blocksize`` is given (or ``groundtruth_vol`` isn't an in-memory array, e.g. an ``h5py.Dataset``),
+        the groundtruth is read in blocks of that many slices.
         """
-        assert (groundtruth_vol.shape == self._label_img.shape)
-        sp_to_gt_mapping = label_vol_mapping(self._label_img, groundtruth_vol)
+        assert (tuple(groundtruth_vol.shape) == tuple(self._label_img.shape))
+        if blocksize is None and ( not isinstance(groundtruth_vol, np.ndarray)
+                                   or isinstance(groundtruth_vol, np.memmap) ):
+            blocksize = self._default_blocksize()
+        sp_to_gt_mapping = label_vol_mapping(self._label_img, groundtruth_vol, blocksize)
 
         unique_sp_edges = self.edge_ids
         decisions = sp_to_gt_mapping[unique_sp_edges[:, 0]] != sp_to_gt_mapping[unique_sp_edges[:, 1]]
@@ -718,8 +1608,6 @@ class Rag(object):
         Given a list of ON/OFF labels for the Rag edges, compute a new label volume in which
         all supervoxels with at least one inactive edge between them are merged together.
         
-        Requires ``networkx``.
-        
         Parameters
         ----------
         edge_decisions
@@ -734,8 +1622,9 @@ class Rag(object):
         Returns
         -------
         *VigraArray*
+            The segments are numbered consecutively (starting at 1),
+            in the order of their smallest superpixel ID.
         """
-        import networkx as nx
         assert out is None or hasattr(out, 'axistags'), \
             "Must provide accurate axistags, otherwise performance suffers by 10x"
         assert edge_decisions.shape == (self._edge_ids.shape[0],)
@@ -743,25 +1632,27 @@ class Rag(object):
         inactive_edge_ids = self.edge_ids[np.nonzero( np.logical_not(edge_decisions) )]
     
         logger.debug("Finding connected components in node graph...")
-        g = nx.Graph( list(inactive_edge_ids) ) 
-        
-        # If any supervoxels are completely independent (not merged with any neighbors),
-        # they haven't been added to the graph yet.
-        # Add them now.
-        g.add_nodes_from(self.sp_ids)
-        
-        sp_mapping = {}
-        for i, sp_ids in enumerate(nx.connected_components(g), start=1):
-            for sp_id in sp_ids:
-                sp_mapping[int(sp_id)] = i
-        del g
-    
-        return vigra.analysis.applyMapping( self._label_img, sp_mapping, out=out )
+        components = connected_components(inactive_edge_ids, self.max_sp+1)
+
+        # Number the components consecutively (ignoring sp ids that aren't present)
+        sp_mapping = np.zeros( (self.max_sp+1,), dtype=np.uint32 )
+        _, sp_mapping[self.sp_ids] = np.unique(components[self.sp_ids], return_inverse=True)
+        sp_mapping[self.sp_ids] += 1
 
-    def serialize_hdf5(self, h5py_group, store_labels=False, compression='lzf', compression_opts=None):
+        return relabel( self._label_img, sp_mapping, out=out )
+
+    #: The version of the hdf5 layout written by :py:meth:`serialize_hdf5()`.
+    #: (Rags that were serialized without a ``format_version`` attribute can still be deserialized.)
+    SERIALIZATION_FORMAT_VERSION = 2
+
+    def serialize_hdf5(self, h5py_group, store_labels=False, compression='lzf', compression_opts=None,
+                       store_dense_tables=True):
         """
         Serialize the Rag to the given hdf5 group.
 
+        Each column of the edge tables is stored as a separate chunked, compressed dataset,
+        with a typed schema (see :py:func:`~ilastikrag.util.dataframe_to_hdf5`).
+
         Parameters
         ----------
         h5py_group
@@ -775,25 +1666,36 @@ class Rag(object):
             unless you don't plan to use superpixel features.
         
         compression
-            Passed directly to ``h5py.Group.create_dataset``.
+            Passed directly to ``h5py.Group.create_dataset``. |br|
+            If ``None``, the edge table columns are stored contiguously,
+            so they can be memory-mapped by ``deserialize_hdf5(..., mmap=True)``.
         
         compression_opts
             Passed directly to ``h5py.Group.create_dataset``.
+
+        store_dense_tables
+            If False, only the ``unique_edge_tables`` are stored.  The ``dense_edge_tables``                |br|
+            (which have one row per *pixel* edge, and thus make up most of the serialized data)             |br|
+            and the ``flat_edge_label_img`` are re-derived from the labels by ``deserialize_hdf5()``,        |br|
+            so the labels must be stored (``store_labels=True``) or provided at deserialization time.
         """
+        h5py_group.attrs['format_version'] = Rag.SERIALIZATION_FORMAT_VERSION
+
         # Flag: flat_superpixels
         h5py_group.create_dataset('flat_superpixels', data=self.flat_superpixels)
         
         # Dense DFs
-        dense_tables_parent_group = h5py_group.create_group('dense_edge_tables')
-        for axiskey, df in self.dense_edge_tables.items():
-            df_group = dense_tables_parent_group.create_group('{}'.format(axiskey))
-            dataframe_to_hdf5(df_group, df)
+        if store_dense_tables:
+            dense_tables_parent_group = h5py_group.create_group('dense_edge_tables')
+            for axiskey, df in self.dense_edge_tables.items():
+                df_group = dense_tables_parent_group.create_group('{}'.format(axiskey))
+                dataframe_to_hdf5(df_group, df, compression, compression_opts)
 
         # Unique DFs
         unique_tables_parent_group = h5py_group.create_group('unique_edge_tables')
         for axiskey, df in self.unique_edge_tables.items():
             df_group = unique_tables_parent_group.create_group('{}'.format(axiskey))
-            dataframe_to_hdf5(df_group, df)
+            dataframe_to_hdf5(df_group, df, compression, compression_opts)
 
         # label_img metadata
         labels_dset = h5py_group.create_dataset('label_img',
@@ -811,7 +1713,7 @@ class Rag(object):
             labels_dset.attrs['valid_data'] = True
 
         # Z edge-label image
-        if self._flat_superpixels:
+        if self._flat_superpixels and store_dense_tables:
             flat_edge_labels_dset = h5py_group.create_dataset('flat_edge_labels',
                                                               shape=self._flat_edge_label_img.shape,
                                                               dtype=self._flat_edge_label_img.dtype,
@@ -822,7 +1724,7 @@ class Rag(object):
 
 
     @classmethod
-    def deserialize_hdf5(cls, h5py_group, label_img=None):
+    def deserialize_hdf5(cls, h5py_group, label_img=None, lazy=False, mmap=False):
         """
         Deserialize the Rag from the given ``h5py.Group``,
         which was written via ``Rag.serialize_to_hdf5()``.
@@ -832,23 +1734,50 @@ class Rag(object):
         label_img
             If not ``None``, don't load labels from hdf5, use this volume instead.
             Useful for when ``serialize_hdf5()`` was called with ``store_labels=False``. 
+
+        lazy
+            If ``True``, load only the unique edge tables now, and load each of the
+            :py:attr:`dense_edge_tables` when it is first accessed (e.g. by ``compute_features()``). |br|
+            In that case, the hdf5 file must remain open for as long as the Rag is used. |br|
+            If the dense tables weren't stored (``serialize_hdf5(..., store_dense_tables=False)``),
+            they are re-derived from the labels: when first accessed if ``lazy``, otherwise right away (in parallel).
+
+        mmap
+            If ``True``, memory-map the edge table columns instead of reading them,
+            if they were serialized with ``compression=None``. |br|
+            The memory maps refer to the file by name, so (unlike for ``lazy``) the hdf5 file may be closed,
+            but it must not be modified or deleted while the Rag is in use.
         """
+        format_version = h5py_group.attrs.get('format_version', 1)
+        assert format_version <= Rag.SERIALIZATION_FORMAT_VERSION, \
+            "Rag was serialized by a newer version of ilastikrag (format version {})".format( format_version )
+
         rag = Rag('__will_deserialize__')
 
         # Flag: flat_superpixels
         rag._flat_superpixels = h5py_group['flat_superpixels'][()]
         
         # Dense Edge DFs
-        rag._dense_edge_tables = OrderedDict()
-        dense_tables_parent_group = h5py_group['dense_edge_tables']
-        for axiskey, df_group in sorted(dense_tables_parent_group.items())[::-1]: # tables should be restored to zyx order.
-            rag._dense_edge_tables[axiskey] = dataframe_from_hdf5(df_group)
+        # (If they weren't stored, they are derived from the labels, below.)
+        has_dense_tables = ('dense_edge_tables' in h5py_group)
+        if has_dense_tables:
+            dense_tables_parent_group = h5py_group['dense_edge_tables']
+            dense_table_loaders = OrderedDict()
+            for axiskey, df_group in sorted(dense_tables_parent_group.items())[::-1]: # tables should be restored to zyx order.
+                dense_table_loaders[axiskey] = lambda df_group=df_group: dataframe_from_hdf5(df_group, mmap=mmap)
+    
+            if lazy:
+                rag._dense_edge_tables = LazyDict(dense_table_loaders)
+            else:
+                rag._dense_edge_tables = OrderedDict()
+                for axiskey, load_table in dense_table_loaders.items():
+                    rag._dense_edge_tables[axiskey] = load_table()
 
-        # Dense Edge DFs
+        # Unique Edge DFs
         rag._unique_edge_tables = {}
         unique_tables_parent_group = h5py_group['unique_edge_tables']
         for axiskey, df_group in sorted(unique_tables_parent_group.items()):
-            rag._unique_edge_tables[axiskey] = dataframe_from_hdf5(df_group)
+            rag._unique_edge_tables[axiskey] = dataframe_from_hdf5(df_group, mmap=mmap)
         
         # label_img
         label_dset = h5py_group['label_img']
@@ -863,20 +1792,13 @@ class Rag(object):
             label_img = label_img.withAxes(axes)
             rag._label_img = label_img
         elif label_img is not None:
-            assert hasattr(label_img, 'axistags'), \
-                "For optimal performance, make sure label_img is a VigraArray with accurate axistags"
-            assert set(label_img.axistags.keys()).issubset('zyx'), \
-                "Only axes z,y,x are permitted, not {}".format( label_img.axistags.keys() )
-
-            # Transpose to proper order
-            axes = 'zyx'[-label_img.ndim:]
-            label_img = label_img.withAxes(axes)
-
-            rag._label_img = label_img
+            rag._label_img = Rag._external_labels(label_img)
         else:
             rag._label_img = Rag._EmptyLabels(label_dset.shape, label_dset.dtype, axistags)
 
-        if rag._flat_superpixels:
+        if not has_dense_tables:
+            rag._init_derived_edge_tables(lazy)
+        elif rag._flat_superpixels:
             flat_edge_labels_dset = h5py_group['flat_edge_labels']
             flat_edge_labels = flat_edge_labels_dset[:]
             axistags = vigra.AxisTags.fromJSON(flat_edge_labels_dset.attrs['axistags'])
@@ -888,6 +1810,159 @@ class Rag(object):
 
         return rag
 
+    #: The version of the directory layout written by :py:meth:`save()`.
+    SAVE_FORMAT_VERSION = 1
+
+    def save(self, path, store_labels=False, store_dense_tables=True):
+        """
+        Save the Rag to the given directory (which is created if necessary),
+        as raw ``.npy`` files plus a small JSON manifest (``manifest.json``). |br|
+        Unlike :py:meth:`serialize_hdf5()`, nothing is compressed, so the Rag can be opened
+        (and memory-mapped) almost instantly via :py:meth:`load()`.
+
+        Parameters
+        ----------
+        path
+            *str* -- A directory. Should not hold any other data.
+
+        store_labels
+            If True, the labels are saved, too.
+            Otherwise, provide them to :py:meth:`load()` if you need superpixel features.
+
+        store_dense_tables
+            If False, the ``dense_edge_tables`` and ``flat_edge_label_img`` are not saved,
+            and :py:meth:`load()` re-derives them from the labels (when they are first accessed),
+            as for :py:meth:`serialize_hdf5()`.
+        """
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        manifest = OrderedDict()
+        manifest['format_version'] = Rag.SAVE_FORMAT_VERSION
+        manifest['flat_superpixels'] = bool(self._flat_superpixels)
+        manifest['max_sp'] = int(self._max_sp)
+        manifest['label_img'] = { 'shape': list(self._label_img.shape),
+                                  'dtype': np.dtype(self._label_img.dtype).str,
+                                  'axistags': self._label_img.axistags.toJSON(),
+                                  'file': None }
+        if store_labels:
+            manifest['label_img']['file'] = 'label_img.npy'
+            np.save(os.path.join(path, 'label_img.npy'), np.asarray(self._label_img))
+
+        np.save(os.path.join(path, 'edge_ids.npy'), self._edge_ids)
+        np.save(os.path.join(path, 'sp_ids.npy'), self._sp_ids)
+
+        manifest['dense_edge_tables'] = None
+        saved_tables = [('unique_edge_tables', self._unique_edge_tables)]
+        if store_dense_tables:
+            saved_tables.append( ('dense_edge_tables', self.dense_edge_tables) )
+
+        for tables_name, tables in saved_tables:
+            manifest[tables_name] = OrderedDict()
+            for axiskey, df in tables.items():
+                table_dir = os.path.join(tables_name, axiskey)
+                manifest[tables_name][axiskey] = dataframe_to_npy(os.path.join(path, table_dir), df)
+                manifest[tables_name][axiskey]['dir'] = table_dir
+
+        if self._flat_superpixels and store_dense_tables:
+            manifest['flat_edge_label_img'] = { 'file': 'flat_edge_label_img.npy',
+                                                'axistags': self._flat_edge_label_img.axistags.toJSON() }
+            np.save(os.path.join(path, 'flat_edge_label_img.npy'), np.asarray(self._flat_edge_label_img))
+
+        # Write the manifest last, so an interrupted save() can't be loaded.
+        with open(os.path.join(path, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+    @classmethod
+    def load(cls, path, mmap=True, label_img=None):
+        """
+        Load a Rag that was saved via :py:meth:`save()`.
+
+        Parameters
+        ----------
+        path
+            *str* -- The directory the Rag was saved to.
+
+        mmap
+            If True, ``edge_ids``, ``sp_ids``, ``flat_edge_label_img``, the (saved) labels, and every column of
+            the ``unique_edge_tables`` and ``dense_edge_tables`` are read-only memory maps of the saved files,
+            so loading takes (almost) no time, and processes that load the same Rag share the same page cache. |br|
+            (The dense edge tables are only opened when they are first accessed.)
+
+        label_img
+            If not ``None``, use this volume as the labels (if they weren't saved).
+        """
+        with open(os.path.join(path, 'manifest.json'), 'r') as f:
+            manifest = json.load(f)
+        assert manifest['format_version'] <= Rag.SAVE_FORMAT_VERSION, \
+            "Rag was saved by a newer version of ilastikrag (format version {})".format( manifest['format_version'] )
+
+        mmap_mode = 'r' if mmap else None
+        def load_array(filename):
+            return np.load(os.path.join(path, filename), mmap_mode=mmap_mode)
+
+        rag = Rag('__will_deserialize__')
+        rag._flat_superpixels = manifest['flat_superpixels']
+
+        # Note: The tables are restored to zyx order.
+        rag._unique_edge_tables = {}
+        for axiskey, table_manifest in manifest['unique_edge_tables'].items():
+            rag._unique_edge_tables[str(axiskey)] = \
+                dataframe_from_npy(os.path.join(path, table_manifest['dir']), table_manifest, mmap)
+
+        # (If the dense tables weren't saved, they are derived from the labels, below.)
+        has_dense_tables = (manifest['dense_edge_tables'] is not None)
+        if has_dense_tables:
+            dense_table_loaders = OrderedDict()
+            for axiskey, table_manifest in sorted(manifest['dense_edge_tables'].items())[::-1]:
+                dense_table_loaders[str(axiskey)] = \
+                    lambda table_manifest=table_manifest: \
+                        dataframe_from_npy(os.path.join(path, table_manifest['dir']), table_manifest, mmap)
+            rag._dense_edge_tables = LazyDict(dense_table_loaders)
+
+        # label_img
+        label_manifest = manifest['label_img']
+        axistags = vigra.AxisTags.fromJSON(label_manifest['axistags'])
+        if label_manifest['file']:
+            assert label_img is None, \
+                "The labels were already saved. Why are you also providing them externally?"
+            rag._label_img = vigra.taggedView( load_array(label_manifest['file']), axistags )
+        elif label_img is not None:
+            rag._label_img = Rag._external_labels(label_img)
+        else:
+            rag._label_img = Rag._EmptyLabels( tuple(label_manifest['shape']),
+                                               np.dtype(str(label_manifest['dtype'])),
+                                               axistags )
+
+        if not has_dense_tables:
+            rag._init_derived_edge_tables(lazy=True)
+        elif rag._flat_superpixels:
+            flat_manifest = manifest['flat_edge_label_img']
+            rag._flat_edge_label_img = vigra.taggedView( load_array(flat_manifest['file']),
+                                                         vigra.AxisTags.fromJSON(flat_manifest['axistags']) )
+
+        # Other attributes (stored, to avoid scanning the tables)
+        rag._edge_ids = load_array('edge_ids.npy')
+        rag._sp_ids = load_array('sp_ids.npy')
+        rag._num_sp = len(rag._sp_ids)
+        rag._max_sp = rag._sp_ids.dtype.type(manifest['max_sp'])
+
+        return rag
+
+    @classmethod
+    def _external_labels(cls, label_img):
+        """
+        Validate the labels that the user provided to a deserialized Rag, and transpose them to zyx order.
+        """
+        assert hasattr(label_img, 'axistags'), \
+            "For optimal performance, make sure label_img is a VigraArray with accurate axistags"
+        assert set(label_img.axistags.keys()).issubset('zyx'), \
+            "Only axes z,y,x are permitted, not {}".format( label_img.axistags.keys() )
+
+        # Transpose to proper order
+        axes = 'zyx'[-label_img.ndim:]
+        return label_img.withAxes(axes)
+
     class _EmptyLabels(object):
         """
         A little stand-in object for a missing labels array, in case the user
@@ -920,36 +1995,31 @@ class Rag(object):
             except AttributeError:
                 self._raise_NotImplemented()
 
-    def _select_accumulator_for_group(self, acc_id, acc_type, feature_group_names, accumulator_set="default"):
+    def _select_accumulator_for_group(self, acc_id, acc_type, feature_group_names, accumulators_by_key,
+                                      quantile_method="histogram"):
         """
-        Select an accumulator from the given accumulator_set for the given id/type and feature names.
+        Select the user's accumulator for the given id/type (from the dict returned by _check_accumulator_conflicts()),
+        or else create a default accumulator for the given feature names.
         """
-        if accumulator_set == "default":
-            accumulator_set = []
-
-        for acc in accumulator_set:
-            assert acc.ACCUMULATOR_TYPE in ('edge', 'sp', 'flatedge'), \
-                "{} has unknown accumulator-type: {}".format( acc, acc.ACCUMULATOR_TYPE )
-            assert acc.ACCUMULATOR_ID, \
-                "{} has empty accumulator-id: {}".format( acc, acc.ACCUMULATOR_ID )
-            assert '_' not in acc.ACCUMULATOR_ID, \
-                "{} has a bad char in its accumulator-id: {}".format( acc, acc.ACCUMULATOR_ID )
-
-            if acc.ACCUMULATOR_ID == acc_id and acc.ACCUMULATOR_TYPE == acc_type:
-                return acc
+        acc = accumulators_by_key.get((acc_id, acc_type))
+        if acc is not None:
+            return acc
 
         # Try default
-        return self._create_default_accumulator(acc_id, acc_type, feature_group_names)
+        return self._create_default_accumulator(acc_id, acc_type, feature_group_names, quantile_method)
 
-    def _create_default_accumulator(self, acc_id, acc_type, feature_group_names):
+    def _create_default_accumulator(self, acc_id, acc_type, feature_group_names, quantile_method="histogram"):
         """
         Select the default accumulator class with the given id/type, and construct
         a new instance with the given feature names.
         """
-        try:
-            acc_class = Rag.DEFAULT_ACCUMULATOR_CLASSES[(acc_id, acc_type)]
-        except KeyError:
+        if (acc_id, acc_type) not in Rag.DEFAULT_ACCUMULATOR_CLASSES:
             raise RuntimeError("No known accumulator class for features: {}".format( feature_group_names ))
+        acc_class = Rag.DEFAULT_ACCUMULATOR_CLASSES[(acc_id, acc_type)]
+
+        # The default accumulators that provide quantiles also accept a quantile_method
+        if any('_quantiles' in name for name in feature_group_names):
+            return acc_class(self, feature_group_names, quantile_method=quantile_method)
         return acc_class(self, feature_group_names)
 
     @classmethod
@@ -957,101 +2027,28 @@ class Rag(object):
         """
         Check the given accumulator set for possible conflicts,
         i.e. if two of them have matching types/ids, then we can't choose between them.
+
+        Returns the (validated) accumulators in a dict of { (acc_id, acc_type) : accumulator },
+        so they can be selected without scanning the list again.
         """
+        accumulators_by_key = {}
         if accumulator_set == "default":
-            return
+            return accumulators_by_key
 
-        counts = defaultdict(lambda: 0)
         for acc in accumulator_set:
             assert isinstance(acc, BaseEdgeAccumulator) or isinstance(acc, BaseSpAccumulator), \
                 "All accumulators must inherit from an accumulator base class.\n"\
                 "Wrong type: {}".format( acc )
-            
-            counts[(acc.ACCUMULATOR_ID, acc.ACCUMULATOR_TYPE)] += 1
-            if counts[(acc.ACCUMULATOR_ID, acc.ACCUMULATOR_TYPE)] > 1:
+            assert acc.ACCUMULATOR_TYPE in ('edge', 'sp', 'flatedge'), \
+                "{} has unknown accumulator-type: {}".format( acc, acc.ACCUMULATOR_TYPE )
+            assert acc.ACCUMULATOR_ID, \
+                "{} has empty accumulator-id: {}".format( acc, acc.ACCUMULATOR_ID )
+            assert '_' not in acc.ACCUMULATOR_ID, \
+                "{} has a bad char in its accumulator-id: {}".format( acc, acc.ACCUMULATOR_ID )
+
+            if (acc.ACCUMULATOR_ID, acc.ACCUMULATOR_TYPE) in accumulators_by_key:
                 raise RuntimeError("Conflicting accumulator selections.\n"
                                    "Multiple accumulators found to process features of type: {}_{}"
                                    .format(acc.ACCUMULATOR_ID, acc.ACCUMULATOR_TYPE))
-
-if __name__ == '__main__':
-    import sys
-    logger.addHandler( logging.StreamHandler(sys.stdout) )
-    logger.setLevel(logging.DEBUG)
-
-    from lazyflow.utility import Timer
-    
-    import h5py
-    #watershed_path = '/magnetic/data/flyem/chris-two-stage-ilps/volumes/subvol/256/watershed-256.h5'
-    #grayscale_path = '/magnetic/data/flyem/chris-two-stage-ilps/volumes/subvol/256/grayscale-256.h5'
-
-    watershed_path = '/magnetic/data/flyem/chris-two-stage-ilps/volumes/subvol/512/watershed-512.h5'
-    grayscale_path = '/magnetic/data/flyem/chris-two-stage-ilps/volumes/subvol/512/grayscale-512.h5'
-    
-    logger.info("Loading watershed...")
-    with h5py.File(watershed_path, 'r') as f:
-        watershed = f['watershed'][:]
-    if watershed.shape[-1] == 1:
-        watershed = watershed[...,0]
-    watershed = vigra.taggedView( watershed, 'zyx' )
-
-    logger.info("Loading grayscale...")
-    with h5py.File(grayscale_path, 'r') as f:
-        grayscale = f['grayscale'][:]
-    if grayscale.shape[-1] == 1:
-        grayscale = grayscale[...,0]
-    grayscale = vigra.taggedView( grayscale, 'zyx' )
-    # typical features will be float32, not uint8, so let's not cheat
-    grayscale = grayscale.astype(np.float32, copy=False)
-
-    feature_names = []
-    #feature_names = ['edgeregion_edge_regionradii', ]
-    feature_names = ['standard_edge_mean', ]
-    #feature_names += ['standard_edge_count', 'standard_edge_sum', 'standard_edge_mean', 'standard_edge_variance',
-    #                  'standard_edge_minimum', 'standard_edge_maximum', 'standard_edge_quantiles_25', 'standard_edge_quantiles_50', 'standard_edge_quantiles_75', 'standard_edge_quantiles_100']
-    #feature_names += ['standard_sp_count']
-    #feature_names += ['standard_sp_count', 'standard_sp_sum', 'standard_sp_mean', 'standard_sp_variance', 'standard_sp_kurtosis', 'standard_sp_skewness']
-    #feature_names += ['standard_sp_count', 'standard_sp_variance', 'standard_sp_quantiles_25', ]
-
-    with Timer() as timer:
-        logger.info("Creating python Rag...")
-        rag = Rag( watershed )
-    logger.info("Creating rag ({} superpixels, {} edges) took {} seconds"
-                .format( rag.num_sp, rag.num_edges, timer.seconds() ))
-    print "unique edge labels per axis: {}".format( [len(df['edge_label'].unique()) for df in rag.dense_edge_tables.values()] )
-    print "Total pixel edges: {}".format( sum(len(df) for df in rag.dense_edge_tables ) )
-
-    with Timer() as timer:
-        edge_features_df = rag.compute_features(grayscale, feature_names)
-        #edge_features_df = rag.compute_features(None, ['edgeregion_edge_regionradii'])
-        
-    print "Computing features with python Rag took: {}".format( timer.seconds() )
-    #print edge_features_df[0:10]
-    
-    print ""
-    print ""
-
-#     # For comparison with vigra.graphs.vigra.graphs.regionAdjacencyGraph
-#     import vigra
-#     with Timer() as timer:
-#         gridGraph = vigra.graphs.gridGraph(watershed.shape)
-#         rag = vigra.graphs.regionAdjacencyGraph(gridGraph, watershed)
-#         #ids = rag.uvIds()
-#     print "Creating vigra Rag took: {}".format( timer.seconds() )
-#  
-#     from relabel_consecutive import relabel_consecutive
-#     watershed = relabel_consecutive(watershed, out=watershed)
-#     assert watershed.axistags is not None
-#  
-#     grayscale_f = grayscale.astype(np.float32, copy=False)
-#     with Timer() as timer:
-#         gridGraphEdgeIndicator = vigra.graphs.edgeFeaturesFromImage(gridGraph,grayscale_f)
-#         p0 = rag.accumulateEdgeFeatures(gridGraphEdgeIndicator)/255.0
-#     print "Computing 1 vigra feature took: {}".format( timer.seconds() )
- 
-
-#     # For comparison with scikit-image Rag performance. (It's bad.)
-#     from skimage.future.graph import RAG
-#     with Timer() as timer:
-#         logger.info("Creating skimage Rag...")
-#         rag = RAG( watershed )
-#     logger.info("Creating skimage rag took {} seconds".format( timer.seconds() ))
+            accumulators_by_key[(acc.ACCUMULATOR_ID, acc.ACCUMULATOR_TYPE)] = acc
+        return accumulators_by_key
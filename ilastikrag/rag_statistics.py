@@ -0,0 +1,126 @@
+import numpy as np
+
+from .lazy_import import lazy_import
+pd = lazy_import('pandas')
+
+class RagStatistics(object):
+    """
+    Mergeable statistics of the pixel values on each edge and in each superpixel of a Rag,
+    as returned by :py:meth:`Rag.compute_statistics() <ilastikrag.rag.Rag.compute_statistics>`.
+
+    Features for the standard accumulators can be computed from the statistics (via :py:meth:`edge_features()`),
+    and -- more importantly -- so can the features of the edges and superpixels that result
+    from merging superpixels together (via :py:meth:`merge_edges()`), without touching the pixel data again.
+    This makes it cheap to recompute the features after each round of a hierarchical agglomeration.
+
+    Attributes
+    ----------
+    edge_ids
+        *ndarray, shape=(N,2)* -- The ``(sp1, sp2)`` pair of each edge (with ``sp1 < sp2``), sorted.
+
+    edge_statistics
+        :py:class:`~ilastikrag.accumulators.standard.label_statistics.LabelStatistics`
+        of the edge pixel values, with one label per row of ``edge_ids``.
+
+    sp_statistics
+        :py:class:`~ilastikrag.accumulators.standard.label_statistics.LabelStatistics`
+        of the superpixel pixel values, indexed by sp id.
+
+    ndim
+        The dimensionality of the label image, for normalizing the sp ``count`` and ``sum`` features
+        (as in :py:class:`~ilastikrag.accumulators.standard.standard_sp_accumulator.StandardSpAccumulator`).
+    """
+    def __init__(self, edge_ids, edge_statistics, sp_statistics, ndim):
+        assert len(edge_ids) == edge_statistics.num_labels
+        self.edge_ids = edge_ids
+        self.edge_statistics = edge_statistics
+        self.sp_statistics = sp_statistics
+        self.ndim = ndim
+
+    def merge_edges(self, sp_groups):
+        """
+        Merge superpixels (and therefore their edges) into groups, and return the statistics of the result.
+
+        Edges between two superpixels of the same group disappear,
+        and all edges between the same two groups are merged into a single edge.
+
+        Parameters
+        ----------
+        sp_groups
+            1D *ndarray*, indexed by sp id (i.e. of length ``sp_statistics.num_labels``):
+            The new id of each superpixel. |br|
+            For example, the result of ``rag.naive_segmentation_from_edge_decisions()``
+            can be converted into ``sp_groups`` via ``label_vol_mapping()``.
+
+        Returns
+        -------
+        :py:class:`RagStatistics`
+            Statistics of the merged superpixels (indexed by the new ids) and their edges.
+        """
+        sp_groups = np.asarray(sp_groups)
+        assert sp_groups.shape == (self.sp_statistics.num_labels,), \
+            "sp_groups must have one entry for each sp id (0..max_sp)"
+        assert sp_groups.min() >= 0, "Every superpixel must be assigned to a group"
+        num_groups = int(sp_groups.max()) + 1
+
+        merged_ids = sp_groups[self.edge_ids]
+        merged_ids.sort(axis=1)
+        internal = (merged_ids[:, 0] == merged_ids[:, 1])
+
+        # Find the unique (sp1, sp2) pairs of the remaining edges
+        external_ids = merged_ids[~internal].astype(np.uint64)
+        packed_ids = (external_ids[:, 0] << np.uint64(32)) | external_ids[:, 1]
+        unique_packed_ids, edge_indexes = np.unique(packed_ids, return_inverse=True)
+
+        edge_groups = np.empty( (len(self.edge_ids),), dtype=np.intp )
+        edge_groups[internal] = -1
+        edge_groups[~internal] = edge_indexes
+
+        new_edge_ids = np.empty( (len(unique_packed_ids), 2), dtype=self.edge_ids.dtype )
+        new_edge_ids[:, 0] = unique_packed_ids >> np.uint64(32)
+        new_edge_ids[:, 1] = unique_packed_ids & np.uint64(0xFFFFFFFF)
+
+        edge_statistics = self.edge_statistics.merge_labels(edge_groups, len(new_edge_ids))
+        sp_statistics = self.sp_statistics.merge_labels(sp_groups, num_groups)
+        return RagStatistics(new_edge_ids, edge_statistics, sp_statistics, self.ndim)
+
+    def edge_features(self, feature_names):
+        """
+        Compute features for each edge from the statistics, in the same format as
+        :py:meth:`Rag.compute_features() <ilastikrag.rag.Rag.compute_features>`.
+
+        Parameters
+        ----------
+        feature_names
+            A list of ``standard_edge_<stat>`` and ``standard_sp_<stat>`` feature names,
+            where ``<stat>`` is one of ``count``, ``sum``, ``minimum``, ``maximum``, ``mean``,
+            ``variance``, ``skewness``, ``kurtosis``, or (if the statistics were computed with
+            ``quantile_sketch=True``) ``quantiles_<percent>``.
+
+        Returns
+        -------
+        *pandas.DataFrame*
+            With columns ``sp1``, ``sp2``, and one column per edge feature
+            (or two per sp feature: ``_sum`` and ``_difference``).
+        """
+        sp1 = self.edge_ids[:, 0]
+        sp2 = self.edge_ids[:, 1]
+
+        edge_df = pd.DataFrame({ 'sp1': sp1, 'sp2': sp2 }, columns=['sp1', 'sp2'])
+        for feature_name in feature_names:
+            feature_name = feature_name.lower()
+            if feature_name.startswith('standard_edge_'):
+                edge_df[feature_name] = self.edge_statistics.feature_column(feature_name)
+            elif feature_name.startswith('standard_sp_'):
+                sp_column = self.sp_statistics.feature_column(feature_name)
+                sums = sp_column[sp1] + sp_column[sp2]
+                differences = np.abs(sp_column[sp1] - sp_column[sp2])
+                if feature_name.endswith('_count') or feature_name.endswith('_sum'):
+                    # Same normalization as the StandardSpAccumulator
+                    sums = np.power(sums, np.float32(1./self.ndim))
+                    differences = np.power(differences, np.float32(1./self.ndim))
+                edge_df[feature_name + '_sum'] = sums
+                edge_df[feature_name + '_difference'] = differences
+            else:
+                assert False, "Can't compute feature {} from the statistics".format( feature_name )
+        return edge_df
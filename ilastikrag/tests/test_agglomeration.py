@@ -0,0 +1,95 @@
+import numpy as np
+import vigra
+
+from ilastikrag import Rag, Agglomerator
+from ilastikrag.util import generate_random_voronoi
+
+class TestAgglomerator(object):
+
+    def test_threshold(self):
+        """
+        After agglomerating up to a threshold, every remaining edge must have a score
+        at or above the threshold, and the result must agree with the edge decisions.
+        """
+        superpixels = generate_random_voronoi((100,200), 200)
+        rag = Rag( superpixels )
+
+        values = np.random.random(size=superpixels.shape).astype(np.float32)
+        values = vigra.taggedView(values, 'yx')
+
+        stats = rag.compute_statistics(values)
+        agglomerator = Agglomerator(stats, 'mean')
+        sp_mapping = agglomerator.agglomerate(threshold=0.5)
+
+        assert 1 < agglomerator.num_segments < rag.num_sp
+        assert len(agglomerator.merge_history) == rag.num_sp - agglomerator.num_segments
+        assert len(np.unique(sp_mapping[rag.sp_ids])) == agglomerator.num_segments
+
+        merged_stats = stats.merge_edges(sp_mapping)
+        assert (merged_stats.edge_statistics.feature_column('mean') >= 0.5).all()
+
+        decisions = Agglomerator.edge_decisions(sp_mapping, rag.edge_ids)
+        segmentation = rag.naive_segmentation_from_edge_decisions(decisions)
+        merged_rag = Rag( segmentation )
+        assert merged_rag.num_sp == agglomerator.num_segments
+        assert len(merged_rag.edge_ids) == len(merged_stats.edge_ids)
+
+        # Continue to a fixed number of segments
+        sp_mapping = agglomerator.agglomerate(num_segments=10)
+        assert agglomerator.num_segments == 10
+        assert len(np.unique(sp_mapping[rag.sp_ids])) == 10
+
+    def test_quantile_score(self):
+        """
+        Quantile sketches aren't merged during agglomeration, so they can't be used as scores
+        (except for quantiles 0 and 100, i.e. the exact minimum and maximum).
+        """
+        superpixels = generate_random_voronoi((100,200), 200)
+        rag = Rag( superpixels )
+
+        values = np.random.random(size=superpixels.shape).astype(np.float32)
+        values = vigra.taggedView(values, 'yx')
+        stats = rag.compute_statistics(values, quantile_sketch=True)
+
+        for edge_score in ['quantiles_50', 'standard_edge_quantiles_50']:
+            try:
+                Agglomerator(stats, edge_score)
+            except AssertionError:
+                pass
+            else:
+                assert False, "Expected {} to be rejected".format( edge_score )
+
+        agglomerator = Agglomerator(stats, 'quantiles_100')
+        agglomerator.agglomerate(num_segments=10)
+        merged_stats = stats.merge_edges(agglomerator.sp_mapping())
+        assert (merged_stats.edge_statistics.feature_column('quantiles_100') ==
+                merged_stats.edge_statistics.feature_column('maximum')).all()
+
+    def test_custom_score(self):
+        """
+        A custom score function may use the segment statistics, too.
+        """
+        superpixels = generate_random_voronoi((100,200), 200)
+        rag = Rag( superpixels )
+
+        values = np.random.random(size=superpixels.shape).astype(np.float32)
+        values = vigra.taggedView(values, 'yx')
+
+        # Merge the smallest segments first
+        def smaller_segment_size(agglomerator, edge_indexes):
+            sizes = agglomerator.sp_statistics.count[agglomerator.edge_ids[edge_indexes]]
+            return sizes.min(axis=1)
+
+        stats = rag.compute_statistics(values)
+        agglomerator = Agglomerator(stats, smaller_segment_size, rescore_neighbors=True)
+        sp_mapping = agglomerator.agglomerate(threshold=500)
+
+        segment_sizes = np.bincount(sp_mapping[superpixels].reshape(-1))[1:]
+        assert (segment_sizes >= 500).all()
+
+if __name__ == "__main__":
+    import sys
+    import nose
+    sys.argv.append("--nocapture")    # Don't steal stdout.  Show it on the console as usual.
+    sys.argv.append("--nologcapture") # Don't set the logging level to DEBUG.  Leave it alone.
+    nose.run(defaultTest=__file__)
@@ -0,0 +1,60 @@
+import numpy as np
+import vigra
+
+from ilastikrag import Rag, SegmentationEvaluator
+from ilastikrag.util import generate_random_voronoi
+
+class TestSegmentationEvaluator(object):
+
+    def test_perfect_segmentation(self):
+        """
+        If the groundtruth consists of whole superpixels,
+        the corresponding sp_mapping should have no errors at all.
+        """
+        superpixels = generate_random_voronoi((100,200), 200)
+        rag = Rag( superpixels )
+
+        sp_mapping = (np.arange(rag.max_sp+1) // 10).astype(np.uint32)
+        groundtruth = vigra.taggedView(sp_mapping[superpixels], 'yx')
+
+        evaluator = SegmentationEvaluator(rag, groundtruth)
+        merge_error, split_error = evaluator.variation_of_information(sp_mapping)
+        assert abs(merge_error) < 1e-9 and abs(split_error) < 1e-9
+        error, precision, recall = evaluator.adapted_rand_error(sp_mapping)
+        assert abs(error) < 1e-9 and abs(precision - 1.0) < 1e-9 and abs(recall - 1.0) < 1e-9
+
+        # The superpixels themselves are an oversegmentation: no merge errors
+        merge_error, split_error = evaluator.variation_of_information()
+        assert abs(merge_error) < 1e-9 and split_error > 0.0
+        error, precision, recall = evaluator.adapted_rand_error()
+        assert abs(precision - 1.0) < 1e-9 and recall < 1.0
+
+        # Each superpixel lies entirely within one groundtruth object
+        probabilities = evaluator.edge_merge_probabilities()
+        decisions = evaluator.edge_decisions()
+        assert ((probabilities == 1.0) == ~decisions).all()
+        assert ((probabilities == 0.0) == decisions).all()
+        assert (decisions == rag.edge_decisions_from_groundtruth(groundtruth)).all()
+
+    def test_edge_merge_probabilities(self):
+        superpixels = generate_random_voronoi((100,200), 200)
+        rag = Rag( superpixels )
+
+        groundtruth = np.zeros_like(superpixels)
+        groundtruth[:, 100:] = 1
+        groundtruth[::2, :] += 2
+
+        evaluator = SegmentationEvaluator(rag, groundtruth)
+        probabilities = evaluator.edge_merge_probabilities()
+
+        for (sp1, sp2), probability in zip(rag.edge_ids[:20], probabilities[:20]):
+            gt_fractions_1 = np.bincount(groundtruth[superpixels == sp1], minlength=4) / float((superpixels == sp1).sum())
+            gt_fractions_2 = np.bincount(groundtruth[superpixels == sp2], minlength=4) / float((superpixels == sp2).sum())
+            assert abs(probability - np.dot(gt_fractions_1, gt_fractions_2)) < 1e-6
+
+if __name__ == "__main__":
+    import sys
+    import nose
+    sys.argv.append("--nocapture")    # Don't steal stdout.  Show it on the console as usual.
+    sys.argv.append("--nologcapture") # Don't set the logging level to DEBUG.  Leave it alone.
+    nose.run(defaultTest=__file__)
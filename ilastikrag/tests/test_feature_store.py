@@ -0,0 +1,155 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+import h5py
+
+from ilastikrag.feature_store import FeatureStore
+from ilastikrag.util import value_fingerprint
+
+def _check_store(store):
+    features_df = pd.DataFrame( { 'sp1': np.arange(10, dtype=np.uint32),
+                                  'sp2': np.arange(10, dtype=np.uint32) + 1,
+                                  'standard_edge_mean': np.random.random(10).astype(np.float32),
+                                  'standard_sp_count_sum': np.arange(10, dtype=np.float32),
+                                  'standard_sp_count_difference': np.ones(10, dtype=np.float32) },
+                                columns=['sp1', 'sp2', 'standard_edge_mean',
+                                         'standard_sp_count_sum', 'standard_sp_count_difference'] )
+
+    assert store.fingerprints('zyx') == []
+    assert store.missing_features('zyx', 'abc', ['standard_edge_mean']) == ['standard_edge_mean']
+
+    store.write('zyx', 'abc', ['standard_edge_mean'], features_df)
+    assert store.fingerprints('zyx') == ['abc']
+    assert store.stored_features('zyx', 'abc').keys() == ['standard_edge_mean']
+
+    # Append-only: stored features are skipped
+    store.write('zyx', 'abc', ['standard_edge_mean', 'standard_sp_count'], features_df)
+    assert store.stored_features('zyx', 'abc') == { 'standard_edge_mean': ['standard_edge_mean'],
+                                                    'standard_sp_count': ['standard_sp_count_sum',
+                                                                          'standard_sp_count_difference'] }
+    assert store.missing_features('zyx', 'abc', ['standard_sp_count', 'standard_edge_maximum']) \
+        == ['standard_edge_maximum']
+
+    # Only the requested columns are read
+    columns = store.read('zyx', 'abc', ['standard_sp_count'])
+    assert columns.keys() == ['standard_sp_count_sum', 'standard_sp_count_difference']
+    for colname, values in columns.items():
+        assert values.dtype == features_df[colname].dtype
+        assert (values == features_df[colname].values).all()
+
+    # Other fingerprints are independent
+    assert store.missing_features('zyx', 'def', ['standard_sp_count']) == ['standard_sp_count']
+
+    try:
+        store.write('zyx', 'abc', ['standard_edge_maximum'], features_df[:5])
+    except AssertionError:
+        pass
+    else:
+        assert False, "Expected the store to refuse features for a subset of the edges."
+
+def _check_quantile_columns(store):
+    """
+    Each feature gets only its own columns, even if another feature's name starts with it.
+    """
+    features_df = pd.DataFrame( { 'sp1': np.arange(10, dtype=np.uint32),
+                                  'sp2': np.arange(10, dtype=np.uint32) + 1,
+                                  'standard_edge_quantiles_10': np.random.random(10).astype(np.float32),
+                                  'standard_edge_quantiles_100': np.random.random(10).astype(np.float32),
+                                  'standard_sp_quantiles_10_sum': np.random.random(10).astype(np.float32),
+                                  'standard_sp_quantiles_100_sum': np.random.random(10).astype(np.float32) },
+                                columns=['sp1', 'sp2', 'standard_edge_quantiles_10', 'standard_edge_quantiles_100',
+                                         'standard_sp_quantiles_10_sum', 'standard_sp_quantiles_100_sum'] )
+
+    feature_names = [ 'standard_edge_quantiles_10', 'standard_edge_quantiles_100',
+                      'standard_sp_quantiles_10', 'standard_sp_quantiles_100' ]
+    store.write('yx', 'quantiles', feature_names, features_df)
+    assert store.stored_features('yx', 'quantiles') == \
+        { 'standard_edge_quantiles_10': ['standard_edge_quantiles_10'],
+          'standard_edge_quantiles_100': ['standard_edge_quantiles_100'],
+          'standard_sp_quantiles_10': ['standard_sp_quantiles_10_sum'],
+          'standard_sp_quantiles_100': ['standard_sp_quantiles_100_sum'] }
+
+    columns = store.read('yx', 'quantiles', ['standard_edge_quantiles_10', 'standard_sp_quantiles_10'])
+    assert columns.keys() == ['standard_edge_quantiles_10', 'standard_sp_quantiles_10_sum']
+
+def test_hdf5_store():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        filepath = os.path.join(tmp_dir, 'test_store.h5')
+        with h5py.File(filepath, 'w') as f:
+            _check_store( FeatureStore(f.create_group('saved_rag')) )
+            _check_quantile_columns( FeatureStore(f['saved_rag']) )
+
+        # Reopen in a 'later session'
+        with h5py.File(filepath, 'r') as f:
+            store = FeatureStore(f['saved_rag'])
+            assert store.fingerprints('zyx') == ['abc']
+            assert store.read('zyx', 'abc', ['standard_edge_mean']).keys() == ['standard_edge_mean']
+    finally:
+        shutil.rmtree(tmp_dir)
+
+def test_directory_store():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        _check_store( FeatureStore(tmp_dir) )
+        _check_quantile_columns( FeatureStore(tmp_dir) )
+        assert not any( filename.endswith('.tmp') for filename in os.listdir(os.path.join(tmp_dir, 'features/zyx/abc')) )
+
+        store = FeatureStore(tmp_dir, mmap=True)
+        columns = store.read('zyx', 'abc', ['standard_edge_mean'])
+        assert isinstance(columns['standard_edge_mean'], np.memmap)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+def test_value_fingerprint():
+    values = np.random.random((10,20,30)).astype(np.float32)
+    fingerprint = value_fingerprint(values)
+    assert value_fingerprint(values.copy(), blocksize=3) == fingerprint
+    assert value_fingerprint(values.astype(np.float64)) != fingerprint
+    assert value_fingerprint(values.reshape(20,10,30)) != fingerprint
+
+    values[5,5,5] += 1
+    assert value_fingerprint(values) != fingerprint
+
+def test_compute_features_with_store():
+    import vigra
+    from ilastikrag import Rag
+    from ilastikrag.util import generate_random_voronoi
+
+    superpixels = generate_random_voronoi((100,200), 200)
+    rag = Rag( superpixels )
+    values = vigra.taggedView( np.random.random(superpixels.shape).astype(np.float32), superpixels.axistags )
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        store = FeatureStore(tmp_dir)
+        feature_names = ['standard_edge_mean', 'standard_sp_count']
+        expected_df = rag.compute_features(values, feature_names)
+
+        features_df = rag.compute_features(values, ['standard_edge_mean'], feature_store=store)
+        assert (features_df.values == expected_df[features_df.columns].values).all()
+
+        # Only the new feature is computed
+        features_df = rag.compute_features(values, feature_names, feature_store=store)
+        assert list(features_df.columns) == list(expected_df.columns)
+        assert (features_df.values == expected_df.values).all()
+        assert len(store.fingerprints('yx')) == 1
+
+        # A 'later session' reads the stored features, even without the values (given their fingerprint)
+        fingerprint = store.fingerprints('yx')[0]
+        features_array = rag.compute_features(None, feature_names, feature_store=FeatureStore(tmp_dir),
+                                              fingerprint=fingerprint, asarray=True)
+        assert features_array.column_names == list(expected_df.columns[2:])
+        assert (features_array.values == expected_df.values[:, 2:]).all()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == "__main__":
+    import sys
+    import nose
+    sys.argv.append("--nocapture")    # Don't steal stdout.  Show it on the console as usual.
+    sys.argv.append("--nologcapture") # Don't set the logging level to DEBUG.  Leave it alone.
+    nose.run(defaultTest=__file__)
@@ -0,0 +1,45 @@
+import sys
+import subprocess
+
+from ilastikrag.lazy_import import lazy_import
+
+def test_lazy_import():
+    os = lazy_import('os')
+    assert os is sys.modules['os'], "Already-imported modules should be returned as-is"
+
+    # Not imported yet in a fresh interpreter
+    script = ("import sys\n"
+              "from ilastikrag.lazy_import import lazy_import\n"
+              "shelve = lazy_import('shelve')\n"
+              "assert 'shelve' not in sys.modules\n"
+              "assert shelve.open\n"
+              "assert 'shelve' in sys.modules\n")
+    subprocess.check_call([sys.executable, '-c', script])
+
+def test_package_import_is_lazy():
+    """
+    Importing ilastikrag must not import pandas or vigra, or any of the built-in accumulators' dependencies.
+    """
+    script = ("import sys\n"
+              "import ilastikrag\n"
+              "from ilastikrag import Rag\n"
+              "assert list(Rag.DEFAULT_ACCUMULATOR_CLASSES.keys())\n"
+              "heavy = [m for m in ('pandas', 'vigra', 'h5py', 'PyQt4') if m in sys.modules]\n"
+              "assert not heavy, 'Imported eagerly: {}'.format(heavy)\n"
+              "accumulator_modules = [m for m in sys.modules if m.startswith('ilastikrag.accumulators.')\n"
+              "                       and m.split('.')[2] not in ('base', 'registry') and sys.modules[m] is not None]\n"
+              "assert not accumulator_modules, 'Imported eagerly: {}'.format(accumulator_modules)\n"
+              "assert 'ilastikrag.accumulators.standard.standard_edge_accumulator' not in sys.modules\n"
+              "\n"
+              "# The subpackages are still available as attributes, and import on first use.\n"
+              "assert ilastikrag.accumulators.standard.StandardEdgeAccumulator\n"
+              "assert 'ilastikrag.accumulators.standard.standard_edge_accumulator' in sys.modules\n"
+              "from ilastikrag.accumulators.edgeregion import EdgeRegionEdgeAccumulator\n")
+    subprocess.check_call([sys.executable, '-c', script])
+
+if __name__ == "__main__":
+    import sys
+    import nose
+    sys.argv.append("--nocapture")    # Don't steal stdout.  Show it on the console as usual.
+    sys.argv.append("--nologcapture") # Don't set the logging level to DEBUG.  Leave it alone.
+    nose.run(defaultTest=__file__)
@@ -0,0 +1,65 @@
+import numpy as np
+
+from ilastikrag.profiling import Profile, NULL_PROFILE
+
+def test_profile():
+    profile = Profile('operation')
+    profile.start()
+    try:
+        with profile.stage('operation'):
+            for _ in range(3):
+                with profile.stage('inner'):
+                    a = np.ones((2**20,))
+                    del a
+    finally:
+        profile.stop()
+
+    assert profile.stages.keys() == ['operation', 'operation/inner']
+    assert profile['operation'].calls == 1
+    assert profile['operation/inner'].calls == 3
+    assert profile['operation/inner'].wall_seconds <= profile['operation'].wall_seconds
+
+    df = profile.to_dataframe()
+    assert list(df.index) == ['operation', 'operation/inner']
+    assert list(df.columns) == ['calls', 'wall_seconds', 'cpu_seconds', 'peak_mb']
+    assert 'inner' in profile.report()
+
+def test_null_profile():
+    with NULL_PROFILE.stage('anything'):
+        pass
+
+def test_rag_profile():
+    import vigra
+    from ilastikrag import Rag
+    from ilastikrag.util import generate_random_voronoi
+
+    superpixels = generate_random_voronoi((100,200), 200)
+    rag = Rag( superpixels )
+    assert rag.last_profile is None
+
+    rag = Rag( superpixels, profile=True )
+    stages = rag.last_profile.stages
+    assert stages.keys()[0] == 'construction'
+    for stage in ['edge_mask:y', 'edge_ids:x', 'unique_edge_labels', 'dense_edge_table:y/merge']:
+        assert 'construction/' + stage in stages, stage
+
+    values = vigra.taggedView( np.random.random(superpixels.shape).astype(np.float32), superpixels.axistags )
+    rag.compute_features(values, ['standard_edge_mean', 'standard_sp_count'])
+    stages = rag.last_profile.stages
+    assert stages.keys()[0] == 'compute_features'
+    assert 'compute_features/compute/edge_group:yx/extract_edge_values' in stages
+    assert 'compute_features/compute/edge_group:yx/accumulator:standard_edge' in stages
+    assert 'compute_features/compute/edge_group:yx/accumulator:standard_sp' in stages
+
+    # Disabled again: The last profile is kept.
+    rag.profile = False
+    rag.compute_features(values, ['standard_edge_count'])
+    assert rag.last_profile.stages.keys()[0] == 'compute_features'
+    assert rag.last_profile['compute_features'].calls == 1
+
+if __name__ == "__main__":
+    import sys
+    import nose
+    sys.argv.append("--nocapture")    # Don't steal stdout.  Show it on the console as usual.
+    sys.argv.append("--nologcapture") # Don't set the logging level to DEBUG.  Leave it alone.
+    nose.run(defaultTest=__file__)
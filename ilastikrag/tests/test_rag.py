@@ -8,6 +8,39 @@ import vigra
 
 from ilastikrag import Rag
 from ilastikrag.util import generate_random_voronoi
+from ilastikrag.accumulators.base import BaseSpAccumulator
+
+class MaxSpAccumulator(BaseSpAccumulator):
+    """
+    A minimal custom sp accumulator, which doesn't support blockwise processing.
+    """
+    ACCUMULATOR_ID = 'max'
+
+    def __init__(self, rag, feature_names):
+        self._sp_max = None
+
+    def cleanup(self):
+        self._sp_max = None
+
+    @classmethod
+    def supported_features(cls, rag):
+        return ['max_sp_max']
+
+    def ingest_values(self, rag, value_img):
+        self._sp_max = np.zeros( (rag.max_sp+1,), dtype=np.float32 )
+        np.maximum.at( self._sp_max, np.asarray(rag.label_img).reshape(-1), np.asarray(value_img).reshape(-1) )
+
+    def append_edge_features_to_df(self, edge_df):
+        sp_max = self._sp_max[edge_df[['sp1', 'sp2']].values]
+        edge_df['max_sp_max_sum'] = sp_max.sum(axis=1)
+        return edge_df
+
+def _is_memory_mapped(values):
+    while values is not None:
+        if isinstance(values, np.memmap):
+            return True
+        values = getattr(values, 'base', None)
+    return False
 
 class TestRag(object):
     
@@ -242,6 +275,332 @@ class TestRag(object):
         
         assert (features_df_original.values == features_df_deserialized.values).all()
 
+    def test_lazy_deserialization(self):
+        """
+        Deserialize the rag lazily (with memory-mapped columns),
+        and make sure the dense tables are only loaded when needed.
+        """
+        import h5py
+
+        superpixels = generate_random_voronoi((100,200), 200)
+        original_rag = Rag( superpixels )
+
+        tmp_dir = tempfile.mkdtemp()
+        filepath = os.path.join(tmp_dir, 'test_rag.h5')
+
+        with h5py.File(filepath, 'w') as f:
+            original_rag.serialize_hdf5(f.create_group('saved_rag'), store_labels=True, compression=None)
+
+        with h5py.File(filepath, 'r') as f:
+            assert f['saved_rag'].attrs['format_version'] == Rag.SERIALIZATION_FORMAT_VERSION
+            deserialized_rag = Rag.deserialize_hdf5(f['saved_rag'], lazy=True, mmap=True)
+
+            assert (deserialized_rag.edge_ids == original_rag.edge_ids).all()
+            assert deserialized_rag.dense_edge_tables.keys() == original_rag.dense_edge_tables.keys()
+            assert not any(deserialized_rag.dense_edge_tables.is_loaded(k) for k in 'yx')
+
+            for axiskey, dense_table in original_rag.dense_edge_tables.items():
+                deserialized_table = deserialized_rag.dense_edge_tables[axiskey]
+                assert list(deserialized_table.columns) == list(dense_table.columns)
+                assert (deserialized_table.dtypes.values == dense_table.dtypes.values).all()
+                assert (deserialized_table.values == dense_table.values).all()
+
+            values = superpixels.astype(np.float32)
+            feature_names = ['standard_edge_mean', 'standard_sp_count']
+            features_df_original = original_rag.compute_features(values, feature_names)
+            features_df_deserialized = deserialized_rag.compute_features(values, feature_names)
+            assert (features_df_original.values == features_df_deserialized.values).all()
+
+    def test_save_load(self):
+        """
+        Save the rag to a directory, then load it (memory-mapped) and make sure nothing was lost.
+        """
+        superpixels = generate_random_voronoi((10,100,200), 200, flat_superpixels=True)
+        original_rag = Rag( superpixels, flat_superpixels=True )
+
+        tmp_dir = tempfile.mkdtemp()
+        rag_dir = os.path.join(tmp_dir, 'saved_rag')
+        original_rag.save(rag_dir, store_labels=True)
+        loaded_rag = Rag.load(rag_dir, mmap=True)
+
+        assert isinstance(loaded_rag.edge_ids, np.memmap)
+        assert (loaded_rag.edge_ids == original_rag.edge_ids).all()
+        assert (loaded_rag.sp_ids == original_rag.sp_ids).all()
+        assert loaded_rag.max_sp == original_rag.max_sp
+        assert loaded_rag.num_edges == original_rag.num_edges
+        assert loaded_rag.label_img.axistags == original_rag.label_img.axistags
+        assert (loaded_rag.label_img == original_rag.label_img).all()
+        assert (loaded_rag.flat_edge_label_img == original_rag.flat_edge_label_img).all()
+
+        for tables, loaded_tables in [(original_rag.unique_edge_tables, loaded_rag.unique_edge_tables),
+                                      (original_rag.dense_edge_tables, loaded_rag.dense_edge_tables)]:
+            assert sorted(loaded_tables.keys()) == sorted(tables.keys())
+            for axiskey, table in tables.items():
+                assert list(loaded_tables[axiskey].columns) == list(table.columns)
+                for col_name in table.columns:
+                    assert _is_memory_mapped(loaded_tables[axiskey][col_name].values), \
+                        "Column {} of table {} was copied".format( col_name, axiskey )
+                assert (loaded_tables[axiskey].values == table.values).all()
+
+        values = superpixels.astype(np.float32)
+        for edge_group, feature_names in [('yx', ['standard_edge_mean', 'standard_sp_count']),
+                                          ('z', ['standard_flatedge_count'])]:
+            features_df_original = original_rag.compute_features(values, feature_names, edge_group=edge_group)
+            features_df_loaded = loaded_rag.compute_features(values, feature_names, edge_group=edge_group)
+            assert (features_df_original.values == features_df_loaded.values).all()
+
+    def test_compact_serialization(self):
+        """
+        Serialize the rag without its dense tables, and make sure
+        they are re-derived from the labels (eagerly or lazily).
+        """
+        import h5py
+
+        superpixels = generate_random_voronoi((10,100,200), 200, flat_superpixels=True)
+        original_rag = Rag( superpixels, flat_superpixels=True )
+
+        tmp_dir = tempfile.mkdtemp()
+        filepath = os.path.join(tmp_dir, 'test_rag.h5')
+
+        with h5py.File(filepath, 'w') as f:
+            original_rag.serialize_hdf5(f.create_group('saved_rag'), store_labels=True, store_dense_tables=False)
+
+        for lazy in (False, True):
+            with h5py.File(filepath, 'r') as f:
+                assert 'dense_edge_tables' not in f['saved_rag']
+                deserialized_rag = Rag.deserialize_hdf5(f['saved_rag'], lazy=lazy)
+
+            assert deserialized_rag.dense_edge_tables.keys() == original_rag.dense_edge_tables.keys()
+            assert (deserialized_rag.flat_edge_label_img == original_rag.flat_edge_label_img).all()
+            for axiskey, dense_table in original_rag.dense_edge_tables.items():
+                deserialized_table = deserialized_rag.dense_edge_tables[axiskey]
+                assert list(deserialized_table.columns) == list(dense_table.columns)
+                assert (deserialized_table.values == dense_table.values).all()
+
+            values = superpixels.astype(np.float32)
+            for edge_group, feature_names in [('yx', ['standard_edge_mean']),
+                                              ('z', ['standard_flatedge_count'])]:
+                features_df_original = original_rag.compute_features(values, feature_names, edge_group=edge_group)
+                features_df_deserialized = deserialized_rag.compute_features(values, feature_names, edge_group=edge_group)
+                assert (features_df_original.values == features_df_deserialized.values).all()
+
+        # Without labels, the dense tables can't be derived.
+        with h5py.File(filepath, 'w') as f:
+            original_rag.serialize_hdf5(f.create_group('saved_rag'), store_labels=False, store_dense_tables=False)
+
+        with h5py.File(filepath, 'r') as f:
+            deserialized_rag = Rag.deserialize_hdf5(f['saved_rag'])
+
+        try:
+            deserialized_rag.dense_edge_tables['y']
+        except NotImplementedError:
+            pass
+        else:
+            assert False, "Expected NotImplementedError"
+
+    def test_blockwise_features(self):
+        """
+        Features computed blockwise (e.g. from an hdf5 dataset)
+        should match the features computed from an in-memory value image.
+        """
+        import h5py
+
+        superpixels = generate_random_voronoi((20,50,60), 100)
+        rag = Rag( superpixels )
+
+        values = np.random.random(size=superpixels.shape).astype(np.float32)
+        values = vigra.taggedView(values, 'zyx')
+
+        feature_names = ['standard_edge_count', 'standard_edge_mean', 'standard_edge_minimum', 'standard_edge_maximum',
+                         'standard_edge_quantiles_0', 'standard_edge_quantiles_100',
+                         'standard_sp_count', 'standard_sp_mean', 'standard_sp_variance', 'standard_sp_regionradii',
+                         'edgeregion_edge_regionradii']
+        features_df = rag.compute_features(values, feature_names)
+        
+        # Small blocks, in memory
+        blockwise_df = rag.compute_features(values, feature_names, blocksize=3)
+        assert list(blockwise_df.columns.values) == list(features_df.columns.values)
+        assert np.allclose(blockwise_df.values, features_df.values, rtol=1e-4)
+
+        # hdf5 dataset (always processed blockwise)
+        tmp_dir = tempfile.mkdtemp()
+        filepath = os.path.join(tmp_dir, 'test_values.h5')
+        with h5py.File(filepath, 'w') as f:
+            f.create_dataset('values', data=values, chunks=(1,50,60))
+            h5_df = rag.compute_features(f['values'], feature_names, blocksize=7)
+        assert list(h5_df.columns.values) == list(features_df.columns.values)
+        assert np.allclose(h5_df.values, features_df.values, rtol=1e-4)
+
+    def test_feature_array_output(self):
+        """
+        compute_features(..., asarray=True) should produce the
+        same features as the DataFrame output, in the same column order.
+        """
+        superpixels = generate_random_voronoi((100,200), 200)
+        rag = Rag( superpixels )
+
+        values = np.random.random(size=superpixels.shape).astype(np.float32)
+        values = vigra.taggedView(values, 'yx')
+
+        feature_names = ['standard_edge_mean', 'standard_edge_quantiles_25', 'edgeregion_edge_area',
+                         'standard_sp_count', 'standard_sp_mean']
+        features_df = rag.compute_features(values, feature_names)
+
+        features = rag.compute_features(values, feature_names, asarray=True)
+        assert features.values.dtype == np.float32
+        assert features.column_names == list(features_df.columns.values[2:])
+        assert (features.edge_ids == features_df[['sp1', 'sp2']].values).all()
+        assert (features.values == features_df.values[:, 2:]).all()
+        assert (features['standard_edge_mean'] == features_df['standard_edge_mean'].values).all()
+        assert (features.to_dataframe().values == features_df.values).all()
+        assert features.as_structured()['standard_sp_count_sum'].shape == (len(features_df),)
+
+        # Write directly into a memmap
+        tmp_dir = tempfile.mkdtemp()
+        filepath = os.path.join(tmp_dir, 'features.bin')
+        out = np.memmap(filepath, dtype=np.float32, mode='w+', shape=features.values.shape)
+        mmap_features = rag.compute_features(values, feature_names, out=out)
+        assert mmap_features.values is out
+        assert (out == features.values).all()
+
+    def test_feature_plan(self):
+        """
+        A FeaturePlan can be re-used for several value images,
+        and gives the same results as compute_features().
+        """
+        superpixels = generate_random_voronoi((100,200), 200)
+        rag = Rag( superpixels )
+
+        feature_names = ['standard_edge_mean', 'standard_edge_quantiles_50', 'edgeregion_edge_area', 'standard_sp_mean']
+        plan = rag.plan_features(feature_names)
+        assert plan.edge_groups == ['yx']
+
+        for _ in range(3):
+            values = np.random.random(size=superpixels.shape).astype(np.float32)
+            values = vigra.taggedView(values, 'yx')
+
+            features_df = rag.compute_features(values, feature_names)
+            planned_df = plan.compute(values)
+            assert list(planned_df.columns.values) == list(features_df.columns.values)
+            assert (planned_df.values == features_df.values).all()
+
+            planned_features = plan.compute(values, asarray=True)
+            assert (planned_features.values == features_df.values[:, 2:]).all()
+
+    def test_edge_subset_features(self):
+        """
+        compute_features(..., edges=...) should give the same results as computing
+        the features for all edges and selecting the requested rows.
+        """
+        superpixels = generate_random_voronoi((100,200), 200)
+        rag = Rag( superpixels )
+
+        values = np.random.random(size=superpixels.shape).astype(np.float32)
+        values = vigra.taggedView(values, 'yx')
+
+        feature_names = ['standard_edge_count', 'standard_edge_mean', 'standard_edge_quantiles_50',
+                         'edgeregion_edge_area', 'standard_sp_count', 'standard_sp_mean']
+        features_df = rag.compute_features(values, feature_names, quantile_method='exact')
+
+        edge_labels = np.array([17, 3, 42, len(features_df)-1])
+        subset_df = rag.compute_features(values, feature_names, quantile_method='exact', edges=edge_labels)
+        assert list(subset_df.columns.values) == list(features_df.columns.values)
+        assert np.allclose(subset_df.values, features_df.values[edge_labels])
+
+        # Edges can also be given as (sp1, sp2) pairs, in either order.
+        edge_ids = features_df[['sp2', 'sp1']].values[edge_labels]
+        pairs_df = rag.compute_features(values, feature_names, quantile_method='exact', edges=edge_ids)
+        assert (pairs_df.values == subset_df.values).all()
+
+        subset_features = rag.compute_features(values, feature_names, quantile_method='exact',
+                                               edges=edge_labels, asarray=True)
+        assert (subset_features.values == subset_df.values[:, 2:]).all()
+
+        # A custom sp accumulator without blockwise support: Features are computed for all edges, then selected.
+        accumulator_set = [MaxSpAccumulator(rag, ['max_sp_max'])]
+        features_df = rag.compute_features(values, ['max_sp_max', 'standard_edge_mean'], accumulator_set=accumulator_set)
+        subset_df = rag.compute_features(values, ['max_sp_max', 'standard_edge_mean'], accumulator_set=accumulator_set,
+                                         edges=edge_labels)
+        assert (subset_df.values == features_df.values[edge_labels]).all()
+
+        # Flat superpixels
+        superpixels = generate_random_voronoi((10,100,200), 200, flat_superpixels=True)
+        rag = Rag( superpixels, flat_superpixels=True )
+
+        values = np.random.random(size=superpixels.shape).astype(np.float32)
+        values = vigra.taggedView(values, 'zyx')
+
+        feature_names = ['standard_flatedge_mean', 'similarity_flatedge_correlation', 'standard_sp_mean']
+        features_df = rag.compute_features(values, feature_names, edge_group='z')
+        edge_labels = np.array([5, 0, len(features_df)-1])
+        subset_df = rag.compute_features(values, feature_names, edge_group='z', edges=edge_labels)
+        assert np.allclose(subset_df.values, features_df.values[edge_labels])
+
+    def test_roi_features(self):
+        """
+        compute_features(..., roi=...) should give the same edge features
+        as a Rag built from the cropped images.
+        """
+        superpixels = generate_random_voronoi((100,200), 200)
+        rag = Rag( superpixels )
+
+        values = np.random.random(size=superpixels.shape).astype(np.float32)
+        values = vigra.taggedView(values, 'yx')
+
+        start, stop = (20, 50), (70, 130)
+        cropped_rag = Rag( superpixels[20:70, 50:130] )
+        cropped_values = values[20:70, 50:130]
+
+        feature_names = ['standard_edge_count', 'standard_edge_mean']
+        cropped_df = cropped_rag.compute_features(cropped_values, feature_names)
+        roi_df = rag.compute_features(values, feature_names, roi=(start, stop))
+        assert (roi_df[['sp1', 'sp2']].values == cropped_df[['sp1', 'sp2']].values).all()
+        assert np.allclose(roi_df.values, cropped_df.values)
+
+        # With roi_whole_edges=True, the same edges are selected, but their features cover all of their pixels.
+        features_df = rag.compute_features(values, feature_names + ['standard_sp_count'])
+        whole_df = rag.compute_features(values, feature_names + ['standard_sp_count'],
+                                        roi=(start, stop), roi_whole_edges=True)
+        assert (whole_df[['sp1', 'sp2']].values == roi_df[['sp1', 'sp2']].values).all()
+        assert np.allclose(whole_df.values, features_df.values[whole_df.index.values])
+
+    def test_statistics_merge_edges(self):
+        """
+        The features derived from merged statistics should match the features
+        computed directly from a merged label image.
+        """
+        superpixels = generate_random_voronoi((100,200), 200)
+        rag = Rag( superpixels )
+
+        values = np.random.random(size=superpixels.shape).astype(np.float32)
+        values = vigra.taggedView(values, 'yx')
+
+        feature_names = ['standard_edge_count', 'standard_edge_mean', 'standard_edge_minimum',
+                         'standard_edge_maximum', 'standard_edge_variance',
+                         'standard_sp_count', 'standard_sp_mean', 'standard_sp_variance']
+
+        stats = rag.compute_statistics(values)
+        features_df = rag.compute_features(values, feature_names)
+        stats_df = stats.edge_features(feature_names)
+        assert list(stats_df.columns.values) == list(features_df.columns.values)
+        assert np.allclose(stats_df.values, features_df.values, rtol=1e-4)
+
+        # Merge every three consecutive superpixel ids
+        sp_groups = np.arange(rag.max_sp+1) // 3 + 1
+        merged_superpixels = vigra.taggedView(sp_groups[superpixels].astype(np.uint32), 'yx')
+        merged_rag = Rag( merged_superpixels )
+
+        merged_stats = stats.merge_edges(sp_groups)
+        assert (merged_stats.edge_ids == merged_rag.edge_ids).all()
+
+        merged_features_df = merged_rag.compute_features(values, feature_names)
+        merged_stats_df = merged_stats.edge_features(feature_names)
+        assert np.allclose(merged_stats_df.values, merged_features_df.values, rtol=1e-4)
+
+        # Blockwise statistics are the same
+        blockwise_stats = rag.compute_statistics(values, blocksize=10)
+        assert np.allclose(blockwise_stats.edge_features(feature_names).values, stats_df.values, rtol=1e-4)
+
     def test_invalid_feature_names(self):
         """
         The Rag should refuse to compute features it doesn't 
@@ -0,0 +1,91 @@
+import pkg_resources
+
+from ilastikrag.accumulators.registry import AccumulatorRegistry, cached_supported_features
+from ilastikrag.accumulators.base import BaseSpAccumulator
+
+class CountingSpAccumulator(BaseSpAccumulator):
+    ACCUMULATOR_ID = 'counting'
+    num_calls = 0
+
+    @classmethod
+    def supported_features(cls, rag):
+        cls.num_calls += 1
+        return ['counting_sp_ndim{}'.format(rag.label_img.ndim)]
+
+class FakeRag(object):
+    class FakeLabels(object):
+        def __init__(self, ndim):
+            self.ndim = ndim
+
+    def __init__(self, ndim, flat_superpixels=False):
+        self.label_img = FakeRag.FakeLabels(ndim)
+        self.flat_superpixels = flat_superpixels
+
+def test_register():
+    registry = AccumulatorRegistry([ (('standard', 'edge'), 'ilastikrag.accumulators.standard:StandardEdgeAccumulator') ])
+    assert not registry.is_loaded(('standard', 'edge'))
+
+    registry.register(CountingSpAccumulator)
+    registry.register('ilastikrag.accumulators.standard:StandardSpAccumulator', 'standard', 'sp')
+    assert list(registry.keys()) == [('standard', 'edge'), ('counting', 'sp'), ('standard', 'sp')]
+    assert ('standard', 'sp') in registry
+    assert not registry.is_loaded(('standard', 'sp'))
+
+    assert registry[('counting', 'sp')] is CountingSpAccumulator
+    assert registry[('standard', 'edge')].__name__ == 'StandardEdgeAccumulator'
+    assert registry.is_loaded(('standard', 'edge'))
+
+    try:
+        registry.register(CountingSpAccumulator)
+    except RuntimeError:
+        pass
+    else:
+        assert False, "Expected a conflict"
+
+def test_entry_points():
+    dist = pkg_resources.Distribution(project_name='ilastikrag-test-plugin', version='1.0')
+    entry_point = pkg_resources.EntryPoint.parse('standard_flatedge = ilastikrag.accumulators.standard:StandardFlatEdgeAccumulator',
+                                                 dist=dist)
+    dist._ep_map = { 'ilastikrag.test_accumulators': { entry_point.name: entry_point } }
+    pkg_resources.working_set.add(dist, entry='ilastikrag-test-plugin')
+
+    registry = AccumulatorRegistry([], entry_point_group='ilastikrag.test_accumulators')
+    assert list(registry.keys()) == [('standard', 'flatedge')]
+    assert not registry.is_loaded(('standard', 'flatedge'))
+    assert registry[('standard', 'flatedge')].__name__ == 'StandardFlatEdgeAccumulator'
+
+def test_broken_entry_points():
+    """
+    Entry points with bad names or conflicting ids/types are skipped, without affecting the others.
+    """
+    dist = pkg_resources.Distribution(project_name='ilastikrag-broken-plugin', version='1.0')
+    entry_points = [ pkg_resources.EntryPoint.parse(line, dist=dist) for line in
+                     [ 'standard_flatedge = ilastikrag.accumulators.standard:StandardFlatEdgeAccumulator',
+                       'bad_id_edge = mypackage.accumulators:BadIdEdgeAccumulator',
+                       'badtype_region = mypackage.accumulators:BadTypeAccumulator',
+                       'standard_sp = mypackage.accumulators:ConflictingSpAccumulator' ] ]
+    dist._ep_map = { 'ilastikrag.broken_accumulators': { ep.name: ep for ep in entry_points } }
+    pkg_resources.working_set.add(dist, entry='ilastikrag-broken-plugin')
+
+    registry = AccumulatorRegistry([ (('standard', 'sp'), 'ilastikrag.accumulators.standard:StandardSpAccumulator') ],
+                                   entry_point_group='ilastikrag.broken_accumulators')
+    assert sorted(registry.keys()) == [('standard', 'flatedge'), ('standard', 'sp')]
+    assert registry[('standard', 'sp')].__name__ == 'StandardSpAccumulator'
+    assert registry[('standard', 'flatedge')].__name__ == 'StandardFlatEdgeAccumulator'
+
+def test_cached_supported_features():
+    CountingSpAccumulator.num_calls = 0
+    assert cached_supported_features(CountingSpAccumulator, FakeRag(3)) == ['counting_sp_ndim3']
+    assert cached_supported_features(CountingSpAccumulator, FakeRag(3)) == ['counting_sp_ndim3']
+    assert CountingSpAccumulator.num_calls == 1
+
+    assert cached_supported_features(CountingSpAccumulator, FakeRag(2)) == ['counting_sp_ndim2']
+    assert cached_supported_features(CountingSpAccumulator, FakeRag(3, flat_superpixels=True)) == ['counting_sp_ndim3']
+    assert CountingSpAccumulator.num_calls == 3
+
+if __name__ == "__main__":
+    import sys
+    import nose
+    sys.argv.append("--nocapture")    # Don't steal stdout.  Show it on the console as usual.
+    sys.argv.append("--nologcapture") # Don't set the logging level to DEBUG.  Leave it alone.
+    nose.run(defaultTest=__file__)
@@ -45,7 +45,69 @@ class TestSimilarityFlatEdgeAccumulator(object):
         features_df = rag.compute_features(values, ['similarity_flatedge_correlation'], edge_group='z')
         assert (features_df['similarity_flatedge_correlation'].values <= 1.0).all()
         assert (features_df['similarity_flatedge_correlation'].values >= -1.0).all()
-        
+
+        # Blockwise processing should produce the same results
+        blockwise_df = rag.compute_features(values, ['similarity_flatedge_correlation'], edge_group='z', blocksize=3)
+        assert np.allclose(blockwise_df['similarity_flatedge_correlation'].values,
+                           features_df['similarity_flatedge_correlation'].values, atol=1e-6)
+
+    def test_correlation_reference(self):
+        """
+        Compare with the per-edge correlation of the left/right slice values, as computed via np.cov()
+        (the original implementation), including an edge with constant values (correlation 1.0).
+        """
+        superpixels = generate_random_voronoi((10,100,200), 50, flat_superpixels=True)
+        rag = Rag( superpixels, flat_superpixels=True )
+
+        values = np.random.random(size=superpixels.shape).astype(np.float32)
+
+        # Give the largest edge a constant value on its 'left' side.
+        z_edge_table = rag.unique_edge_tables['z']
+        labels = np.asarray(superpixels)
+        edge_sizes = [ ((labels[:-1] == sp1) & (labels[1:] == sp2)).sum()
+                       for sp1, sp2 in z_edge_table[['sp1', 'sp2']].values[:50] ]
+        constant_edge = int(np.argmax(edge_sizes))
+        sp1, sp2 = z_edge_table[['sp1', 'sp2']].values[constant_edge]
+        constant_mask = np.zeros_like(labels, dtype=bool)
+        constant_mask[:-1] = (labels[:-1] == sp1) & (labels[1:] == sp2)
+        values[constant_mask] = 0.5
+        values = vigra.taggedView(values, 'zyx')
+
+        features_df = rag.compute_features(values, ['similarity_flatedge_correlation'], edge_group='z')
+        correlations = features_df['similarity_flatedge_correlation'].values
+
+        # Reference: Group the (left, right) value pairs of all slice pairs by edge.
+        left_sp = labels[:-1].reshape(-1)
+        right_sp = labels[1:].reshape(-1)
+        left_values = np.asarray(values[:-1], dtype=np.float64).reshape(-1)
+        right_values = np.asarray(values[1:], dtype=np.float64).reshape(-1)
+        order = np.lexsort((right_sp, left_sp))
+        pair_ids = np.transpose([left_sp[order], right_sp[order]])
+        group_starts = np.concatenate(([0], np.nonzero((pair_ids[1:] != pair_ids[:-1]).any(axis=1))[0] + 1))
+        group_stops = np.concatenate((group_starts[1:], [len(order)]))
+
+        reference = {}
+        for start, stop in zip(group_starts, group_stops):
+            if stop - start < 2:
+                # (np.cov() is undefined for a single pixel)
+                continue
+            covariance = np.cov(left_values[order[start:stop]], right_values[order[start:stop]])
+            denominator = np.sqrt(covariance[0,0]*covariance[1,1])
+            if denominator == 0.0:
+                reference[tuple(pair_ids[start])] = 1.0
+            else:
+                reference[tuple(pair_ids[start])] = covariance[0,1] / denominator
+
+        assert reference[(sp1, sp2)] == 1.0
+        assert correlations[constant_edge] == 1.0
+
+        num_checked = 0
+        for edge_index, (sp1, sp2) in enumerate(features_df[['sp1', 'sp2']].values):
+            if (sp1, sp2) in reference:
+                assert np.isclose(correlations[edge_index], reference[(sp1, sp2)], atol=1e-5), \
+                    "Edge {}: {} != {}".format( (sp1, sp2), correlations[edge_index], reference[(sp1, sp2)] )
+                num_checked += 1
+        assert num_checked > len(features_df) // 2
 
 if __name__ == "__main__":
     import sys
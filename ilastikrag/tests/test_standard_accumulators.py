@@ -275,6 +275,127 @@ class TestStandardAccumulators(object):
 
         assert list(features_df.columns.values) == ['sp1', 'sp2'] + edge_feature_names + sp_output_columns
 
+    def test_exact_quantiles(self):
+        superpixels = generate_random_voronoi((100,200), 200)
+        rag = Rag( superpixels )
+
+        values = np.random.random(size=superpixels.shape).astype(np.float32)
+        values = vigra.taggedView(values, 'yx')
+
+        feature_names = ['standard_edge_minimum', 'standard_edge_maximum',
+                         'standard_edge_quantiles_0', 'standard_edge_quantiles_100',
+                         'standard_sp_quantiles_50']
+        features_df = rag.compute_features(values, feature_names, quantile_method='exact')
+
+        # Exact quantiles 0 and 100 are simply the min/max
+        assert (features_df['standard_edge_quantiles_0'].values == features_df['standard_edge_minimum'].values).all()
+        assert (features_df['standard_edge_quantiles_100'].values == features_df['standard_edge_maximum'].values).all()
+
+        # Manually compute the sp medians
+        sp_medians = np.zeros( (rag.max_sp+1,), dtype=np.float32 )
+        for sp in rag.sp_ids:
+            sp_medians[sp] = np.median(values[superpixels == sp])
+
+        sp1 = features_df['sp1'].values
+        sp2 = features_df['sp2'].values
+        assert np.allclose(features_df['standard_sp_quantiles_50_sum'].values, sp_medians[sp1] + sp_medians[sp2])
+        assert np.allclose(features_df['standard_sp_quantiles_50_difference'].values, np.abs(sp_medians[sp1] - sp_medians[sp2]))
+
+        # Same results when processed blockwise
+        blockwise_df = rag.compute_features(values, feature_names, quantile_method='exact', blocksize=7)
+        assert (blockwise_df.values == features_df.values).all()
+
+    def test_sketch_quantiles(self):
+        superpixels = generate_random_voronoi((100,200), 200)
+        rag = Rag( superpixels )
+
+        values = 1.0 + np.random.random(size=superpixels.shape).astype(np.float32)
+        values = vigra.taggedView(values, 'yx')
+
+        feature_names = ['standard_edge_quantiles', 'standard_sp_quantiles_50']
+        exact_df = rag.compute_features(values, feature_names, quantile_method='exact')
+        sketch_df = rag.compute_features(values, feature_names, quantile_method='sketch')
+        assert list(sketch_df.columns.values) == list(exact_df.columns.values)
+
+        # Quantiles 0 and 100 are exact
+        for name in ['standard_edge_quantiles_0', 'standard_edge_quantiles_100']:
+            assert (sketch_df[name].values == exact_df[name].values).all()
+
+        # The others are within 1% of an actual edge value
+        # (The exact method interpolates between values, so the results aren't directly comparable for small edges.)
+        edge_names = ['standard_edge_quantiles_10', 'standard_edge_quantiles_50', 'standard_edge_quantiles_90']
+        assert (sketch_df[edge_names].values >= 0.99*exact_df[['standard_edge_quantiles_0']].values).all()
+        assert (sketch_df[edge_names].values <= 1.01*exact_df[['standard_edge_quantiles_100']].values).all()
+        assert np.allclose(sketch_df['standard_sp_quantiles_50_sum'].values,
+                           exact_df['standard_sp_quantiles_50_sum'].values, rtol=0.02)
+
+        # Merging the sketches of each block gives the same results as one big sketch.
+        blockwise_df = rag.compute_features(values, feature_names, quantile_method='sketch', blocksize=7)
+        assert (blockwise_df.values == sketch_df.values).all()
+
+    def test_histogram_features(self):
+        superpixels = generate_random_voronoi((100,200), 200)
+        rag = Rag( superpixels )
+
+        values = np.random.random(size=superpixels.shape).astype(np.float32)
+        values = vigra.taggedView(values, 'yx')
+
+        feature_names = ['standard_edge_count', 'standard_edge_histogram_8', 'standard_sp_histogram_4']
+        features_df = rag.compute_features(values, feature_names)
+
+        edge_bin_names = ['standard_edge_histogram_8_{}'.format(i) for i in range(8)]
+        sp_bin_names = ['standard_sp_histogram_4_{}'.format(i) for i in range(4)]
+        sp_output_columns = []
+        for name in sp_bin_names:
+            sp_output_columns += [name + '_sum', name + '_difference']
+        assert list(features_df.columns.values) == ['sp1', 'sp2', 'standard_edge_count'] + edge_bin_names + sp_output_columns
+
+        # The bins of each histogram add up to the total count
+        edge_histograms = features_df[edge_bin_names].values
+        assert (edge_histograms.sum(axis=1) == features_df['standard_edge_count'].values).all()
+
+        sp_counts = np.bincount(superpixels.flat[:])
+        sp1 = features_df['sp1'].values
+        sp2 = features_df['sp2'].values
+        sp_histogram_sums = features_df[[name + '_sum' for name in sp_bin_names]].values
+        assert (sp_histogram_sums.sum(axis=1) == sp_counts[sp1] + sp_counts[sp2]).all()
+
+        # The sp histograms span the range of the whole image,
+        # so they're identical when processed blockwise.
+        blockwise_df = rag.compute_features(values, ['standard_sp_histogram_4'], blocksize=7)
+        assert (blockwise_df[sp_output_columns].values == features_df[sp_output_columns].values).all()
+
+    def test_output_column_selection(self):
+        """
+        An accumulator that was configured with more features than the user asks for
+        should only provide the requested columns (and can be re-used with a different selection).
+        """
+        from ilastikrag.accumulators.standard import StandardEdgeAccumulator, StandardSpAccumulator
+        superpixels = generate_random_voronoi((100,200), 200)
+        rag = Rag( superpixels )
+
+        values = np.random.random(size=superpixels.shape).astype(np.float32)
+        values = vigra.taggedView(values, 'yx')
+
+        edge_acc = StandardEdgeAccumulator(rag, ['standard_edge_count', 'standard_edge_mean', 'standard_edge_quantiles'])
+        sp_acc = StandardSpAccumulator(rag, ['standard_sp_count', 'standard_sp_mean'])
+        accumulator_set = [edge_acc, sp_acc]
+
+        full_df = rag.compute_features(values, ['standard_edge_mean', 'standard_edge_quantiles_50',
+                                                'standard_sp_count', 'standard_sp_mean'])
+
+        features_df = rag.compute_features(values, ['standard_edge_quantiles_50', 'standard_sp_mean'],
+                                           accumulator_set=accumulator_set)
+        assert list(features_df.columns.values) == ['sp1', 'sp2', 'standard_edge_quantiles_50',
+                                                    'standard_sp_mean_sum', 'standard_sp_mean_difference']
+        assert (features_df.values == full_df[features_df.columns].values).all()
+
+        features_df = rag.compute_features(values, ['standard_edge_mean', 'standard_sp_count'],
+                                           accumulator_set=accumulator_set)
+        assert list(features_df.columns.values) == ['sp1', 'sp2', 'standard_edge_mean',
+                                                    'standard_sp_count_sum', 'standard_sp_count_difference']
+        assert (features_df.values == full_df[features_df.columns].values).all()
+
 if __name__ == "__main__":
     import sys
     import nose
@@ -90,6 +90,28 @@ class TestStandardFlatEdgeAccumulator(object):
         assert np.isclose(combined_features_df['standard_flatedge_regionradii_0'], combined_features_df['edgeregion_edge_regionradii_0'], atol=0.001).all()
         assert np.isclose(combined_features_df['standard_flatedge_regionradii_1'], combined_features_df['edgeregion_edge_regionradii_1'], atol=0.001).all()
 
+    def test_blockwise(self):
+        num_sp_per_slice = 200
+        slice_superpixels = generate_random_voronoi((100,200), num_sp_per_slice)
+        
+        superpixels = np.zeros( shape=((10,) + slice_superpixels.shape), dtype=np.uint32 )
+        for z in range(10):
+            superpixels[z] = slice_superpixels + z*num_sp_per_slice
+        superpixels = vigra.taggedView(superpixels, 'zyx')
+
+        rag_flat = Rag( superpixels, flat_superpixels=True )
+        
+        values = np.random.random(size=(superpixels.shape)).astype(np.float32)
+        values = vigra.taggedView(values, 'zyx')
+
+        feature_names = ['standard_flatedge_count', 'standard_flatedge_mean', 'standard_flatedge_quantiles_100',
+                         'standard_flatedge_regionradii', 'standard_sp_mean']
+        features_df = rag_flat.compute_features(values, feature_names, edge_group='z')
+        blockwise_df = rag_flat.compute_features(values, feature_names, edge_group='z', blocksize=3)
+
+        assert list(blockwise_df.columns.values) == list(features_df.columns.values)
+        assert np.allclose(blockwise_df.values, features_df.values, rtol=1e-4)
+
 
 if __name__ == "__main__":
     import sys
@@ -2,10 +2,13 @@ import tempfile
 import shutil
 
 import numpy as np
+import pandas as pd
 import h5py
 
 from ilastikrag.rag import Rag
-from ilastikrag.util import label_vol_mapping, generate_random_voronoi, dataframe_to_hdf5, dataframe_from_hdf5
+from ilastikrag.util import label_vol_mapping, generate_random_voronoi, dataframe_to_hdf5, dataframe_from_hdf5, \
+                            dataframe_to_npy, dataframe_from_npy, connected_components, relabel, \
+                            contingency_table, sparse_contingency_table
 
 def test_label_vol_mapping():
     # 1 2
@@ -31,6 +34,79 @@ def test_label_vol_mapping():
 
     assert (label_vol_mapping(vol1, vol2) == [0,7,7,4,5]).all()
 
+def test_sparse_contingency_table():
+    vol1 = np.random.randint(0, 50, size=(30,40)).astype(np.uint32)
+    vol2 = np.random.randint(0, 20, size=(30,40)).astype(np.uint32)
+
+    dense_table = contingency_table(vol1, vol2)
+    for blocksize in (None, 7):
+        table = sparse_contingency_table(vol1, vol2, blocksize)
+        assert list(table.columns.values) == ['label1', 'label2', 'count']
+        assert (table['count'] > 0).all()
+        assert (dense_table[table['label1'].values, table['label2'].values] == table['count'].values).all()
+        assert table['count'].sum() == vol1.size
+
+        mapping = label_vol_mapping(vol1, vol2, blocksize)
+        assert (mapping == np.argmax(dense_table, axis=1)).all()
+
+    # Large label values are no problem
+    vol2 += 2**31
+    table = sparse_contingency_table(vol1, vol2, 7)
+    assert (dense_table[table['label1'].values, table['label2'].values - 2**31] == table['count'].values).all()
+
+def test_connected_components():
+    # 0   1-2-3   4-5
+    #       |
+    #       6
+    edge_ids = np.array([[5,4], [1,2], [3,2], [6,2]])
+    components = connected_components(edge_ids, 7)
+    assert (components == [0,1,1,1,4,4,1]).all()
+
+    # A long chain, in random order
+    edge_ids = np.transpose([np.arange(999), np.arange(1,1000)])
+    edge_ids = edge_ids[np.random.permutation(len(edge_ids))]
+    assert (connected_components(edge_ids, 1000) == 0).all()
+
+    # No edges
+    assert (connected_components(np.zeros((0,2), dtype=np.uint32), 3) == [0,1,2]).all()
+
+def test_relabel():
+    superpixels = generate_random_voronoi((100,200), 200)
+    mapping = np.random.randint(0, 10, size=(superpixels.max()+1,)).astype(np.uint32)
+
+    relabeled = relabel(superpixels, mapping, num_threads=4)
+    assert relabeled.axistags == superpixels.axistags
+    assert (relabeled == mapping[superpixels]).all()
+
+    out = np.zeros(superpixels.shape, dtype=np.uint8)
+    relabel(superpixels, mapping, out=out)
+    assert (out == mapping[superpixels]).all()
+
+    # Labels beyond the end of the mapping are an error (not clipped to the last entry)
+    for num_threads in (1, 4):
+        try:
+            relabel(superpixels, mapping[:-1], num_threads=num_threads)
+        except AssertionError:
+            pass
+        else:
+            assert False, "Expected an error for labels that aren't in the mapping."
+
+def test_generate_random_voronoi():
+    superpixels = generate_random_voronoi((100,200), 200, seed=1)
+    assert (superpixels == generate_random_voronoi((100,200), 200, seed=1)).all()
+    assert superpixels.max() == 200
+
+    # Rough boundaries have more pixel edges
+    rough_superpixels = generate_random_voronoi((100,200), 200, edge_roughness=10.0, seed=1)
+    num_edge_pixels = np.count_nonzero(superpixels[1:] != superpixels[:-1])
+    assert np.count_nonzero(rough_superpixels[1:] != rough_superpixels[:-1]) > num_edge_pixels
+
+    flat_superpixels = generate_random_voronoi((10,100,200), 200, flat_superpixels=True, seed=1)
+    assert flat_superpixels.axistags.keys() == list('zyx')
+    for z in range(10):
+        slice_ids = np.unique(flat_superpixels[z])
+        assert slice_ids.min() == z*200+1 and slice_ids.max() == (z+1)*200
+
 def test_features_df_serialization():
     superpixels = generate_random_voronoi((100,200), 200)
     rag = Rag( superpixels )
@@ -58,6 +134,119 @@ def test_features_df_serialization():
     finally:
         shutil.rmtree(tmpdir)
 
+def test_dataframe_legacy_format():
+    """
+    Tables that were written in the original (untyped) format can still be read.
+    """
+    df = pd.DataFrame({ 'sp1': np.arange(10, dtype=np.uint32),
+                        'sp2': np.arange(10, dtype=np.uint32) + 1,
+                        'forwardness': np.arange(10) % 2 == 0 },
+                      columns=['sp1', 'sp2', 'forwardness'])
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        with h5py.File( tmpdir + '/' + 'test_dataframe.h5', 'w' ) as f:
+            group = f.create_group('test_dataframe')
+            group['row_index'] = df.index.values
+            group['column_index'] = repr(df.columns.values)
+            columns_group = group.create_group('columns')
+            for col_index, col_name in enumerate(df.columns.values):
+                columns_group['{:03}'.format(col_index)] = df[col_name].values
+
+        with h5py.File( tmpdir + '/' + 'test_dataframe.h5', 'r' ) as f:
+            readback_df = dataframe_from_hdf5( f['test_dataframe'] )
+
+        assert list(readback_df.columns.values) == list(df.columns.values)
+        assert (readback_df.dtypes.values == df.dtypes.values).all()
+        assert (readback_df.values == df.values).all()
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_dataframe_mmap():
+    """
+    Memory-mapped tables are not copied into memory when the DataFrame is constructed.
+    """
+    df = pd.DataFrame({ 'sp1': np.arange(100, dtype=np.uint32),
+                        'sp2': np.arange(100, dtype=np.uint32) + 1,
+                        'mean': np.random.random(100).astype(np.float32) },
+                      columns=['sp1', 'sp2', 'mean'])
+
+    def is_memory_mapped(values):
+        while values is not None:
+            if isinstance(values, np.memmap):
+                return True
+            values = getattr(values, 'base', None)
+        return False
+
+    def check_mmapped(readback_df):
+        assert list(readback_df.columns.values) == list(df.columns.values)
+        assert (readback_df.dtypes.values == df.dtypes.values).all()
+        assert (readback_df.values == df.values).all()
+        for col_name in df.columns.values:
+            assert is_memory_mapped(readback_df[col_name].values), \
+                "Column {} was copied".format( col_name )
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        h5_path = tmpdir + '/' + 'test_dataframe.h5'
+        with h5py.File( h5_path, 'w' ) as f:
+            dataframe_to_hdf5( f.create_group('test_dataframe'), df, compression=None )
+        with h5py.File( h5_path, 'r' ) as f:
+            readback_df = dataframe_from_hdf5( f['test_dataframe'], mmap=True )
+        check_mmapped(readback_df)
+
+        # Compressed columns can't be memory-mapped, so they're read as usual.
+        with h5py.File( h5_path, 'w' ) as f:
+            dataframe_to_hdf5( f.create_group('test_dataframe'), df )
+        with h5py.File( h5_path, 'r' ) as f:
+            readback_df = dataframe_from_hdf5( f['test_dataframe'], mmap=True )
+        assert (readback_df.values == df.values).all()
+        assert not is_memory_mapped(readback_df['mean'].values)
+
+        npy_dir = tmpdir + '/' + 'test_dataframe'
+        manifest = dataframe_to_npy( npy_dir, df )
+        readback_df = dataframe_from_npy( npy_dir, manifest, mmap=True )
+        check_mmapped(readback_df)
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_dataframe_from_blocks_fallback():
+    """
+    If the pandas internals can't be used, the DataFrame is still constructed (as a copy), with a warning.
+    """
+    import logging
+    import pandas.core.internals
+    from ilastikrag.util import _dataframe_from_blocks
+
+    class ListHandler(logging.Handler):
+        def __init__(self):
+            logging.Handler.__init__(self)
+            self.records = []
+        def emit(self, record):
+            self.records.append(record)
+
+    def changed_make_block(*args, **kwargs):
+        raise TypeError("make_block() got an unexpected keyword argument 'placement'")
+
+    blocks = [ (np.arange(6, dtype=np.uint32).reshape(2,3), [1, 0]),
+               (np.ones((1,3), dtype=np.float32), [2]) ]
+
+    handler = ListHandler()
+    logger = logging.getLogger('ilastikrag.util')
+    logger.addHandler(handler)
+    original_make_block = pandas.core.internals.make_block
+    pandas.core.internals.make_block = changed_make_block
+    try:
+        df = _dataframe_from_blocks(blocks, pd.Index(['a', 'b', 'c']), pd.RangeIndex(3))
+    finally:
+        pandas.core.internals.make_block = original_make_block
+        logger.removeHandler(handler)
+
+    assert list(df.columns) == ['a', 'b', 'c']
+    assert (df['a'].values == [3,4,5]).all() and (df['b'].values == [0,1,2]).all() and (df['c'].values == 1).all()
+    assert list(df.dtypes.values) == [np.uint32, np.uint32, np.float32]
+    assert [record.levelno for record in handler.records] == [logging.WARNING]
+
 if __name__ == "__main__":
     import sys
     import nose
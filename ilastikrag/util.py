@@ -1,34 +1,117 @@
+import os
+import re
+import ast
+import json
+from collections import OrderedDict, Mapping
+
 import numpy as np
-import pandas as pd
-import vigra
+
+from .lazy_import import lazy_import
+pd = lazy_import('pandas')
+vigra = lazy_import('vigra')
+
+import logging
+logger = logging.getLogger(__name__)
+
+def sparse_contingency_table(vol1, vol2, blocksize=None):
+    """
+    Count the overlapping pixels of each pair of labels ``(i, j)`` that actually occur together
+    in ``vol1`` and ``vol2``, without allocating a dense table of all possible pairs.
+
+    Each pair of labels is packed into a single ``uint64`` and the pairs are counted
+    via a sort-unique pass.  If ``blocksize`` is given, the volumes are read (and counted)
+    in blocks of that many slices along the first axis, so they may be larger than RAM
+    (e.g. ``h5py.Dataset`` or ``numpy.memmap``).  The labels must be less than ``2**32``.
+
+    Returns
+    -------
+    *pandas.DataFrame* with columns ``['label1', 'label2', 'count']``, sorted by ``('label1', 'label2')``.
+    """
+    assert tuple(vol1.shape) == tuple(vol2.shape), \
+        "Volumes must have the same shape: {} != {}".format( vol1.shape, vol2.shape )
+
+    if blocksize is None:
+        blocksize = max(1, vol1.shape[0])
+
+    packed_pairs = np.zeros( (0,), dtype=np.uint64 )
+    counts = np.zeros( (0,), dtype=np.uint64 )
+    for block_start in range(0, vol1.shape[0], blocksize):
+        block1 = np.asarray(vol1[block_start:block_start+blocksize]).reshape(-1)
+        block2 = np.asarray(vol2[block_start:block_start+blocksize]).reshape(-1)
+        for block in (block1, block2):
+            assert block.dtype.itemsize <= 4 or block.max() < 2**32, "Labels must be less than 2**32"
+
+        block_pairs = (block1.astype(np.uint64) << np.uint64(32)) | block2.astype(np.uint64)
+        block_pairs, block_counts = np.unique(block_pairs, return_counts=True)
+
+        # Merge with the previous blocks
+        if len(packed_pairs):
+            block_pairs = np.concatenate((packed_pairs, block_pairs))
+            block_counts = np.concatenate((counts, block_counts))
+            block_pairs, inverse = np.unique(block_pairs, return_inverse=True)
+            block_counts = np.bincount(inverse, block_counts, minlength=len(block_pairs))
+        packed_pairs = block_pairs
+        counts = block_counts.astype(np.uint64)
+
+    table = pd.DataFrame({ 'label1': (packed_pairs >> np.uint64(32)).astype(np.uint32),
+                           'label2': (packed_pairs & np.uint64(0xFFFFFFFF)).astype(np.uint32),
+                           'count': counts },
+                         columns=['label1', 'label2', 'count'])
+    return table
 
 def contingency_table(vol1, vol2, maxlabels=None):
     """
     Return a 2D array 'table' such that ``table[i,j]`` represents
     the count of overlapping pixels with value ``i`` in ``vol1``
     and value ``j`` in ``vol2``. 
+
+    Note: The table is dense, so it needs ``(max1+1)*(max2+1)`` entries.
+    For large label values, use :py:func:`sparse_contingency_table()` instead.
     """
     maxlabels = maxlabels or (vol1.max(), vol2.max())
     table = np.zeros( (maxlabels[0]+1, maxlabels[1]+1), dtype=np.uint32 )
     
-    # np.add.at() will accumulate counts at the given array coordinates
-    np.add.at(table, [vol1.reshape(-1), vol2.reshape(-1)], 1 )
+    sparse_table = sparse_contingency_table(vol1, vol2)
+    table[sparse_table['label1'].values, sparse_table['label2'].values] = sparse_table['count'].values
     return table
 
-def label_vol_mapping(vol_from, vol_to):
+def label_vol_mapping(vol_from, vol_to, blocksize=None):
     """
     Determine how remap voxel IDs in ``vol_from`` into corresponding
     IDs in ``vol_to``, according to maxiumum overlap.
     (Note that this is not a commutative operation.)
+
+    Computed from the :py:func:`sparse_contingency_table()` of the two volumes
+    (with the given ``blocksize``, if any).
     
     Returns
     -------
     A 1D index array such that ``mapping[i] = j``, where ``i``
     is a voxel ID in ``vol_from``, and ``j`` is the corresponding
     ID in ``vol_to``.
+    (In case of a tie, the smallest ``j`` is chosen.)
+    """
+    table = sparse_contingency_table(vol_from, vol_to, blocksize)
+    return mapping_from_contingency_table(table)
+
+def mapping_from_contingency_table(table):
     """
-    table = contingency_table(vol_from, vol_to)
-    mapping = np.argmax(table, axis=1)
+    Given a :py:func:`sparse_contingency_table()`, return the ``label2`` with maximum overlap
+    for each ``label1``, as a 1D index array (see :py:func:`label_vol_mapping()`).
+    """
+    label1 = table['label1'].values
+    label2 = table['label2'].values
+    counts = table['count'].values
+
+    # Sort by label1, then by descending count (then by label2, to break ties)
+    # and take the first row for each label1.
+    order = np.lexsort((label2, -counts.astype(np.int64), label1))
+    sorted_label1 = label1[order]
+    first_rows = np.ones( (len(order),), dtype=bool )
+    first_rows[1:] = (sorted_label1[1:] != sorted_label1[:-1])
+
+    mapping = np.zeros( (label1.max()+1 if len(label1) else 0,), dtype=label2.dtype )
+    mapping[sorted_label1[first_rows]] = label2[order][first_rows]
     return mapping
 
 def edge_mask_for_axis( label_img, axis ):
@@ -188,6 +271,135 @@ def get_edge_ids( label_img ):
     final_edge_label_lookup_df = unique_edge_labels( all_edge_ids )
     return final_edge_label_lookup_df
 
+def connected_components(edge_ids, num_nodes):
+    """
+    Find the connected components of an undirected graph with nodes ``0..num_nodes-1``
+    and the given edges, via vectorized union-find (alternating 'hooking' and 'pointer-jumping' steps).
+
+    Returns
+    -------
+    A 1D index array such that ``components[i]`` is the smallest node id in the component of node ``i``.
+    """
+    components = np.arange(num_nodes, dtype=np.uint32)
+    edge_ids = np.asarray(edge_ids).reshape(-1, 2)
+    while True:
+        roots_1 = components[edge_ids[:,0]]
+        roots_2 = components[edge_ids[:,1]]
+        unmerged = (roots_1 != roots_2)
+        if not unmerged.any():
+            return components
+
+        # Only the edges between different trees are needed from now on
+        edge_ids = edge_ids[unmerged]
+        roots_1 = roots_1[unmerged]
+        roots_2 = roots_2[unmerged]
+
+        # Hook each root onto the smallest root it is connected to.
+        # (Roots only ever point to smaller ids, so no cycles can arise.)
+        smaller_roots = np.minimum(roots_1, roots_2)
+        larger_roots = np.maximum(roots_1, roots_2)
+        hooks = pd.Series(smaller_roots).groupby(larger_roots).min()
+        components[hooks.index.values] = np.minimum(components[hooks.index.values], hooks.values)
+
+        # Point every node directly at its root
+        while True:
+            grandparents = components[components]
+            if (grandparents == components).all():
+                break
+            components = grandparents
+
+def relabel(label_img, mapping, out=None, num_threads=None):
+    """
+    Relabel ``label_img`` via a dense lookup table, i.e. ``out[...] = mapping[label_img]``.
+    The image is processed in slabs along the first axis, in parallel (``numpy.take()`` releases the GIL).
+    Much faster than ``vigra.analysis.applyMapping()`` with a dict.
+
+    Parameters
+    ----------
+    label_img
+        *ndarray* of non-negative integer labels.
+
+    mapping
+        1D *ndarray*, indexed by label (must include ``label_img.max()``, or an ``AssertionError`` is raised).
+
+    out
+        *ndarray* (Optional).  Same shape as ``label_img``.
+        By default, a new array with the same dtype as ``mapping`` is allocated
+        (with the same axistags as ``label_img``, if any).
+
+    num_threads
+        *int* (Optional).  By default, one per CPU.
+    """
+    from multiprocessing import cpu_count
+    from multiprocessing.pool import ThreadPool
+
+    if out is None:
+        out = np.empty( label_img.shape, dtype=mapping.dtype )
+        if hasattr(label_img, 'axistags'):
+            out = vigra.taggedView(out, label_img.axistags)
+    assert out.shape == label_img.shape, "out has the wrong shape: {}".format( out.shape )
+    mapping = np.asarray(mapping).astype(out.dtype, copy=False)
+
+    num_threads = num_threads or cpu_count()
+    num_slices = label_img.shape[0] if label_img.ndim > 0 else 1
+    slab_size = max(1, (num_slices + num_threads - 1) // num_threads)
+
+    def take(labels, out):
+        # mode='clip' avoids a temporary buffer, but then we must check the label range ourselves.
+        labels = np.asarray(labels)
+        assert labels.size == 0 or labels.max() < len(mapping), \
+            "mapping has {} entries, but label_img contains label {}".format( len(mapping), labels.max() )
+        np.take(mapping, labels, out=np.asarray(out), mode='clip')
+
+    def relabel_slab(slab_start):
+        slab = np.s_[slab_start:slab_start+slab_size]
+        take(label_img[slab], out[slab])
+
+    if num_threads == 1 or num_slices <= slab_size or label_img.ndim == 0:
+        take(label_img, out)
+    else:
+        pool = ThreadPool(num_threads)
+        try:
+            pool.map(relabel_slab, range(0, num_slices, slab_size))
+        finally:
+            pool.close()
+    return out
+
+def value_fingerprint(value_img, blocksize=None):
+    """
+    Return a hash (hex string) of the given image's shape, dtype, axis order, and contents,
+    e.g. to identify the value image that features were computed from
+    (see :py:class:`~ilastikrag.feature_store.FeatureStore`).
+
+    Parameters
+    ----------
+    value_img
+        *ndarray* (or ``h5py.Dataset``, which is read blockwise), or ``None``
+        (for features computed from the labels alone).
+
+    blocksize
+        *int* (Optional).  Read the image in blocks of this many slices (along the first axis).
+    """
+    import hashlib
+
+    if value_img is None:
+        return 'no_values'
+
+    sha = hashlib.sha1()
+    sha.update( json.dumps([ list(value_img.shape),
+                             np.dtype(value_img.dtype).str,
+                             list(value_img.axistags.keys()) if hasattr(value_img, 'axistags') else None ]) )
+
+    if value_img.ndim == 0:
+        sha.update( np.ascontiguousarray(value_img[()]).data )
+        return sha.hexdigest()
+
+    blocksize = blocksize or len(value_img)
+    for block_start in range(0, len(value_img), blocksize):
+        block = np.asarray(value_img[block_start:block_start+blocksize])
+        sha.update( np.ascontiguousarray(block).data )
+    return sha.hexdigest()
+
 def nonzero_coord_array(a):
     """
     Equivalent to ``np.transpose(a.nonzero())``, but much
@@ -205,19 +417,55 @@ def nonzero_coord_array(a):
         base_array = base_array.base
     return base_array
     
-def generate_random_voronoi(shape, num_sp):
+def generate_random_voronoi(shape, num_sp, flat_superpixels=False, edge_roughness=0.0, seed=None):
     """
     Generate a superpixel image for testing.
     A set of N seed points (N=``num_sp``) will be chosen randomly, and the superpixels
     will just be a voronoi diagram for those seeds.
     Note: The first superpixel ID is 1.
+
+    Parameters
+    ----------
+    shape
+        *tuple* -- 2D or 3D
+
+    num_sp
+        *int* -- The number of superpixels (per slice, if ``flat_superpixels=True``).
+
+    flat_superpixels
+        *bool* (Optional) -- Generate a separate 2D voronoi diagram for each ``z``-slice of a 3D volume,
+        with distinct superpixel IDs in each slice (as for ``Rag(..., flat_superpixels=True)``).
+
+    edge_roughness
+        *float* (Optional) -- Grow the superpixels over a random elevation map of this amplitude,
+        instead of a flat one.  Rougher boundaries have more pixel edges per superpixel edge,
+        i.e. larger ``dense_edge_tables``, for the same number of superpixels. |br|
+        (Try values between ``0.0`` (straight boundaries) and ``10.0``.)
+
+    seed
+        *int* or ``numpy.random.RandomState`` (Optional) -- For reproducible results.
+        By default, the global ``numpy.random`` state is used.
     """
     assert len(shape) in (2,3), "Only 2D and 3D supported."
-    
+    if seed is None:
+        random = np.random
+    elif isinstance(seed, np.random.RandomState):
+        random = seed
+    else:
+        random = np.random.RandomState(seed)
+
+    if flat_superpixels:
+        assert len(shape) == 3, "Flat superpixels must be 3D"
+        superpixels = np.zeros( shape, dtype=np.uint32 )
+        for z in range(shape[0]):
+            slice_superpixels = generate_random_voronoi(shape[1:], num_sp, edge_roughness=edge_roughness, seed=random)
+            superpixels[z] = slice_superpixels + z*num_sp
+        return vigra.taggedView(superpixels, 'zyx')
+
     seed_coords = []
     for dim in shape:
         # Generate more than we need, so we can toss duplicates
-        seed_coords.append( np.random.randint( dim, size=(2*num_sp,) ) )
+        seed_coords.append( random.randint( dim, size=(2*num_sp,) ) )
 
     seed_coords = np.transpose(seed_coords)
     seed_coords = list(set(map(tuple, seed_coords))) # toss duplicates
@@ -226,8 +474,13 @@ def generate_random_voronoi(shape, num_sp):
 
     superpixels = np.zeros( shape, dtype=np.uint32 )
     superpixels[seed_coords] = np.arange( num_sp )+1
-    
-    vigra.analysis.watersheds( np.zeros(shape, dtype=np.float32),
+
+    if edge_roughness:
+        elevation = (edge_roughness * random.random_sample(shape)).astype(np.float32)
+    else:
+        elevation = np.zeros(shape, dtype=np.float32)
+
+    vigra.analysis.watersheds( elevation,
                                seeds=superpixels,
                                out=superpixels )
     superpixels = vigra.taggedView(superpixels, 'zyx'[3-len(shape):])        
@@ -242,29 +495,117 @@ def colorize_labels(label_img):
         colorized[...,c] = random_colors[...,c][label_img]
     return colorized
 
-def dataframe_to_hdf5(h5py_group, df):
+class LazyDict(Mapping):
+    """
+    A read-only, ordered mapping whose values are only computed (or loaded) when they are first accessed.
+    Each value is produced by calling the loader function that was given for its key.
+
+    Example
+    -------
+    ::
+
+       >>> tables = LazyDict([ ('y', lambda: dataframe_from_hdf5(group['y'])),
+       ...                     ('x', lambda: dataframe_from_hdf5(group['x'])) ])
+       >>> tables.keys()     # Nothing loaded yet
+       ['y', 'x']
+       >>> tables['x']       # Loads the 'x' table
+    """
+    def __init__(self, loaders):
+        """
+        Parameters
+        ----------
+        loaders
+            *OrderedDict* (or list of pairs) of ``key : loader``,
+            where ``loader()`` returns the value for ``key``.
+        """
+        self._loaders = OrderedDict(loaders)
+        self._values = {}
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            value = self._values[key] = self._loaders[key]()
+            return value
+
+    def __iter__(self):
+        return iter(self._loaders)
+
+    def __len__(self):
+        return len(self._loaders)
+
+    def __contains__(self, key):
+        return key in self._loaders
+
+    def is_loaded(self, key):
+        """
+        Return True if the value for the given key has already been loaded.
+        """
+        return key in self._values
+
+#: The version of the on-disk format written by :py:func:`dataframe_to_hdf5()`.
+#: (Groups without a ``format_version`` attribute were written in the original, untyped format.)
+DATAFRAME_FORMAT_VERSION = 2
+
+#: Number of rows per chunk in the compressed column datasets.
+DATAFRAME_CHUNK_ROWS = 2**16
+
+def dataframe_to_hdf5(h5py_group, df, compression='lzf', compression_opts=None, chunk_rows=DATAFRAME_CHUNK_ROWS):
     """
     Helper function to serialize a pandas.DataFrame to an h5py.Group.
 
     Note: This function uses a custom storage format,
           not the same format as pandas.DataFrame.to_hdf().
 
-    Known to work for the DataFrames used in the Rag datastructure,
-    including the MultiIndex columns in the dense_edge_tables.
-    Not tested with more complicated DataFrame structures. 
+    Each column is stored as a separate (typed) dataset, chunked along the rows and compressed,
+    and the column names and dtypes are stored as a JSON schema in the group's attributes,
+    along with a ``format_version``.  The row index is only stored if it isn't simply ``0..N-1``.
+
+    If ``compression=None``, the columns are stored contiguously (not chunked),
+    so they can be memory-mapped when they are read (see :py:func:`dataframe_from_hdf5()`).
+
+    Known to work for the DataFrames used in the Rag datastructure.
+    Columns must have a numeric (or bool) dtype.
     """
-    h5py_group['row_index'] = df.index.values
-    h5py_group['column_index'] = repr(df.columns.values)
-    
     # The deserialization function below requires this.
     assert len(set(df.columns.values)) == len(df.columns.values), \
         "DataFrame column names must be unique to be serialized!"
-    
+
+    schema = []
     columns_group = h5py_group.create_group('columns')
-    for col_index, _col_name in enumerate(df.columns.values):
-        columns_group['{:03}'.format(col_index)] = df.iloc[:, col_index].values
+    for col_index, col_name in enumerate(df.columns.values):
+        values = df.iloc[:, col_index].values
+        assert values.dtype != object, \
+            "Can't serialize column {} with dtype object".format( col_name )
+        if isinstance(col_name, tuple):
+            col_name = list(col_name)
+        schema.append( [col_name, values.dtype.str] )
+        _create_column_dataset( columns_group, '{:03}'.format(col_index), values,
+                                compression, compression_opts, chunk_rows )
+
+    if (df.index.values == np.arange(len(df))).all():
+        h5py_group.attrs['row_index'] = 'range'
+    else:
+        h5py_group.attrs['row_index'] = 'stored'
+        _create_column_dataset( h5py_group, 'row_index', df.index.values,
+                                compression, compression_opts, chunk_rows )
+
+    h5py_group.attrs['schema'] = json.dumps(schema)
+    h5py_group.attrs['format_version'] = DATAFRAME_FORMAT_VERSION
 
-def dataframe_from_hdf5(h5py_group):
+def _create_column_dataset(parent_group, name, values, compression, compression_opts, chunk_rows):
+    """
+    Store the given 1D array as a chunked, compressed dataset,
+    or as a contiguous dataset if compression is None (or the array is empty).
+    """
+    if compression is None or len(values) == 0:
+        return parent_group.create_dataset(name, data=values)
+    return parent_group.create_dataset( name, data=values,
+                                        chunks=(min(len(values), chunk_rows),),
+                                        compression=compression,
+                                        compression_opts=compression_opts )
+
+def dataframe_from_hdf5(h5py_group, columns=None, mmap=False):
     """
     Helper function to deserialize a pandas.DataFrame from an h5py.Group,
     as written by ``dataframe_to_hdf5()``.
@@ -272,28 +613,141 @@ def dataframe_from_hdf5(h5py_group):
     Note: This function uses a custom storage format,
           not the same format as pandas.read_hdf().
 
-    Known to work for the DataFrames used in the Rag datastructure,
-    including the MultiIndex columns in the dense_edge_tables.
-    Not tested with more complicated DataFrame structures. 
+    Parameters
+    ----------
+    h5py_group
+        *h5py.Group*
+
+    columns
+        *list* of column names (Optional) -- Read only these columns.
+
+    mmap
+        *bool* (Optional) -- Memory-map the columns that were stored without compression,
+        instead of reading them.  (Compressed columns are read as usual.) |br|
+        The DataFrame's columns are then read-only views of the memory maps, not copies.
+        The memory maps refer to the file by name, so the hdf5 file may be closed,
+        but it must not be modified or deleted while the DataFrame is in use.
     """
-    from numpy import array # We use eval() for the column index, which uses 'array'
-    array # Avoid linter usage errors
-    row_index_values = h5py_group['row_index'][:]
-    column_index_names = list(eval(h5py_group['column_index'][()]))
-    if isinstance(column_index_names[0], np.ndarray):
+    if 'format_version' not in h5py_group.attrs:
+        assert columns is None, "Can't select columns from a table in the original format."
+        return _dataframe_from_hdf5_v1(h5py_group)
+
+    format_version = h5py_group.attrs['format_version']
+    assert format_version <= DATAFRAME_FORMAT_VERSION, \
+        "Table was written by a newer version of ilastikrag (format version {})".format( format_version )
+
+    column_names = []
+    dtypes = []
+    for col_name, dtype in json.loads(h5py_group.attrs['schema']):
+        if isinstance(col_name, list):
+            column_names.append( tuple(map(str, col_name)) )
+        else:
+            column_names.append( str(col_name) )
+        dtypes.append( np.dtype(str(dtype)) )
+
+    if columns is None:
+        columns = column_names
+
+    columns_group = h5py_group['columns']
+    blocks = []
+    for position, col_name in enumerate(columns):
+        col_index = column_names.index(col_name)
+        values = _read_column_dataset(columns_group['{:03}'.format(col_index)], mmap)
+        assert values.dtype == dtypes[col_index]
+        # One block per column, so no column is copied into a shared block.
+        blocks.append( (values[np.newaxis], [position]) )
+
+    if h5py_group.attrs['row_index'] == 'stored':
+        row_index = pd.Index(_read_column_dataset(h5py_group['row_index'], mmap))
+    else:
+        num_rows = len(columns_group['000']) if column_names else 0
+        row_index = _range_index(num_rows)
+
+    if column_names and isinstance(column_names[0], tuple):
+        column_index = pd.MultiIndex.from_tuples(columns)
+    else:
+        column_index = pd.Index(columns)
+    return _dataframe_from_blocks(blocks, column_index, row_index)
+
+def _range_index(num_rows):
+    if hasattr(pd, 'RangeIndex'):
+        return pd.RangeIndex(num_rows)
+    return pd.Index(np.arange(num_rows))
+
+def _dataframe_from_blocks(blocks, column_index, row_index):
+    """
+    Construct a DataFrame whose internal blocks are the given arrays, without copying them
+    (e.g. to keep memory-mapped columns memory-mapped).
+
+    The public DataFrame constructors copy (consolidate) all columns of the same dtype into one block,
+    so this uses the (private) pandas BlockManager API.  If that API isn't available
+    (or its signatures have changed), a warning is logged, and the DataFrame is constructed
+    via the public API instead, which copies the values.
+
+    Parameters
+    ----------
+    blocks
+        *list* of ``(values, positions)``, where ``values`` is a 2D array with one row per column,
+        and ``positions`` lists the positions of those columns in ``column_index``.
+
+    column_index, row_index
+        *pandas.Index*
+    """
+    try:
+        from pandas.core.internals import BlockManager, make_block
+        manager_blocks = [ make_block(values, placement=positions) for values, positions in blocks ]
+        manager = BlockManager(manager_blocks, [column_index, row_index])
+    except (ImportError, TypeError) as ex:
+        # The private API is missing, or its signatures have changed.
+        logger.warning("Can't construct the DataFrame without copying its columns "
+                       "(pandas {} internals not supported: {}).  Reading them into memory instead."
+                       .format( pd.__version__, ex ))
+    else:
+        # Otherwise, pandas would merge blocks of the same dtype (copying them) on first use, e.g. in df.values.
+        manager._is_consolidated = True
+        manager._known_consolidated = True
+        return pd.DataFrame(manager)
+
+    data = OrderedDict()
+    for values, positions in blocks:
+        for row, position in enumerate(positions):
+            data[position] = values[row]
+    df = pd.DataFrame(data, index=row_index, columns=range(len(column_index)))
+    df.columns = column_index
+    return df
+
+def _read_column_dataset(dset, mmap=False):
+    """
+    Read the given 1D dataset, or memory-map it (read-only) if possible.
+    """
+    if mmap and dset.chunks is None and dset.compression is None and len(dset) > 0:
+        offset = dset.id.get_offset()
+        if offset is not None:
+            return np.memmap(dset.file.filename, mode='r', dtype=dset.dtype, shape=dset.shape, offset=offset)
+    return dset[:]
+
+def _dataframe_from_hdf5_v1(h5py_group):
+    """
+    Deserialize a DataFrame that was written in the original (untyped) format,
+    which stored the column index as a ``repr()`` string.
+    """
+    column_index_repr = h5py_group['column_index'][()]
+    column_index_names = _parse_column_index_repr(column_index_repr)
+    if isinstance(column_index_names[0], (tuple, list)):
         column_index_names = map(tuple, column_index_names)
         column_index = pd.MultiIndex.from_tuples(column_index_names)
     elif isinstance(column_index_names[0], str):
         column_index = column_index_names
     else:
         raise NotImplementedError("I don't know how to handle that type of column index.: {}"
-                                  .format(h5py_group['column_index'][()]))
+                                  .format(column_index_repr))
 
     # This assertion required due to our use of the dict syntax below.
     # We could probably change this requirement if it's a problem...
     assert len(set(column_index)) == len(column_index), \
         "DataFrame column names must be unique to be deserialized!"
-    
+
+    row_index_values = h5py_group['row_index'][:]
     columns_group = h5py_group['columns']
     col_values = []
     for _name, col_values_dset in sorted(columns_group.items()):
@@ -303,3 +757,86 @@ def dataframe_from_hdf5(h5py_group):
                          columns=column_index,
                          data={ name: values for name,values in zip(column_index_names, col_values) } )
 
+def _parse_column_index_repr(column_index_repr):
+    """
+    Parse the ``repr()`` of a numpy array of column names, e.g. ``"array(['sp1', 'sp2'], dtype=object)"``,
+    without calling ``eval()``.
+    """
+    match = re.match(r'^\s*array\((.*?)(,\s*dtype=[^)]*)?\)\s*$', column_index_repr, re.DOTALL)
+    assert match, "Can't parse column index: {}".format( column_index_repr )
+    return list(ast.literal_eval(match.group(1)))
+
+def dataframe_to_npy(dirpath, df):
+    """
+    Save a pandas.DataFrame to the given directory as raw ``.npy`` files,
+    which can be loaded (and memory-mapped) very quickly via :py:func:`dataframe_from_npy()`.
+
+    The columns are saved in one file per dtype, as a 2D array with one row per column.
+    That way, each file can be used directly as one of the DataFrame's internal blocks when it is loaded,
+    without copying it.
+
+    Returns
+    -------
+    *dict*
+        The table's manifest (JSON-serializable), which must be passed to :py:func:`dataframe_from_npy()`.
+    """
+    assert len(set(df.columns.values)) == len(df.columns.values), \
+        "DataFrame column names must be unique to be serialized!"
+    if not os.path.exists(dirpath):
+        os.makedirs(dirpath)
+
+    # Group the columns by dtype
+    columns_by_dtype = OrderedDict()
+    for col_name, dtype in zip(df.columns.values, df.dtypes.values):
+        assert dtype != object, \
+            "Can't serialize column {} with dtype object".format( col_name )
+        columns_by_dtype.setdefault(dtype, []).append(col_name)
+
+    blocks = []
+    for block_index, (dtype, col_names) in enumerate(columns_by_dtype.items()):
+        filename = 'block_{:03}.npy'.format(block_index)
+        block_values = np.empty( (len(col_names), len(df)), dtype=dtype )
+        for row, col_name in enumerate(col_names):
+            block_values[row] = df[col_name].values
+        np.save(os.path.join(dirpath, filename), block_values)
+        blocks.append( { 'file': filename, 'columns': map(str, col_names) } )
+
+    manifest = { 'num_rows': len(df),
+                 'columns': map(str, df.columns.values),
+                 'blocks': blocks,
+                 'row_index': None }
+    if not (df.index.values == np.arange(len(df))).all():
+        manifest['row_index'] = 'row_index.npy'
+        np.save(os.path.join(dirpath, 'row_index.npy'), df.index.values)
+    return manifest
+
+def dataframe_from_npy(dirpath, manifest, mmap=True):
+    """
+    Load a pandas.DataFrame that was saved via :py:func:`dataframe_to_npy()`.
+
+    Parameters
+    ----------
+    dirpath
+        The directory the DataFrame was saved to.
+
+    manifest
+        *dict*, as returned by :py:func:`dataframe_to_npy()`
+
+    mmap
+        *bool* -- If True, the columns of the DataFrame are read-only memory maps of the ``.npy`` files.
+    """
+    num_rows = manifest['num_rows']
+    mmap_mode = 'r' if (mmap and num_rows > 0) else None
+    columns = map(str, manifest['columns'])
+
+    if manifest['row_index']:
+        row_index = pd.Index(np.load(os.path.join(dirpath, manifest['row_index']), mmap_mode=mmap_mode))
+    else:
+        row_index = _range_index(num_rows)
+
+    # Each file becomes one of the DataFrame's blocks.
+    blocks = []
+    for block in manifest['blocks']:
+        values = np.load(os.path.join(dirpath, block['file']), mmap_mode=mmap_mode)
+        blocks.append( (values, map(columns.index, map(str, block['columns']))) )
+    return _dataframe_from_blocks(blocks, pd.Index(columns), row_index)
@@ -10,5 +10,5 @@ setup(name='ilastikrag',
       url='github.com/stuarteberg/ilastikrag',
       packages=find_packages()
       ## see conda-recipe/meta.yaml for dependency information
-      ##install_requires=['numpy', 'h5py', 'pandas', 'vigra', 'networkx']
+      ##install_requires=['numpy', 'h5py', 'pandas', 'vigra']
      )